@@ -10,6 +10,41 @@ static char  commandline[BUFLEN];
 static char* nextchar = commandline;
 static bool  commandavailable = false;
 static bool  discardinput = false;
+static bool  readingframe = false;
+
+uint8_t crc8( uint8_t crc, const uint8_t* data, uint8_t length )
+{
+    while (length--) {
+	crc ^= *data++;
+	for (int i = 0; i < 8; i++) {
+	    crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+	}
+    }
+    return crc;
+}
+
+// Add the next character of a binary frame
+// Returns true when a complete frame with a good CRC has been read.
+static bool readframe( char c )
+{
+    *nextchar++ = c;
+    uint8_t* frame  = (uint8_t*)commandline;
+    int      n      = nextchar - commandline;
+    uint8_t  length = frame[1];
+    if (n == 2 && (length == 0 || length > FRAME_MAXLENGTH)) {
+	Serial.println( F("ReadCommand_serial(): Bad frame length - discarding frame") );
+	nextchar = commandline;
+	readingframe = false;
+    } else if (n > 2 && n == length + 3) {
+	nextchar = commandline;
+	readingframe = false;
+	if (crc8( 0, frame + 1, length + 1 ) == frame[length + 2]) {
+	    return true;
+	}
+	Serial.println( F("ReadCommand_serial(): Bad frame CRC - discarding frame") );
+    }
+    return false;
+}
 
 char* ReadCommand_serial()
 {
@@ -18,7 +53,15 @@ char* ReadCommand_serial()
     while (Serial.available()) {
 	// digitalWrite( 13, HIGH ); // Flash the LED
 	c = Serial.read();          // Read the next character
-	if (c != '\n') {            // If this is not the end of the line...
+	if (readingframe) {         // If this is part of a binary frame...
+	    if (readframe( c )) {
+		return commandline; // Return the frame
+	    }
+	} else if ((uint8_t)c == FRAME_SYNC && nextchar == commandline &&
+		   !discardinput) { // If this starts a binary frame...
+	    *nextchar++ = c;
+	    readingframe = true;
+	} else if (c != '\n') {     // If this is not the end of the line...
 	    if (discardinput) {
 		continue;
 	    }
@@ -42,6 +85,15 @@ char* ReadCommand_serial()
     return NULL;
 }
 
+void WriteFrame_serial( uint8_t type, const uint8_t* payload, uint8_t length )
+{
+    uint8_t header[3] = { FRAME_SYNC, (uint8_t)(length + 1), type };
+    uint8_t crc = crc8( crc8( 0, header + 1, 2 ), payload, length );
+    Serial.write( header, 3 );
+    Serial.write( payload, length );
+    Serial.write( crc );
+}
+
 void SetupComms_serial( )
 {
     // Flush any incoming data in the serial port
@@ -3,11 +3,33 @@
 #ifndef COMMS_SERIAL_H
 #define COMMS_SERIAL_H
 
+#include <stdint.h>
+
+// The binary frame protocol (see rpi/arduinocomms.py):
+//     SYNC LENGTH TYPE PAYLOAD... CRC
+// LENGTH is the number of bytes of TYPE and PAYLOAD and CRC is the CRC-8
+// (polynomial 0x07) of LENGTH, TYPE and PAYLOAD. Payload fields are fixed
+// width and little-endian.
+#define FRAME_SYNC       0xA5
+#define FRAME_MAXLENGTH  80
+#define FRAME_HELLO      0x01	// Switch to binary (Pi) / acknowledge (Arduino)
+#define FRAME_TRACK      0x10	// int16 x, y
+#define FRAME_HEAD       0x11	// float x, y
+#define FRAME_SETSPEED   0x12	// float left, right
+#define FRAME_POWER      0x13	// float left, right
+#define FRAME_PID        0x14	// float Kp, Ki, Kd
+#define FRAME_STATE      0x20	// uint32 ms, uint8 flags, fields...
+#define PROTOCOL_VERSION 1
+
 void SetupComms_serial( );
+// Returns a text command line, or a binary frame: FRAME_SYNC, LENGTH, TYPE,
+// PAYLOAD... (the CRC has been checked), or NULL if nothing is ready.
 char *ReadCommand_serial();
+void WriteFrame_serial( uint8_t type, const uint8_t* payload, uint8_t length );
+uint8_t crc8( uint8_t crc, const uint8_t* data, uint8_t length );
 
 #endif //COMMS_SERIAL_H
 
 // Local Variables:
 // c-basic-offset: 4
-// End: 
+// End:
@@ -8,6 +8,7 @@
 
 #include "Robot.h"
 #include "Setup.h"
+#include "Comms-serial.h"
 
 Robot::Robot( Wheel&       leftwheel,
 	      Wheel&       rightwheel,
@@ -17,7 +18,8 @@ Robot::Robot( Wheel&       leftwheel,
 	      m_rightwheel ( rightwheel ),
 	      m_head       ( head ),
 	      m_state      ( ),
-	      m_updated    ( false )
+	      m_updated    ( false ),
+	      m_binary     ( false )
 {
 }
 
@@ -153,6 +155,8 @@ bool Robot::robotcommand( char* line )
     
     if (line[0] == '{') {
 	updated = processjson( line );
+    } else if ((uint8_t)line[0] == FRAME_SYNC) {
+	updated = processframe( (const uint8_t*)line + 1 );
     } else {
 	Serial.print( "Unknown robot command: " ); Serial.println( line );
     }
@@ -264,8 +268,154 @@ bool Robot::processjson( const char *json )
     return true;
 }
 
+// Read and write the little-endian fixed width fields of binary frames
+// (the AVR is little-endian, so floats are copied as they are)
+static int16_t getint16( const uint8_t* p )
+{
+    return (int16_t)(p[0] | (p[1] << 8));
+}
+
+static float getfloat( const uint8_t* p )
+{
+    float f;
+    memcpy( &f, p, sizeof( f ) );
+    return f;
+}
+
+static uint8_t* putuint32( uint8_t* p, uint32_t n )
+{
+    for (int i = 0; i < 4; i++) {
+	*p++ = n & 0xFF;
+	n >>= 8;
+    }
+    return p;
+}
+
+static uint8_t* putfloat( uint8_t* p, float f )
+{
+    memcpy( p, &f, sizeof( f ) );
+    return p + sizeof( f );
+}
+
+// Process a binary frame (length, type, payload - see Comms-serial.h)
+bool Robot::processframe( const uint8_t* frame )
+{
+    uint8_t        type    = frame[1];
+    const uint8_t* payload = frame + 2;
+    uint8_t        length  = frame[0] - 1;
+    uint8_t        expected;
+
+    switch (type) {
+    case FRAME_HELLO:    expected = 1;  break;
+    case FRAME_TRACK:    expected = 4;  break;
+    case FRAME_PID:      expected = 12; break;
+    default:             expected = 8;  break;
+    }
+    if (length < expected) {
+	Serial.print( F("processframe() - short frame: ") );
+	Serial.println( type );
+	return false;
+    }
+
+    switch (type) {
+    case FRAME_HELLO: {
+	uint8_t version = PROTOCOL_VERSION;
+	m_binary = (payload[0] == PROTOCOL_VERSION);
+	WriteFrame_serial( FRAME_HELLO, &version, 1 );
+	return true;
+    }
+    case FRAME_TRACK:
+	dotrackingPID( getint16( payload ), getint16( payload + 2 ) );
+	return true;
+    case FRAME_HEAD:
+	look( getfloat( payload ), getfloat( payload + 4 ) );
+	m_state.head = true;
+	return true;
+    case FRAME_SETSPEED:
+	run( getfloat( payload ), getfloat( payload + 4 ) );
+	m_state.setspeed = true;
+	return true;
+    case FRAME_POWER:
+	setpower( getfloat( payload ), getfloat( payload + 4 ) );
+	m_state.power = true;
+	return true;
+    case FRAME_PID: {
+	double Kp = getfloat( payload );
+	double Ki = getfloat( payload + 4 );
+	double Kd = getfloat( payload + 8 );
+	m_leftwheel .pid().setPID( Kp, Ki, Kd );
+	m_rightwheel.pid().setPID( Kp, Ki, Kd );
+	m_state.pid = true;
+	m_updated   = true;
+	return true;
+    }
+    default:
+	Serial.print( F("processframe() - unknown frame type: ") );
+	Serial.println( type );
+	return false;
+    }
+}
+
+// Send the state as a binary frame: the time (ms), a byte of flags for the
+// fields present and the fields (in the order of the flag bits)
+bool Robot::sendstateframe()
+{
+    uint8_t  payload[5 + 4 * 8 + 8 + 12];
+    uint8_t  flags = 0;
+    uint8_t* p     = putuint32( payload, millis() ) + 1;
+
+    if (m_state.head) {
+	m_state.head = false;
+	flags |= 0x01;
+	p = putfloat( p, m_head.angleX() );
+	p = putfloat( p, m_head.angleY() );
+    }
+    if (m_state.power) {
+	m_state.power = false;
+	flags |= 0x02;
+	p = putfloat( p, m_leftwheel .power() );
+	p = putfloat( p, m_rightwheel.power() );
+    }
+    if (m_state.setspeed) {
+	m_state.setspeed = false;
+	flags |= 0x04;
+	p = putfloat( p, m_leftwheel .setspeed() );
+	p = putfloat( p, m_rightwheel.setspeed() );
+    }
+    if (m_state.speed) {
+	m_state.speed = false;
+	flags |= 0x08;
+	p = putfloat( p, m_leftwheel .speed() );
+	p = putfloat( p, m_rightwheel.speed() );
+    }
+    if (m_state.counts) {
+	m_state.counts = false;
+	flags |= 0x10;
+	p = putuint32( p, m_leftwheel .count() );
+	p = putuint32( p, m_rightwheel.count() );
+    }
+    if (m_state.pid) {
+	m_state.pid = false;
+	flags |= 0x20;
+	p = putfloat( p, m_leftwheel.pid().Kp() );
+	p = putfloat( p, m_leftwheel.pid().Ki() );
+	p = putfloat( p, m_leftwheel.pid().Kd() );
+    }
+
+    if (flags == 0) {
+	return false;
+    }
+    payload[4] = flags;
+    WriteFrame_serial( FRAME_STATE, payload, p - payload );
+    return true;
+}
+
 bool Robot::sendstate()
 {
+    if (m_binary) {
+	return sendstateframe();
+    }
+
     DynamicJsonBuffer jsonBuffer;
 
     JsonObject& root = jsonBuffer.createObject();
@@ -64,7 +64,9 @@ public:
 
     bool     processtarget( JsonObject& d );
     bool     processjson( const char* json );
+    bool     processframe( const uint8_t* frame );
     bool     sendstate();
+    bool     sendstateframe();
 
     Wheel&   leftwheel()  { return m_leftwheel;  };
     Wheel&   rightwheel() { return m_rightwheel; };
@@ -75,6 +77,7 @@ private:
     Head&    m_head;
     RobotState m_state;
     bool     m_updated;
+    bool     m_binary;		// Send the state as binary frames
 };
 
 
@@ -239,6 +239,8 @@ void SetupRobot()
     freeram = freeMemory();
     Serial.println( freeram );
     delay(1);
+    // Advertise the protocols for commands (see Comms-serial.h)
+    Serial.println( F("Robot protocols: json binary") );
     Serial.println( F("Robot ready for config") );
 }
 
@@ -3,44 +3,534 @@ Arduino communications interface - over Serial bus.
 """
 
 from __future__ import print_function
+import collections
+import errno
+import fcntl
+import io
+import json
+import os
+import select
+import struct
 import serial
 import threading
+import time
+
+# The binary frame protocol (see arduinoRobot/Comms-serial.cc):
+#     SYNC LENGTH TYPE PAYLOAD... CRC
+# - SYNC:    0xA5 - never the first character of a text (JSON) line
+# - LENGTH:  The number of bytes of TYPE and PAYLOAD
+# - CRC:     CRC-8 (polynomial 0x07) of LENGTH, TYPE and PAYLOAD
+# The payload fields are fixed width and little-endian.
+# Text lines (JSON config and the Arduino diagnostics) can still be sent
+# between the frames.
+FRAME_SYNC       = 0xA5
+FRAME_MAXLENGTH  = 80
+FRAME_HELLO      = 0x01     # Switch to binary (Pi) / acknowledge (Arduino)
+FRAME_TRACK      = 0x10     # Pi to Arduino commands...
+FRAME_HEAD       = 0x11
+FRAME_SETSPEED   = 0x12
+FRAME_POWER      = 0x13
+FRAME_PID        = 0x14
+FRAME_STATE      = 0x20     # Arduino to Pi state
+PROTOCOL_VERSION = 1
+
+hellofield = struct.Struct( "<B" )
+
+# The frame type and fields for each command key
+commandframes = {
+    "track":    (FRAME_TRACK,    struct.Struct( "<hh" )),
+    "head":     (FRAME_HEAD,     struct.Struct( "<ff" )),
+    "setspeed": (FRAME_SETSPEED, struct.Struct( "<ff" )),
+    "power":    (FRAME_POWER,    struct.Struct( "<ff" )),
+    "pid":      (FRAME_PID,      struct.Struct( "<fff" )),
+}
+
+# The state frame is the time (ms) and a byte of flags for the fields
+# which follow, in this order (flag bit 0 first)
+statetime   = struct.Struct( "<IB" )
+statefields = [
+    ("head",     struct.Struct( "<ff" )),
+    ("power",    struct.Struct( "<ff" )),
+    ("setspeed", struct.Struct( "<ff" )),
+    ("speed",    struct.Struct( "<ff" )),
+    ("counts",   struct.Struct( "<II" )),
+    ("pid",      struct.Struct( "<fff" )),
+]
+
+def _crc8table():
+    table = []
+    for i in range( 256 ):
+        crc = i
+        for bit in range( 8 ):
+            crc = ((crc << 1) ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+        table.append( crc )
+    return table
+
+crc8table = _crc8table()
+
+def crc8( data, crc = 0 ):
+    """
+    Return the CRC-8 (polynomial 0x07) of the data (a bytearray).
+    """
+    for byte in data:
+        crc = crc8table[crc ^ byte]
+    return crc
+
+def encodeframe( frametype, payload ):
+    """
+    Return the bytes of a frame of the given type and payload.
+    """
+    frame = bytearray( (FRAME_SYNC, len( payload ) + 1, frametype) )
+    frame += payload
+    frame.append( crc8( frame[1:] ) )
+    return bytes( frame )
+
+def encodecommand( d ):
+    """
+    Return the frames for a command dictionary, eg.
+        {"track": [x, y]} or {"target": {"head": [x, y], "setspeed": [l, r]}}
+
+    Returns None if any of the command can not be sent as frames (eg. config).
+    """
+    frames = b""
+    for key, value in d.items():
+        if key == "target" and isinstance( value, dict ):
+            target = encodecommand( value )
+            if target is None:
+                return None
+            frames += target
+        elif key in commandframes:
+            frametype, fields = commandframes[key]
+            if key == "track":
+                value = [int( v ) for v in value]
+            try:
+                frames += encodeframe( frametype, fields.pack( *value ) )
+            except (struct.error, TypeError):
+                return None
+        else:
+            return None
+    return frames
+
+def decodeframe( frametype, payload ):
+    """
+    Return the dictionary for a (checked) frame from the Arduino:
+    - a state frame as the equivalent JSON state
+    - a hello frame as {"protocol": version}
+    """
+    if frametype == FRAME_STATE:
+        milliseconds, flags = statetime.unpack_from( payload )
+        d = {"time": milliseconds / 1000.0}
+        offset = statetime.size
+        for key, fields in statefields:
+            if flags & 1:
+                d[key] = list( fields.unpack_from( payload, offset ) )
+                offset += fields.size
+            flags >>= 1
+        return d
+    if frametype == FRAME_HELLO:
+        return {"protocol": hellofield.unpack_from( payload )[0]}
+    raise ValueError( "decodeframe(): unknown frame type: 0x%02x" % frametype )
 
 class SerialMonitor( threading.Thread ):
     """
-    A class to monitor the serial port in a thread
+    Event driven serial I/O with the Arduino on one thread.
+
+    A select() loop multiplexes the reads of the serial port, the writes of
+    the queued output (batched into one write) and a wakeup pipe (for new
+    output and close()). The input is read into a reusable buffer and split
+    incrementally into text lines and binary frames for the callback.
     """
-    def __init__( self, device, baudrate ):
+    def __init__( self, device, baudrate, protocol = "json", port = None,
+                  buffersize = 1024, timeout = 1.0, retries = 3 ):
+        """
+        Args:
+        - device:     The serial port device
+        - baudrate:   The baud rate of the serial port
+        - protocol:   "binary" to use the binary frames if the Arduino can
+        - port:       An open port to use instead of the device: a file
+                      descriptor or an object with fileno() (eg. a pty)
+        - buffersize: Size of the input buffer (the longest line)
+        - timeout:    Time (seconds) to wait for the Arduino to acknowledge
+                      the binary protocol...
+        - retries:    ...for each of this number of requests, then use json
+        """
         super( SerialMonitor, self ).__init__()
         self.device     = device
-        self.port       = serial.Serial( self.device, baudrate=baudrate, timeout=None )
+        self.port       = (port if port is not None else
+                           serial.Serial( self.device, baudrate=baudrate, timeout=0 ))
+        self.fd         = self.port if isinstance( self.port, int ) else self.port.fileno()
+        fcntl.fcntl( self.fd, fcntl.F_SETFL,
+                     fcntl.fcntl( self.fd, fcntl.F_GETFL ) | os.O_NONBLOCK )
+        self.input      = io.open( self.fd, "rb", buffering=0, closefd=False )
+        self.buffer     = bytearray( buffersize )
+        self.view       = memoryview( self.buffer )
+        self.length     = 0        # Bytes of input in the buffer
+        self.output     = collections.deque()
+        self.outputlock = threading.Lock()
+        self.unwritten  = b""      # Output not yet taken by the port
+        self.wakeread, self.wakewrite = os.pipe()
         self.callback   = None
         self.done       = False
-        self.daemon     = True     # This thread may block on serial port
+        self.daemon     = True
+        self.binary     = False    # Use the binary frame protocol
+        self.errors     = 0        # Count of bad frames (and overlong lines)
+        self.writes     = 0        # Count of (batched) writes to the port
+        self.protocols  = ["json"]
+        self.protocol   = None     # The version acknowledged by the Arduino
+        self.ready      = threading.Event()
+        self.acknowledged = threading.Event()
 
-        # Opening the serial port resets the Arduino
-        # - wait till it is ready
-        s = ""
-        while not s == "Robot ready for config\r\n":
-            s = self.port.readline()
-            print( "Arduino:", s, end="" )
         # Will call the run() method in a new thread...
         self.start()
+        # Opening the serial port resets the Arduino
+        # - wait till it is ready
+        while not self.ready.wait( 1.0 ):
+            if not self.is_alive():
+                raise IOError( "SerialMonitor: %s closed before the Arduino was ready"
+                               % self.device )
+        if protocol == "binary":
+            self.negotiate( timeout, retries )
+
+    def negotiate( self, timeout = 1.0, retries = 3 ):
+        """
+        Switch to the binary protocol if the Arduino supports it (and
+        acknowledges the request within retries * timeout seconds).
+        """
+        if "binary" not in self.protocols:
+            print( "Arduino: binary protocol not supported - using json" )
+            return
+        hello = encodeframe( FRAME_HELLO, hellofield.pack( PROTOCOL_VERSION ) )
+        for attempt in range( retries ):
+            self.write( hello )
+            if self.acknowledged.wait( timeout ) or not self.is_alive():
+                break
+        if not self.acknowledged.is_set():
+            print( "Arduino: binary protocol not acknowledged - using json" )
+            return
+        self.binary = self.protocol == PROTOCOL_VERSION
+        print( "Arduino: using %s protocol" % ("binary" if self.binary else "json") )
 
     def setcallback( self, callback ):
         self.callback = callback
 
+    def write( self, data ):
+        """
+        Queue data to write to the port (from any thread).
+
+        Returns:
+            The number of bytes queued (0 if the thread has stopped).
+        """
+        if not self.is_alive():
+            return 0
+        if not isinstance( data, bytes ):
+            data = data.encode( "latin-1" )
+        with self.outputlock:
+            wakeup = not self.output
+            self.output.append( data )
+        if wakeup:
+            os.write( self.wakewrite, b"w" )
+        return len( data )
+
+    def _dispatch( self, message ):
+        if not self.ready.is_set():
+            # Still waiting for the Arduino to be ready
+            if isinstance( message, dict ):
+                return
+            print( "Arduino:", message, end="" )
+            if message.startswith( "Robot protocols:" ):
+                self.protocols = message.split()[2:]
+            elif message == "Robot ready for config\r\n":
+                self.ready.set()
+            return
+        if isinstance( message, dict ) and "protocol" in message:
+            self.protocol = message["protocol"]
+            self.acknowledged.set()
+            return
+        try:
+            if self.callback is not None:
+                self.callback( message )
+            else:
+                print( "Arduino: ", message )
+        except Exception as e:
+            # A bad message (or a bug in the callback) must not stop the
+            # serial thread
+            print( "SerialMonitor: callback failed: %r: %r" % (e, message) )
+
+    def _parse( self ):
+        """
+        Dispatch the complete lines and frames in the input buffer.
+        """
+        buf   = self.buffer
+        start = 0
+        while start < self.length:
+            if buf[start] == FRAME_SYNC:
+                if self.length - start < 2:
+                    break
+                length = buf[start + 1]
+                if not 0 < length <= FRAME_MAXLENGTH:
+                    self.errors += 1
+                    start += 1          # Resynchronise on the next byte
+                    continue
+                end = start + length + 3
+                if end > self.length:
+                    break
+                frame = buf[start + 1:end]
+                start = end
+                if crc8( frame[:-1] ) != frame[-1]:
+                    self.errors += 1
+                    print( "SerialMonitor: bad frame discarded" )
+                    continue
+                message = decodeframe( frame[1], frame[2:-1] )
+            else:
+                end = buf.find( b"\n", start, self.length )
+                if end < 0:
+                    break
+                message = bytes( buf[start:end + 1] )
+                if not isinstance( message, str ):
+                    message = message.decode( "latin-1" )
+                start = end + 1
+            self._dispatch( message )
+        # Move the incomplete line/frame to the start of the buffer
+        if start > 0:
+            buf[:self.length - start] = buf[start:self.length]
+            self.length -= start
+        elif self.length == len( buf ):
+            self.errors += 1
+            print( "SerialMonitor: input buffer full - discarding input" )
+            self.length = 0
+
+    def _read( self ):
+        try:
+            n = self.input.readinto( self.view[self.length:] )
+        except (IOError, OSError) as e:
+            if e.errno == errno.EAGAIN:
+                return
+            n = 0                       # EIO: the other end of a pty closed
+        if n == 0:
+            self.done = True            # End of file: stop
+            return
+        if n is not None:
+            self.length += n
+            self._parse()
+
+    def _write( self ):
+        if not self.unwritten:
+            with self.outputlock:
+                self.unwritten = b"".join( self.output )
+                self.output.clear()
+        try:
+            n = os.write( self.fd, self.unwritten )
+        except (IOError, OSError) as e:
+            if e.errno == errno.EAGAIN:
+                return
+            # The port is gone: discard the output and stop
+            print( "SerialMonitor: write to %s failed: %s" % (self.device, e) )
+            with self.outputlock:
+                self.output.clear()
+            self.unwritten = b""
+            self.done      = True
+            return
+        self.unwritten = self.unwritten[n:]
+        self.writes += 1
+
     def run( self ):
-        while not self.done:
-            s = self.port.readline()
-            # print( "Recv: ", s )
+        while True:
+            writing = bool( self.unwritten or self.output )
+            if self.done and not writing:
+                break
+            readable, writable, exceptional = select.select(
+                [self.fd, self.wakeread], [self.fd] if writing else [], [] )
+            if self.wakeread in readable:
+                os.read( self.wakeread, 4096 )
+            if self.fd in readable and not self.done:
+                self._read()
+            if writable:
+                self._write()
+
+    def close( self, timeout = 1.0 ):
+        """
+        Stop the thread (after writing the queued output, for up to timeout
+        seconds).
+        """
+        self.done = True
+        os.write( self.wakewrite, b"c" )
+        self.join( timeout )
+        if not self.is_alive():
+            os.close( self.wakeread )
+            os.close( self.wakewrite )
+
+
+class SendScheduler( threading.Thread ):
+    """
+    Send the commands to the Arduino from a thread at a limited rate.
+
+    Only the latest value of the coalescible commands (track, and the head
+    and setspeed targets, and a track in the target) is kept: a new value
+    replaces any unsent one, and the latest values are merged into one
+    message. The other commands (eg. config, pid) are sent in order, and the
+    unsent coalescible values are sent before them (so a setspeed sent before
+    a pid is not reordered).
+
+    Each tick sends at most the bytes budget (the first message always goes)
+    and the messages allowed by the maximum message rate.
+    """
+    coalescible = ("track", "head", "setspeed")
+
+    def __init__( self, write, encode, maxrate = None, budget = None,
+                  tick = 0.02, coalesce = None ):
+        """
+        Args:
+        - write:    Function to write the bytes of the messages
+        - encode:   Function to encode a command (text or dict) to bytes
+        - maxrate:  Maximum messages per second (None: no limit)
+        - budget:   Maximum bytes per tick (None: no limit)
+        - tick:     Period (seconds) of the sends
+        - coalesce: The command keys to coalesce (default: coalescible)
+        """
+        super( SendScheduler, self ).__init__()
+        self.write      = write
+        self.encode     = encode
+        self.maxrate    = maxrate
+        self.budget     = budget
+        self.tick       = tick
+        self.coalesce   = self.coalescible if coalesce is None else coalesce
+        self.condition  = threading.Condition()
+        self.ordered    = collections.deque()   # Encoded messages to send in order
+        self.latest     = {}                    # Unsent coalescible values by key
+        self.pending    = 0                     # Commands merged into latest
+        self.credit     = 1.0                   # Messages allowed by the rate
+        self.lasttime   = time.time()
+        self.done       = False
+        self.daemon     = True
+        # Stats
+        self.commands   = 0                     # Commands put
+        self.sent       = 0                     # Messages written
+        self.bytes      = 0                     # Bytes written
+        self.superseded = 0                     # Values replaced before sending
+        self.merged     = 0                     # Commands merged into others
+        self.deferred   = 0                     # Ticks which ran out of budget
+        self.start()
+
+    def _split( self, command ):
+        """
+        Return (the coalescible values, the rest of the command or None).
+        """
+        if not isinstance( command, dict ):
             try:
-                if self.callback is not None:
-                    self.callback( s )
-                else:
-                    print( "Arduino: ", s )
-            except ValueError as msg:
-                print( msg, s )
+                command = json.loads( command )
+            except ValueError:
+                return {}, command      # Send unparsable text as it is
+            if not isinstance( command, dict ):
+                return {}, command
+        values = {}
+        rest   = {}
+        for key, value in command.items():
+            if key == "target" and isinstance( value, dict ):
+                # A track in the target is sent as the (top level) track
+                # command, which is all Robot::processjson() accepts
+                target = {}
+                for key2, value2 in value.items():
+                    if key2 in self.coalesce:
+                        values[key2] = value2
+                    else:
+                        target[key2] = value2
+                if target:
+                    rest[key] = target
+            elif key == "track" and key in self.coalesce:
+                values[key] = value
+            else:
+                rest[key] = value
+        return values, rest or None
+
+    def _fence( self ):
+        """
+        Queue the latest values as one message (ahead of any later commands).
+        """
+        if not self.latest:
+            return
+        command = {}
+        target  = {}
+        for key, value in self.latest.items():
+            if key == "track":
+                command[key] = value
+            else:
+                target[key] = value
+        if target:
+            command["target"] = target
+        self.ordered.append( self.encode( command ) )
+        self.merged  += self.pending - 1
+        self.latest  = {}
+        self.pending = 0
+
+    def put( self, command ):
+        """
+        Queue a command (JSON text or dictionary) to send to the Arduino.
+        """
+        values, rest = self._split( command )
+        with self.condition:
+            self.commands += 1
+            if values:
+                for key in values:
+                    if key in self.latest:
+                        self.superseded += 1
+                self.latest.update( values )
+                self.pending += 1
+            if rest is not None:
+                self._fence()
+                self.ordered.append( self.encode( rest ) )
+            self.condition.notify()
+
+    def _take( self ):
+        """
+        Return the messages which may be sent in this tick.
+        """
+        now = time.time()
+        if self.maxrate:
+            self.credit = min( self.credit + (now - self.lasttime) * self.maxrate,
+                               max( 1.0, self.maxrate * self.tick ) )
+        self.lasttime = now
+        messages = []
+        size     = 0
+        while (self.ordered or self.latest) and (not self.maxrate or self.credit >= 1):
+            if not self.ordered:
+                self._fence()
+            data = self.ordered[0]
+            if messages and self.budget and size + len( data ) > self.budget:
+                self.deferred += 1
+                break
+            messages.append( self.ordered.popleft() )
+            size        += len( data )
+            self.credit -= 1
+        return messages
+
+    def run( self ):
+        while True:
+            with self.condition:
+                while not self.done and not self.ordered and not self.latest:
+                    self.condition.wait()
+                if self.done and not self.ordered and not self.latest:
+                    break
+                messages = self._take()
+            for data in messages:
+                self.write( data )
+                self.sent  += 1
+                self.bytes += len( data )
+            time.sleep( self.tick )
+
+    def close( self ):
+        """
+        Send any queued messages and stop the thread.
+        """
+        with self.condition:
+            self.done = True
+            self.condition.notify()
+        self.join()
+
+    def report( self ):
+        print( 'Sent %d messages (%d bytes) for %d commands: '
+               '%d values superseded, %d commands merged, %d ticks over budget'
+               % ( self.sent, self.bytes, self.commands, self.superseded,
+                   self.merged, self.deferred ) )
 
 
 class ArduinoComms():
@@ -50,47 +540,101 @@ class ArduinoComms():
     Methods:
         __init__(): Construct a comms controller.
         send():  Send a command to the Arduino robot.
-        close(): Close down the serial port monitor thread
+        write(): Write encoded commands to the Arduino robot.
+        close(): Close down the serial port monitor and scheduler threads
     """
-    def __init__( self, device="/dev/ttyS99", baudrate=115200, dummy = False ):
+    def __init__( self, device="/dev/ttyS99", baudrate=115200, dummy = False,
+                  protocol = "json", maxrate = None, budget = None, tick = 0.02,
+                  port = None ):
         """
         Construct an interface object for comms with Arduino over Serial bus.
 
         Arguments:
             dummy (= False): Flag to fake sending comms to Arduino (used for testing)
+            protocol (= "json"): "binary" to send the commands and receive the
+                state as binary frames (if the Arduino supports it)
+            maxrate (= None): Maximum commands per second: send through a
+                SendScheduler, coalescing the track/head/setspeed commands
+            budget (= None): Maximum bytes sent per tick (with maxrate)
+                (default: the capacity of the link at the baudrate)
+            tick (= 0.02): Period (seconds) of the SendScheduler
+            port (= None): An open port (file descriptor or object with
+                fileno(), eg. a pty) to use instead of the device
         
         """
-        self.dummy = dummy
+        self.dummy     = dummy
+        self.binary    = False
+        self.scheduler = None
         if not self.dummy:
-            self.serialmonitor = SerialMonitor( device, baudrate )
+            self.serialmonitor = SerialMonitor( device, baudrate, protocol, port )
+            self.binary = self.serialmonitor.binary
+        if maxrate:
+            self.scheduler = SendScheduler(
+                self.write, self.encode, maxrate,
+                budget or baudrate / 10.0 * tick, tick )
 
     def setcallback( self, callback ):
+        """
+        Set the function to call with each message from the Arduino:
+        a line of text, or the dictionary of a state frame.
+        """
         if not self.dummy:
             self.serialmonitor.setcallback( callback )
 
+    def encode( self, command ):
+        """
+        Return the bytes to send for a command (JSON text or a dictionary).
+        """
+        if self.binary:
+            try:
+                d = command if isinstance( command, dict ) else json.loads( command )
+                frames = encodecommand( d )
+                if frames is not None:
+                    return frames
+            except ValueError:
+                pass
+        if isinstance( command, dict ):
+            command = json.dumps( command, separators=(',',':') )
+        return command + "\n"
+
     # Write a command to the Arduino over serial
     def send( self, command ):
         """
-        Write a command to the Arduino over the I2C bus.
+        Write a command to the Arduino over the serial port
+        (or queue it on the SendScheduler).
 
         Arguments:
-            command (str): The command text to be sent to the Arduino.
+            command (str or dict): The command (JSON text or dictionary)
+                to be sent to the Arduino.
         Returns:
             True on success and False on failure.
         """
+        if self.scheduler is not None:
+            self.scheduler.put( command )
+            return True
+        return self.write( self.encode( command ) )
+
+    def write( self, data ):
+        """
+        Write the encoded bytes of commands to the Arduino.
+
+        Returns:
+            True on success and False if the serial port has stopped.
+        """
         if self.dummy:     # For testing - do dummy writes
-            print( command )   # Diagnostic
+            print( data, end="" )   # Diagnostic
             return True
-        # print( "Send: ", command )
-        # Write the command to the arduino
-        n = self.serialmonitor.port.write( command + "\n" )
-        if (n < len( command + "\n" )):
-            print( "ArduinoComms.send(): Write() sent", n, "chars, instead of",
-                   len( command + "\n" ) )
-            print( "ArduinoComms.send(): command=", command )
+        # print( "Send: ", data )
+        # Queue the command for the arduino
+        if self.serialmonitor.write( data ) == 0:
+            print( "ArduinoComms.write(): serial port stopped - dropped",
+                   repr( data ) )
+            return False
         return True
 
     def close( self ):
+        if self.scheduler is not None:
+            self.scheduler.close()
+            self.scheduler.report()
         if not self.dummy:
-            self.serialmonitor.done = True
-            # self.serialmonitor.join()
+            self.serialmonitor.close()
@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+
+"""
+An emulator of the Arduino robot (arduinoRobot/) on a pseudo-terminal.
+
+Speaks the same serial protocol as the firmware, so arduinoproxy.py and
+ArduinoComms can be run and benchmarked without a board:
+- Opening the port "resets" the robot: it prints "Robot ready for config".
+- Commands are read into a 200 byte line buffer as ReadCommand_serial()
+  does (overlong lines are discarded with the same message), and binary
+  frames are parsed as in Comms-serial.cc.
+- The "target" (head, setspeed, power, pid), "track" and "config" keys are
+  processed as in Robot::processjson().
+- The state is sent as Robot::sendstate() does: changes as they happen,
+  and the speed, power and counts of moving wheels every 100ms.
+- The input and output are throttled to the baud rate (10 bits per byte).
+
+Classes:
+    EmulatedWheel:   A simulated wheel (motor, encoder and speed control).
+    ArduinoEmulator: The emulated robot on a pty.
+
+Usage:
+    ./arduinoemulator.py --link /tmp/ttyS99
+    ./arduinoproxy.py --device /tmp/ttyS99
+"""
+
+from __future__ import print_function
+import errno
+import fcntl
+import json
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+import arduinocomms
+
+BUFLEN = 200                    # The command line buffer of Comms-serial.cc
+
+class EmulatedWheel():
+    """
+    A wheel: motor power drives the speed (pulses per second) with a lag,
+    and setspeed() controls the power with a P controller (as Wheel::Loop()).
+    """
+    gain       = 0.1            # Speed (pulses/s) per unit of motor power
+    lag        = 0.2            # Time constant (seconds) of the speed
+    sampletime = 0.05           # Period (seconds) of the speed control
+
+    def __init__( self ):
+        self.pid        = [0.2, 0.0, 0.0]
+        self.reset()
+
+    def reset( self ):
+        self.power      = 0.0
+        self.speed      = 0.0
+        self.count      = 0.0
+        self.target     = 0.0   # The setspeed
+        self.control    = False # Under speed control
+        self.lasttime   = 0.0
+
+    def setspeed( self, speed ):
+        if -0.001 < speed < 0.001:
+            self.setpower( 0 )
+            return
+        self.target  = speed
+        self.control = True
+
+    def setpower( self, power ):
+        self.control = False
+        self.target  = 0.0
+        self.power   = max( -255.0, min( 255.0, power ) )
+
+    def moving( self ):
+        return abs( self.speed ) > 0.01
+
+    def loop( self, now, dt ):
+        """
+        Advance the wheel dt seconds.
+
+        Returns:
+            True if the power was updated (as Wheel::Loop()).
+        """
+        self.speed += (self.power * self.gain - self.speed) * min( 1.0, dt / self.lag )
+        self.count += abs( self.speed ) * dt
+        if not self.control or now - self.lasttime < self.sampletime:
+            return False
+        self.lasttime = now
+        power = self.power + self.pid[0] * (self.target - self.speed)
+        self.power = (max( 0.0, min( 255.0, power ) ) if self.target > 0 else
+                      max( -255.0, min( 0.0, power ) ))
+        return True
+
+
+class ArduinoEmulator( threading.Thread ):
+    """
+    The Arduino robot emulated on a pseudo-terminal (in a thread).
+
+    Open the port at ArduinoEmulator.name (or the link) to talk to it.
+    """
+    statekeys = ("head", "power", "setspeed", "speed", "counts", "pid")
+
+    def __init__( self, baudrate = 115200, link = None, bootdelay = 0.05,
+                  period = 0.001 ):
+        """
+        Args:
+        - baudrate:  Throttle the input and output to this rate (None: no limit)
+        - link:      Optional path for a symlink to the pty (eg. /tmp/ttyS99)
+        - bootdelay: Time (seconds) from opening the port to the ready message
+        - period:    Period (seconds) of the Arduino loop()
+        """
+        super( ArduinoEmulator, self ).__init__()
+        self.master, slave = os.openpty()
+        tty.setraw( slave )     # No echo or newline translation
+        fcntl.fcntl( self.master, fcntl.F_SETFL,
+                     fcntl.fcntl( self.master, fcntl.F_GETFL ) | os.O_NONBLOCK )
+        self.name       = os.ttyname( slave )
+        os.close( slave )
+        self.link       = link
+        if link is not None:
+            if os.path.lexists( link ):
+                os.remove( link )
+            os.symlink( self.name, link )
+        self.baudrate   = baudrate
+        self.bootdelay  = bootdelay
+        self.period     = period
+        self.done       = False
+        self.daemon     = True
+        self.wheels     = [EmulatedWheel(), EmulatedWheel()]
+        self.head       = [0.0, 0.0]
+        self.trackpos   = [0.0, 0.0]
+        self.connected  = False
+        self.output     = bytearray()
+        # Stats
+        self.commands   = 0     # Lines and frames processed
+        self.overflows  = 0     # Lines discarded as too long
+        self.errors     = 0     # Bad commands and frames
+        self.bytesin    = 0
+        self.bytesout   = 0
+        self.reset( time.time() )
+
+    def reset( self, now ):
+        """
+        Reset the robot (as opening the serial port does).
+        """
+        self.boottime   = now
+        self.booted     = False
+        self.binary     = False
+        self.line       = bytearray()
+        self.discarding = False
+        self.frame      = None  # The binary frame being read
+        self.state      = set() # The state keys to send
+        self.lasttime   = 0.0   # Time of the last periodic state
+        self.tokensin   = 0.0
+        self.tokensout  = 0.0
+        self.head       = [0.0, 0.0]
+        self.trackpos   = [0.0, 0.0]
+        for wheel in self.wheels:
+            wheel.reset()
+        del self.output[:]
+
+    def millis( self, now ):
+        return int( (now - self.boottime) * 1000 )
+
+    # Serial.print() and Serial.println()
+    def serialprint( self, *strings ):
+        for s in strings:
+            self.output += s.encode( "latin-1" ) if not isinstance( s, bytes ) else s
+
+    def serialprintln( self, *strings ):
+        self.serialprint( *(strings + ("\r\n",)) )
+
+    def readcommand( self, c ):
+        """
+        Add the next input byte to the command line (as ReadCommand_serial()).
+
+        Returns:
+            A complete command line (bytes) or frame (bytearray), or None.
+        """
+        if self.frame is not None:
+            self.frame.append( c )
+            length = self.frame[1]
+            if len( self.frame ) == 2 and not 0 < length <= arduinocomms.FRAME_MAXLENGTH:
+                self.serialprintln( "ReadCommand_serial(): Bad frame length - discarding frame" )
+                self.frame = None
+            elif len( self.frame ) > 2 and len( self.frame ) == length + 3:
+                frame, self.frame = self.frame, None
+                if arduinocomms.crc8( frame[1:-1] ) == frame[-1]:
+                    return frame
+                self.errors += 1
+                self.serialprintln( "ReadCommand_serial(): Bad frame CRC - discarding frame" )
+        elif c == arduinocomms.FRAME_SYNC and not self.line and not self.discarding:
+            self.frame = bytearray( (c,) )
+        elif c != ord( "\n" ):
+            if self.discarding:
+                return None
+            self.line.append( c )
+            if len( self.line ) >= BUFLEN - 1:
+                self.overflows += 1
+                self.serialprintln( "ReadCommand_serial(): Input buffer full - discarding input:",
+                              bytes( self.line ) )
+                self.line       = bytearray()
+                self.discarding = True
+        else:
+            line, self.line = bytes( self.line ), bytearray()
+            self.discarding = False
+            return line
+        return None
+
+    def look( self, x, y ):
+        self.head = [x, y]
+
+    def dotrackingPID( self, x, y ):
+        # A P controller (Kp 0.2) of the head position with a deadband
+        output = [0.0 if -2.0 < v < 2.0 else max( -90.0, min( 90.0, -0.2 * v ) )
+                  for v in (x, y)]
+        self.trackpos = [max( -90.0, min( 90.0, self.trackpos[0] + output[0] ) ),
+                         max( -90.0, min( 90.0, self.trackpos[1] - output[1] ) )]
+        self.look( *self.trackpos )
+
+    def processtarget( self, d ):
+        for key, value in d.items():
+            if key == "head":
+                self.look( float( value[0] ), float( value[1] ) )
+                self.state.add( "head" )
+            elif key == "setspeed":
+                for wheel, v in zip( self.wheels, value ):
+                    wheel.setspeed( float( v ) )
+                self.state.add( "setspeed" )
+            elif key == "power":
+                for wheel, v in zip( self.wheels, value ):
+                    wheel.setpower( int( v ) )
+                self.state.add( "power" )
+            elif key == "pid":
+                for wheel in self.wheels:
+                    wheel.pid = [float( v ) for v in value[:3]]
+                self.state.add( "pid" )
+            else:
+                self.serialprintln( "processtarget() - unknown key: ", key )
+
+    def processjson( self, line ):
+        try:
+            root = json.loads( line.decode( "latin-1" ) )
+            if not isinstance( root, dict ):
+                raise ValueError( line )
+        except ValueError:
+            self.errors += 1
+            self.serialprintln( "Processing Json: parseObject() failed:", line )
+            return False
+        for key, value in root.items():
+            if key == "target":
+                self.processtarget( value )
+            elif key == "track":
+                self.dotrackingPID( int( value[0] ), int( value[1] ) )
+            elif key == "config":
+                pass            # Nothing to configure
+            else:
+                self.serialprintln( "ProcessJson() - unknown key ignored: ", key )
+        return True
+
+    def processframe( self, frame ):
+        frametype = frame[2]
+        payload   = bytes( frame[3:-1] )
+        try:
+            if frametype == arduinocomms.FRAME_HELLO:
+                self.binary = payload[:1] == struct.pack( "<B", arduinocomms.PROTOCOL_VERSION )
+                self.sendframe( arduinocomms.FRAME_HELLO,
+                                struct.pack( "<B", arduinocomms.PROTOCOL_VERSION ) )
+            elif frametype == arduinocomms.FRAME_TRACK:
+                self.dotrackingPID( *struct.unpack_from( "<hh", payload ) )
+            else:
+                for key, (keytype, fields) in arduinocomms.commandframes.items():
+                    if keytype == frametype:
+                        self.processtarget( {key: fields.unpack_from( payload )} )
+                        break
+                else:
+                    self.serialprintln( "processframe() - unknown frame type: ", str( frametype ) )
+        except struct.error:
+            self.errors += 1
+            self.serialprintln( "processframe() - short frame: ", str( frametype ) )
+
+    def robotcommand( self, command ):
+        self.commands += 1
+        if isinstance( command, bytearray ):
+            self.processframe( command )
+        elif command[:1] == b"{":
+            self.processjson( command )
+        else:
+            self.errors += 1
+            self.serialprintln( "Unknown robot command: ", command )
+
+    def sendframe( self, frametype, payload ):
+        self.output += arduinocomms.encodeframe( frametype, payload )
+
+    def statevalues( self, key ):
+        left, right = self.wheels
+        return {
+            "head":     self.head,
+            "power":    [left.power, right.power],
+            "setspeed": [left.target, right.target],
+            "speed":    [left.speed, right.speed],
+            "counts":   [int( left.count ), int( right.count )],
+            "pid":      left.pid,
+            }[key]
+
+    def sendstate( self, now ):
+        """
+        Send the changed state (as Robot::sendstate()).
+        """
+        if not self.state:
+            return False
+        keys = [key for key in self.statekeys if key in self.state]
+        self.state.clear()
+        if self.binary:
+            flags   = 0
+            payload = b""
+            for bit, (key, fields) in enumerate( arduinocomms.statefields ):
+                if key in keys:
+                    flags   |= 1 << bit
+                    payload += fields.pack( *self.statevalues( key ) )
+            self.sendframe( arduinocomms.FRAME_STATE,
+                            arduinocomms.statetime.pack( self.millis( now ), flags )
+                            + payload )
+            return True
+        # ArduinoJson prints floats with 2 decimals
+        fields = ['"%s":[%s]' % (key, ",".join(
+            str( v ) if key == "counts" else "%.2f" % v
+            for v in self.statevalues( key ) )) for key in keys]
+        fields.append( '"time":%.2f' % (self.millis( now ) / 1000.0) )
+        self.serialprintln( "{" + ",".join( fields ) + "}" )
+        return True
+
+    def loop( self, now, dt ):
+        """
+        One pass of the Arduino loop() after booting (as Robot::Loop()).
+        """
+        updated = [wheel.loop( now, dt ) for wheel in self.wheels]
+        moving  = [wheel.moving() for wheel in self.wheels]
+        if now - self.lasttime > 0.1 and (any( updated ) or any( moving )):
+            self.state.update( ("speed", "power", "counts") )
+        if self.sendstate( now ):
+            self.lasttime = now
+
+    def _throttle( self, tokens, dt ):
+        if self.baudrate is None:
+            return 1 << 16
+        # Allow a burst of up to 64 bytes (the Arduino serial buffer)
+        return min( tokens + dt * self.baudrate / 10.0, 64.0 )
+
+    def _read( self, now, dt ):
+        self.tokensin = self._throttle( self.tokensin, dt )
+        n = int( self.tokensin )
+        if n <= 0:
+            return
+        try:
+            data = bytearray( os.read( self.master, n ) )
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EIO):
+                return
+            raise
+        self.tokensin -= len( data )
+        self.bytesin  += len( data )
+        if not self.booted:
+            return              # Input before setup() is lost
+        for c in data:
+            command = self.readcommand( c )
+            if command is not None:
+                self.robotcommand( command )
+
+    def _write( self, now, dt ):
+        self.tokensout = self._throttle( self.tokensout, dt )
+        n = min( int( self.tokensout ), len( self.output ) )
+        if n <= 0:
+            return
+        try:
+            n = os.write( self.master, bytes( self.output[:n] ) )
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EIO):
+                return
+            raise
+        del self.output[:n]
+        self.tokensout -= n
+        self.bytesout  += n
+
+    def run( self ):
+        poller = select.poll()
+        poller.register( self.master, select.POLLIN )
+        lasttime = time.time()
+        while not self.done:
+            events = dict( poller.poll( max( 1, int( 1000 * self.period ) ) ) )
+            now = time.time()
+            dt, lasttime = now - lasttime, now
+            if events.get( self.master, 0 ) & select.POLLHUP:
+                # Nobody has the port open
+                self.connected = False
+                time.sleep( 0.01 )
+                continue
+            if not self.connected:
+                # Opening the port resets the Arduino
+                self.connected = True
+                self.reset( now )
+            if not self.booted and now - self.boottime >= self.bootdelay:
+                self.booted = True
+                self.serialprintln( "Free SRAM (Bytes) = 1024" )
+                self.serialprintln( "Robot protocols: json binary" )
+                self.serialprintln( "Robot ready for config" )
+            if events:
+                self._read( now, dt )
+            if self.booted:
+                self.loop( now, dt )
+            self._write( now, dt )
+            if events:
+                time.sleep( self.period )
+
+    def close( self ):
+        self.done = True
+        if self.is_alive():
+            self.join( 1.0 )
+        os.close( self.master )
+        if self.link is not None and os.path.islink( self.link ):
+            os.remove( self.link )
+
+    def report( self ):
+        print( 'Emulator: %d commands, %d bytes in, %d bytes out, '
+               '%d lines overflowed, %d errors'
+               % ( self.commands, self.bytesin, self.bytesout,
+                   self.overflows, self.errors ) )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Emulate the Arduino robot on a pseudo-terminal.'
+        )
+    parser.add_argument(
+        "--baudrate", type=int, default=115200,
+        help="Throttle the serial link to this baud rate (0: no limit)"
+        )
+    parser.add_argument(
+        "--link", default=None,
+        help="Path of a symlink to the pty (eg. /tmp/ttyS99)"
+        )
+    args = parser.parse_args()
+
+    emulator = ArduinoEmulator( args.baudrate or None, args.link )
+    print( "Arduino emulator on", args.link or emulator.name )
+    emulator.start()
+    try:
+        while True:
+            time.sleep( 1 )
+    except (KeyboardInterrupt, SystemExit):
+        emulator.close()
+        emulator.report()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -10,13 +10,13 @@ Classes:
 from __future__ import print_function
 import argparse
 import sys
-import itertools
 import time
 import yaml
 import json
 import paho.mqtt.client
 
 import arduinocomms
+import robotstate
 
 parser = argparse.ArgumentParser(
     description='Run the RPI-arduino proxy control program.'
@@ -25,6 +25,22 @@ parser.add_argument(
     "--verbose", action="store_true",
     help="Print diagnostic output"
     )
+parser.add_argument(
+    "--device", default="/dev/ttyS99",
+    help="Serial port of the arduino (eg. the link of arduinoemulator.py)"
+    )
+parser.add_argument(
+    "--protocol", default="json", choices=["json", "binary"],
+    help="Protocol for the serial link to the arduino (binary if supported)"
+    )
+parser.add_argument(
+    "--maxrate", type=float, default=None,
+    help="Maximum commands/second to the arduino (coalescing track/head/setspeed)"
+    )
+parser.add_argument(
+    "--budget", type=int, default=None,
+    help="Maximum bytes per 20ms tick to the arduino (with --maxrate)"
+    )
 args = parser.parse_args()
 
 
@@ -52,9 +68,9 @@ class MqRobot( paho.mqtt.client.Client ):
                 print( "MQTT: " + msg.topic + " " +
                        str( msg.qos ) + " " + str( msg.payload ) )
         try:
-            d = {"target": json.loads( msg.payload )}
-            s = self.robot.targetstate.state( d )
-            self.robot.send( s )
+            d = self.robot.command( json.loads( msg.payload ) )
+            self.robot.targetstate.state( d )
+            self.robot.send( d )
         except ValueError as e:
             print( e, msg.payload )
 
@@ -73,56 +89,6 @@ class MqRobot( paho.mqtt.client.Client ):
         self.publish( "/mollie-robot/state", state, qos=0, retain=True )
 
 
-class RobotState:
-    def __init__( self ):
-        self.time       = 0
-        self.head       = [0,0]
-        self.setspeed   = [0,0]
-        self.speed      = [0,0]
-        self.counts     = [0,0]
-        self.power      = [0,0]
-        self.pid        = [0.2, 0.0, 0.0 ]
-
-    def update( self, s ):
-        if args.verbose:
-            print( "Line =", s )
-        d = json.loads( s )
-        self.__dict__.update( d )
-        return d
-
-    def listofvalues( self ):
-        return list(
-            itertools.chain(
-                [self.time],
-                self.head,
-                self.setspeed,
-                self.speed,
-                self.counts,
-                self.power,
-                self.pid
-            )
-        )
-    
-    def listofkeys( self ):
-        return [
-            "time",
-            "headX", "headY",
-            "setspeedL", "setspeedR",
-            "speedL", "speedR",
-            "countsL", "countsR",
-            "powerL", "powerR",
-            "Kp", "Ki", "Kd"
-        ]
-
-    def state( self, d ):
-        s = json.dumps( d, separators=(',',':') )
-        self.__dict__.update( d )
-        self.time = time.time()
-        return s
-
-    def json( self ):
-        return json.dumps( self.__dict__, separators=(',',':') )
-
 # Construct robots with a comms object
 # Just requires a "send" method to send commands to the arduino
 class ArduinoProxy():
@@ -131,6 +97,7 @@ class ArduinoProxy():
 
     Methods:
         __init__(): Construct the interface.
+        command(): Return the arduino command for an MQTT target.
         send(): Send a command to the arduino controller.
         Initialise(): Connect to the arduino and initialise the robot.
         Run(): Tell the robot to move.
@@ -154,14 +121,20 @@ class ArduinoProxy():
         self.angleY     = 0
         self.trackingOn = False
         self.arduino    = arduinoComms
-        self.targetstate= RobotState()
-        self.robotstate = RobotState()
+        self.targetstate= robotstate.RobotState()
+        self.robotstate = robotstate.RobotState()
         self.mqrobot    = MqRobot( self )
 
         self.arduino.setcallback( self.process_arduino_response )
 
     def process_arduino_response( self, s ):
-        if (s[0] == "{"):
+        if args.verbose:
+            print( "Line =", s )
+        if isinstance( s, dict ):
+            # A state frame from the binary protocol
+            self.robotstate.update( s )
+            self.mqrobot.send( json.dumps( s, separators=(',',':') ) )
+        elif (s[0] == "{"):
             self.robotstate.update( s )
             self.mqrobot.send( s )
         else:
@@ -173,12 +146,30 @@ class ArduinoProxy():
                 maxn if maxn < n else
                 n)
 
+    def command( self, target ):
+        """
+        Return the command for a target from the MQTT broker: track is a top
+        level command (as Robot::processjson() expects), the rest are
+        wrapped as the "target".
+
+        Arguments:
+            target (dict): The decoded target message.
+        """
+        if not isinstance( target, dict ) or "track" not in target:
+            return {"target": target}
+        command = {"track": target["track"]}
+        rest    = dict( (key, value) for key, value in target.items()
+                        if key != "track" )
+        if rest:
+            command["target"] = rest
+        return command
+
     def send( self, command ):
         """
         Send the supplied command to the Arduino robot controller.
 
         Arguments:
-            command (str): the text of the command to send.
+            command (str or dict): the command to send.
         Returns:
             True on success, False on falure.
         """
@@ -207,9 +198,12 @@ class ArduinoProxy():
 if __name__ == "__main__":
     robbie = ArduinoProxy(
         arduinocomms.ArduinoComms(
-            device       = "/dev/ttyS99",
+            device       = args.device,
             baudrate     = 115200,
-            dummy        = False
+            dummy        = False,
+            protocol     = args.protocol,
+            maxrate      = args.maxrate,
+            budget       = args.budget
         )
     )
 
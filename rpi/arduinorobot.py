@@ -6,12 +6,13 @@ Classes:
 """
 
 from __future__ import print_function
-import itertools
-import time
 import json
+import time
 
 import paho.mqtt.client as mqtt
 
+import robotstate
+
 class MqRobot( mqtt.Client ):
     """
     A simple wrapper to send robot status messages to the MQTT broker
@@ -34,7 +35,12 @@ class MqRobot( mqtt.Client ):
     def _on_message( self, mqttc, obj, msg ):
         print( "MQTT: " + msg.topic + " " +
                str( msg.qos ) + " " + str( msg.payload ) )
-        self.robot.robotstate.state( json.loads( msg.payload ) )
+        try:
+            self.robot.robotstate.update( msg.payload )
+        except ValueError as e:
+            print( e, msg.payload )
+            return
+        self.robot.robotstate.time = time.time()   # The time it arrived here
 
     def _on_log( self, mqttc, obj, level, string ):
         print( "MQTT: " +  string )
@@ -51,57 +57,6 @@ class MqRobot( mqtt.Client ):
         self.publish( "/mollie-robot/target", state, qos=0, retain=True )
 
 
-class RobotState:
-    def __init__( self ):
-        self.time       = 0
-        self.head       = [0,0]
-        self.setspeed   = [0,0]
-        self.speed      = [0,0]
-        self.counts     = [0,0]
-        self.power      = [0,0]
-        self.pid        = [0.2, 0.0, 0.0 ]
-
-    def update( self, s ):
-        print( "Line =", s )
-        d = json.loads( s )
-        self.__dict__.update( d )
-        # print( "Robot =", self.__dict__ )
-        return d
-
-    def listofvalues( self ):
-        return list(
-            itertools.chain(
-                [self.time],
-                self.head,
-                self.setspeed,
-                self.speed,
-                self.counts,
-                self.power,
-                self.pid
-            )
-        )
-    
-    def listofkeys( self ):
-        return [
-            "time",
-            "headX", "headY",
-            "setspeedL", "setspeedR",
-            "speedL", "speedR",
-            "countsL", "countsR",
-            "powerL", "powerR",
-            "Kp", "Ki", "Kd"
-        ]
-
-    def state( self, d ):
-        s = json.dumps( d, separators=(',',':') )
-        self.__dict__.update( d )
-        self.time = time.time()
-        # print( "Target=", self.__dict__ )
-        return s
-
-    def json( self ):
-        return json.dumps( self.__dict__, separators=(',',':') )
-
 # Just requires a "send" method to send commands to the arduino
 class ArduinoRobot():
     """
@@ -128,8 +83,8 @@ class ArduinoRobot():
         self.angleX     = 0
         self.angleY     = 0
         self.trackingOn = False
-        self.targetstate= RobotState()
-        self.robotstate = RobotState()
+        self.targetstate= robotstate.RobotState()
+        self.robotstate = robotstate.RobotState()
         self.mqrobot    = MqRobot( self )
 
     # Simple method to do range checking
@@ -172,8 +127,8 @@ class ArduinoRobot():
             x: Horizontal angle of the object to track.
             y: Vertical angle of the object to track.
         """
-        return self.send( "{track: [%d, %d]}"
-                          % (x, y) )
+        return self.send( json.dumps( {"track": [int( x ), int( y )]},
+                                      separators=(',',':') ) )
 
     def TrackObject( self, posX, posY, area ):
         """
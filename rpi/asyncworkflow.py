@@ -0,0 +1,340 @@
+"""
+An asyncio workflow engine with the same stage semantics as the thread based
+workflow.WorkerPool and WorkflowManager.
+
+Each stage takes items off an input queue, passes them to a processor (with
+any side output queues) and puts the result on an output queue. Processors
+which are coroutine functions (I/O stages: MQTT publish, serial writes,
+display streaming) run on the event loop. Plain functions (CPU heavy stages,
+eg. image tracking) are offloaded to an executor (a thread pool by default).
+Nothing polls: the workers wake when an item arrives, and close() cancels
+them rather than passing sentinels down the pipeline.
+
+Needs Python 3.7+ (the rest of the robot code still runs on Python 2).
+Items may be fed in from other threads (eg. CameraCapture) with
+AsyncWorkflowManager.put_threadsafe().
+"""
+
+import asyncio
+import concurrent.futures
+import time
+
+import workflow
+
+class AsyncQueue( asyncio.Queue ):
+    """
+    An asyncio.Queue with the overflow policies, maxage and metrics of a
+    workflow.FreshQueue:
+    - "block":      put() waits for room
+    - "dropoldest": the oldest items are dropped to make room
+    - "dropnewest": the new item is dropped
+    Dropped items (and items older than maxage seconds by item.time when
+    taken off the queue) are put on the recycle queue.
+    """
+    overflows = workflow.FreshQueue.overflows
+
+    def __init__( self, maxsize = 0, overflow = "block", recycle = None,
+                  maxage = None ):
+        if overflow not in self.overflows:
+            raise ValueError( "AsyncQueue: unknown overflow policy: %s" % overflow )
+        asyncio.Queue.__init__( self, maxsize )
+        self.overflow   = overflow
+        self.recycle    = recycle
+        self.maxage     = maxage
+        self.waits      = workflow.Histogram()
+        self.dropped    = 0       # Count of items dropped when full
+        self.expired    = 0       # Count of items dropped as too old
+
+    # The items are queued as (put time, item)
+    def _put( self, item ):
+        self._queue.append( (time.time(), item) )
+
+    def _get( self ):
+        puttime, item = self._queue.popleft()
+        self.waits.add( time.time() - puttime )
+        return item
+
+    def _drop( self, item ):
+        if self.recycle is not None:
+            self.recycle.put_nowait( item )
+
+    def put_nowait( self, item ):
+        if self.overflow != "block" and self.full():
+            self.dropped += 1
+            if self.overflow == "dropnewest":
+                self._drop( item )
+                return
+            self._drop( asyncio.Queue.get_nowait( self ) )
+            self.task_done()
+        asyncio.Queue.put_nowait( self, item )
+
+    async def put( self, item ):
+        if self.overflow == "block":
+            await asyncio.Queue.put( self, item )
+        else:
+            self.put_nowait( item )
+
+    async def get( self ):
+        while True:
+            item = await asyncio.Queue.get( self )
+            itemtime = getattr( item, "time", None )
+            if (self.maxage is None or itemtime is None or
+                time.time() - itemtime <= self.maxage):
+                return item
+            self.expired += 1
+            self.task_done()
+            self._drop( item )
+
+    def report( self ):
+        print( 'Dropped %d items when full and %d items too old'
+               % ( self.dropped, self.expired ) )
+
+class AsyncStage():
+    """
+    A pool of asyncio tasks to process items off a queue (as a WorkerPool).
+    """
+    def __init__( self, numberofworkers, processor,
+                  inputqueue, outputqueue, otherqueues = None, name = None,
+                  executor = None ):
+        """
+        Args:
+        - numberofworkers:  The number of items processed concurrently
+        - processor:        The function (or coroutine function) to process items:
+                            - first arg is the item to process
+                            - optional second arg: additional queues for other output
+        - inputqueue:       The AsyncQueue for receiving items for processing
+        - outputqueue:      The AsyncQueue to put processed items on when finished
+                            (items returned as None are not passed on)
+        - otherqueues:      Optional list/tuple of queues: passed to processor function
+        - name:             Name of the stage for the metrics
+        - executor:         Executor for plain function processors
+                            (default: a thread pool of numberofworkers threads)
+        """
+        self.name            = name or getattr( processor, "__name__", "stage" )
+        self.numberofworkers = numberofworkers
+        self.processor       = processor
+        self.inputqueue      = inputqueue
+        self.outputqueue     = outputqueue
+        self.otherqueues     = otherqueues
+        self.coroutine       = asyncio.iscoroutinefunction( processor )
+        self.executor        = executor
+        self.ownexecutor     = False
+        if executor is None and not self.coroutine:
+            self.executor    = concurrent.futures.ThreadPoolExecutor( numberofworkers )
+            self.ownexecutor = True
+        self.counter         = 0
+        self.processing      = workflow.Histogram()
+        self.depths          = workflow.Histogram( workflow.Histogram.depthbounds )
+        self.busytime        = 0.0
+        self.starttime       = None
+        self.tasks           = []
+
+    def start( self ):
+        """
+        Start the workers (from a coroutine running on the event loop).
+        """
+        self.starttime = time.time()
+        self.tasks = [asyncio.ensure_future( self._work() )
+                      for i in range( self.numberofworkers )]
+
+    async def _process( self, item ):
+        args = (item,) if self.otherqueues is None else (item, self.otherqueues)
+        if self.coroutine:
+            return await self.processor( *args )
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor( self.executor, self.processor, *args )
+
+    async def _work( self ):
+        while True:
+            item = await self.inputqueue.get()
+            self.depths.add( self.inputqueue.qsize() )
+            starttime = time.time()
+            try:
+                item = await self._process( item )
+                self.counter += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Pass the item on - as a Worker does
+                print( 'AsyncStage %s: processor failed: %r' % (self.name, e) )
+            finally:
+                processingtime = time.time() - starttime
+                self.busytime += processingtime
+                self.processing.add( processingtime )
+                self.inputqueue.task_done()
+            if self.outputqueue is not None and item is not None:
+                await self.outputqueue.put( item )
+
+    def count( self ):
+        return self.counter
+
+    def snapshot( self ):
+        """
+        Return the metrics for the stage (as WorkerPool.snapshot()).
+        """
+        elapsedtime = ((time.time() - self.starttime) * self.numberofworkers
+                       if self.starttime is not None else 0.0)
+        return {
+            "name":       self.name,
+            "count":      self.counter,
+            "processing": self.processing.summary(),
+            "wait":       self.inputqueue.waits.summary(),
+            "depth":      self.depths.summary(),
+            "queued":     self.inputqueue.qsize(),
+            "busy":       (min( 1.0, self.busytime / elapsedtime )
+                           if elapsedtime > 0 else 0.0),
+            }
+
+    async def close( self ):
+        """
+        Cancel the workers (any item being processed is abandoned).
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather( *self.tasks, return_exceptions=True )
+        if self.ownexecutor:
+            self.executor.shutdown( wait=False )
+
+def buildpipeline( description, processors = None, executor = None ):
+    """
+    Build the AsyncQueues and AsyncStages of a pipeline description
+    (the same description as workflow.buildpipeline()).
+
+    Returns:
+        (dict of {name: queue}, list of AsyncStages)
+    """
+    queuespecs = description.get( "queues", {} )
+    queues = {}
+    for name, spec in queuespecs.items():
+        spec = dict( spec or {} )
+        spec.pop( "recycle", None )
+        capacity = spec.pop( "capacity", 0 )
+        queues[name] = AsyncQueue( capacity, **spec )
+    for name, spec in queuespecs.items():
+        recycle = (spec or {}).get( "recycle" )
+        if recycle is not None:
+            if recycle not in queues:
+                raise ValueError( "Pipeline: queue %s recycles to unknown queue %s"
+                                  % (name, recycle) )
+            queues[name].recycle = queues[recycle]
+    def queue( name, stage ):
+        if name is None:
+            return None
+        if name not in queues:
+            raise ValueError( "Pipeline: stage %s uses unknown queue %s"
+                              % (stage, name) )
+        return queues[name]
+    stages = []
+    for stage in description.get( "stages", [] ):
+        name      = stage.get( "name" )
+        processor = stage["processor"]
+        if not callable( processor ):
+            processor = (processors[processor] if isinstance( processors, dict )
+                         else getattr( processors, processor ))
+        side = stage.get( "side" )
+        stages.append( AsyncStage(
+            stage.get( "workers", 1 ),
+            processor,
+            queue( stage["input"], name ),
+            queue( stage.get( "output" ), name ),
+            tuple( queue( q, name ) for q in side ) if side else None,
+            name,
+            executor ) )
+    return queues, stages
+
+class AsyncWorkflowManager():
+    """
+    Manage the queues and stages of an asyncio workflow.
+
+    Construct and start() it from a coroutine running on the event loop:
+        manager = AsyncWorkflowManager( description, processors=robot )
+        manager.start()
+        ...
+        await manager.close()
+    """
+    def __init__( self, workflow, interval = None, publish = None,
+                  processors = None, executor = None ):
+        """
+        Args:
+        workflow:   A list/tuple of AsyncStages, or a pipeline description
+                    (see workflow.buildpipeline())
+        interval:   Optional period (seconds) to publish the metrics snapshot()
+        publish:    Function called with each snapshot() (default: print it)
+        processors: Object (or dict) to look up the processor names of a
+                    pipeline description on
+        executor:   Executor for the plain function processors
+                    (default: a thread pool for each stage)
+        """
+        self.queues     = {}
+        if isinstance( workflow, dict ):
+            self.queues, workflow = buildpipeline( workflow, processors, executor )
+        self.workflow   = workflow
+        self.interval   = interval
+        self.publish    = publish or self.printsnapshot
+        self.loop       = None
+        self.publisher  = None
+        self.starttime  = None
+        self.finishtime = None
+
+    printsnapshot = staticmethod( workflow.WorkflowManager.printsnapshot )
+
+    def start( self ):
+        """
+        Start the stages (from a coroutine running on the event loop).
+        """
+        self.loop      = asyncio.get_event_loop()
+        self.starttime = time.time()
+        for stage in self.workflow:
+            stage.start()
+        if self.interval:
+            self.publisher = asyncio.ensure_future( self._publish() )
+
+    async def _publish( self ):
+        while True:
+            await asyncio.sleep( self.interval )
+            self.publish( self.snapshot() )
+
+    def put_threadsafe( self, queue, item ):
+        """
+        Put an item on a queue (or the name of a queue) from another thread.
+        """
+        if not isinstance( queue, asyncio.Queue ):
+            queue = self.queues[queue]
+        self.loop.call_soon_threadsafe( queue.put_nowait, item )
+
+    def count( self ):
+        # Only count the items processed by the first stage
+        return self.workflow[0].count() if self.workflow else 0
+
+    def snapshot( self ):
+        return [stage.snapshot() for stage in self.workflow]
+
+    def report( self ):
+        elapsedtime = self.finishtime - self.starttime
+        count = self.count()
+        print( 'Processed %d items in %d seconds at %.2ffps'
+               % ( count, elapsedtime, count / elapsedtime if elapsedtime else 0.0 ) )
+        self.printsnapshot( self.snapshot() )
+
+    async def close( self, drain = False ):
+        """
+        Close down the stages.
+
+        Args:
+        drain: Finish processing the queued items first (stage by stage)
+        """
+        if self.publisher is not None:
+            self.publisher.cancel()
+        if drain:
+            for stage in self.workflow:
+                await stage.inputqueue.join()
+        for stage in self.workflow:
+            await stage.close()
+        self.finishtime = time.time()
+        self.report()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Benchmark batched WorkerPool processors against one item at a time.
+
+Pushes items through a WorkerPool with a trivial processor (the per item
+queue overhead) and with a ColourLUT threshold of the frames (stacked into
+one array for the batches), for a range of batch sizes.
+"""
+
+from __future__ import print_function
+import argparse
+import Queue
+import time
+
+import numpy as np
+
+import colourtracker
+import hsvvalues
+import workflow
+
+parser = argparse.ArgumentParser(
+    description='Benchmark batched WorkerPool processors.'
+    )
+parser.add_argument(
+    "--items", type=int, default=2000,
+    help="Number of items for each measurement"
+    )
+parser.add_argument(
+    "--batchsizes", type=int, nargs="+", default=[1, 4, 16, 64],
+    help="Batch sizes to measure (1: one item at a time)"
+    )
+parser.add_argument(
+    "--resolution", type=int, nargs=2, default=[80, 60],
+    help="Size (width height) of the frames to threshold"
+    )
+args = parser.parse_args()
+
+lut = colourtracker.ColourLUT( hsvvalues.hsvvalues["bluething"] )
+
+def nothing( item ):
+    return item
+
+def nothings( batch ):
+    return batch
+
+def threshold( frame ):
+    lut.threshold( frame )
+    return frame
+
+def thresholds( batch ):
+    # One vectorised threshold of all the frames
+    lut.threshold( np.stack( batch ) )
+    return batch
+
+def run( processor, batchprocessor, batchsize, items ):
+    """
+    Return the time per item to process the items through a WorkerPool.
+    """
+    inputqueue  = Queue.Queue()
+    outputqueue = Queue.Queue()
+    if batchsize == 1:
+        pool = workflow.WorkerPool( 1, processor, inputqueue, outputqueue )
+    else:
+        pool = workflow.WorkerPool( 1, batchprocessor, inputqueue, outputqueue,
+                                    batchsize = batchsize )
+    starttime = time.time()
+    for item in items:
+        inputqueue.put( item )
+    for item in items:
+        outputqueue.get()
+    elapsedtime = time.time() - starttime
+    pool.close()
+    return elapsedtime / len( items )
+
+if __name__ == "__main__":
+    width, height = args.resolution
+    frames = [np.random.randint( 0, 256, (height, width, 3) ).astype( np.uint8 )
+              for i in range( args.items )]
+    print( "batchsize   trivial (us/item)   threshold (us/item)" )
+    for batchsize in args.batchsizes:
+        print( "%9d   %17.1f   %19.1f" % (
+            batchsize,
+            1e6 * run( nothing, nothings, batchsize, list( range( args.items ) ) ),
+            1e6 * run( threshold, thresholds, batchsize, frames )) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
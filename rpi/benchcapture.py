@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the camera capture formats for the colour tracking pipeline.
+
+Captures and tracks images for a fixed period in each capture format and
+reports the frame rate and the capture-to-tracked latency. The "jpeg" format
+pays for a jpeg encode in the camera and a decode in the ColourTracker - the
+raw "yuv" and "bgr" formats are captured straight into numpy arrays.
+"""
+
+from __future__ import print_function
+import argparse
+import time
+import Queue
+
+parser = argparse.ArgumentParser(
+    description='Compare frame rate and latency of the camera capture formats.'
+    )
+parser.add_argument(
+    "--formats", nargs="+", default=["jpeg", "yuv", "bgr"],
+    choices=["jpeg", "yuv", "bgr"],
+    help="The capture formats to benchmark"
+    )
+parser.add_argument(
+    "--seconds", type=float, default=10.0,
+    help="How long to run each capture format"
+    )
+parser.add_argument(
+    "--resolution", type=int, nargs=2, default=[320, 240],
+    help="Camera resolution (width height)"
+    )
+parser.add_argument(
+    "--framerate", type=int, default=30,
+    help="Camera framerate"
+    )
+args = parser.parse_args()
+
+import picamera
+
+import cameracapture
+import colourtracker
+import hsvvalues
+
+def newcamera():
+    camera = picamera.PiCamera()
+    camera.resolution   = tuple( args.resolution )
+    camera.framerate    = args.framerate
+    camera.iso          = 800
+    camera.image_effect = 'blur'
+    camera.awb_mode     = 'off'
+    camera.awb_gains    = (1.2,1.2)
+    return camera
+
+def benchmark( format ):
+    """
+    Capture and track images in the given format for args.seconds.
+
+    Returns:
+        (count, fps, mean latency, 95th percentile latency)
+    """
+    tracker         = colourtracker.ColourTracker(
+        hsv_slice   = hsvvalues.hsvvalues["bluething"]
+        )
+    cameraqueue     = Queue.Queue()
+    processingqueue = Queue.Queue()
+    capture         = cameracapture.CameraCapture(
+        newcamera(), cameraqueue, processingqueue, format=format
+        )
+    latencies = []
+    starttime = time.time()
+    while time.time() - starttime < args.seconds:
+        try:
+            image = processingqueue.get( timeout=1.0 )
+        except Queue.Empty:
+            continue
+        tracker.Track( image )
+        latencies.append( time.time() - image.time )
+        cameraqueue.put( image )
+    elapsedtime = time.time() - starttime
+    capture.close()
+    capture.join()
+    latencies.sort()
+    count = len( latencies )
+    if count == 0:
+        return (0, 0.0, 0.0, 0.0)
+    return (count,
+            count / elapsedtime,
+            sum( latencies ) / count,
+            latencies[int( 0.95 * (count - 1) )])
+
+if __name__ == "__main__":
+    print( "format   frames     fps   latency(ms)   p95(ms)" )
+    for format in args.formats:
+        count, fps, latency, p95 = benchmark( format )
+        print( "%-6s %8d %7.2f %13.1f %9.1f"
+               % (format, count, fps, latency * 1000.0, p95 * 1000.0) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
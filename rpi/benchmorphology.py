@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmark the Morphology options of the ColourTracker.
+
+Removes the noise from the threshold masks of a set of images (or of
+synthetic masks if no images are given) with each morphology option and
+reports the time per mask and the number of pixels which differ from the
+original repeated 3x3 erode and dilate.
+"""
+
+from __future__ import print_function
+import argparse
+import timeit
+
+import numpy as np
+import cv2
+
+import colourtracker
+import hsvvalues
+
+parser = argparse.ArgumentParser(
+    description='Compare the cost and output of the morphology options.'
+    )
+parser.add_argument(
+    "images", nargs="*",
+    help="Image files to threshold (default: synthetic 320x240 masks)"
+    )
+parser.add_argument(
+    "--target", default="bluething", choices=sorted( hsvvalues.hsvvalues.keys() ),
+    help="The HSV slice to threshold the images with"
+    )
+parser.add_argument(
+    "--repeat", type=int, default=20,
+    help="Number of times to process each mask"
+    )
+args = parser.parse_args()
+
+# The options to compare: (name, Morphology)
+options = [
+    ("iterate",             colourtracker.Morphology( method="iterate" )),
+    ("kernel",              colourtracker.Morphology( method="kernel" )),
+    ("separable",           colourtracker.Morphology( method="separable" )),
+    ("iterate+crop",        colourtracker.Morphology( method="iterate", crop=True )),
+    ("separable+crop",      colourtracker.Morphology( method="separable", crop=True )),
+    ("iterate/2",           colourtracker.Morphology( method="iterate", downscale=2 )),
+    ("separable/2",         colourtracker.Morphology( method="separable", downscale=2 )),
+    ]
+
+def loadmasks():
+    if args.images:
+        tracker = colourtracker.ColourTracker(
+            hsv_slice = hsvvalues.hsvvalues[args.target]
+            )
+        return [tracker._inRange( cv2.imread( f, 1 ) ) for f in args.images]
+    # A ball and some speckle noise
+    masks = []
+    for i in range( 10 ):
+        mask = np.zeros( (240, 320), np.uint8 )
+        cv2.circle( mask, (40 + 25 * i, 60 + 12 * i), 10 + 3 * i, 255, -1 )
+        mask[np.random.random( mask.shape ) < 0.02] = 255
+        masks.append( mask )
+    return masks
+
+if __name__ == "__main__":
+    masks     = loadmasks()
+    reference = [options[0][1].apply( m ) for m in masks]
+    pixels    = sum( m.size for m in masks )
+    print( "option            ms/mask   differing pixels" )
+    for name, morphology in options:
+        t = timeit.timeit( lambda: [morphology.apply( m ) for m in masks],
+                           number=args.repeat )
+        differ = sum( np.count_nonzero( morphology.apply( m ) != r )
+                      for m, r in zip( masks, reference ) )
+        print( "%-15s %9.3f %10d (%.3f%%)"
+               % (name, 1000.0 * t / (args.repeat * len( masks )),
+                  differ, 100.0 * differ / pixels) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the scaling of image tracking over 1 to N workers.
+
+Tracks a recorded frame corpus with the thread based WorkerPool and the
+process based ProcessPool (frames in shared memory) for each number of
+workers, and reports the frames per second and the speedup over one worker.
+The frames are copied into a ring of Image records as the camera would
+capture them, so the copy and queue overheads are included.
+"""
+
+from __future__ import print_function
+import argparse
+import Queue
+import time
+
+import numpy as np
+import cv2
+
+import colourtracker
+import framecorpus
+import hsvvalues
+import processpool
+import workflow
+
+parser = argparse.ArgumentParser(
+    description='Benchmark threads vs processes for the image tracking.'
+    )
+parser.add_argument(
+    "corpus", nargs="+",
+    help="Recorded frame files or directories (*.jpg, *.jpeg, *.npy)"
+    )
+parser.add_argument(
+    "--workers", type=int, default=4,
+    help="Measure from 1 up to this number of workers"
+    )
+parser.add_argument(
+    "--frames", type=int, default=500,
+    help="Number of frames to track for each measurement"
+    )
+parser.add_argument(
+    "--format", default="jpeg", choices=["jpeg", "yuv", "bgr"],
+    help="The capture format of the frames"
+    )
+parser.add_argument(
+    "--target", default="bluething", choices=sorted( hsvvalues.hsvvalues.keys() ),
+    help="The HSV slice to track"
+    )
+args = parser.parse_args()
+
+def loadcorpus():
+    """
+    Return (resolution, list of frame data) of the corpus in args.format.
+    """
+    images = framecorpus.loadframes(
+        args.corpus, None if args.format == "yuv" else args.format )
+    for image in images:
+        if image.format != args.format:
+            parser.error( "can't benchmark %s as %s" % (image.filename, args.format) )
+    if not images:
+        parser.error( "no frames found in the corpus" )
+    resolution = images[0].resolution
+    if resolution is None:
+        img = cv2.imdecode( np.frombuffer( images[0].data, dtype=np.uint8 ), 1 )
+        resolution = (img.shape[1], img.shape[0])
+    return resolution, [image.data if image.format == "jpeg"
+                        else image.array.tobytes() for image in images]
+
+def run( pool, frames, cameraqueue, processingqueue ):
+    """
+    Feed the frames through the pool, recycling the Images it has tracked.
+
+    Returns the frames per second.
+    """
+    starttime = time.time()
+    for i in range( args.frames ):
+        image = cameraqueue.get()
+        image.reset()
+        image.stream.write( frames[i % len( frames )] )
+        image.time = time.time()
+        processingqueue.put( image )
+    # Wait for the last Images to be tracked
+    while pool.count() < args.frames:
+        time.sleep( 0.001 )
+    fps = args.frames / (time.time() - starttime)
+    pool.close()
+    return fps
+
+def benchmark( usethreads, workers, resolution, frames ):
+    tracker         = colourtracker.ColourTracker(
+        hsv_slice   = hsvvalues.hsvvalues[args.target]
+        )
+    ring            = processpool.SharedFrames( workers + 2, resolution, args.format )
+    cameraqueue     = Queue.Queue()
+    processingqueue = Queue.Queue()
+    for image in ring.images():
+        cameraqueue.put( image )
+    def track( image ):
+        tracker.Track( image )
+        return image
+    if usethreads:
+        pool = workflow.WorkerPool( workers, track,
+                                    processingqueue, cameraqueue )
+    else:
+        pool = processpool.ProcessPool( workers, tracker, ring,
+                                        processingqueue, cameraqueue )
+    return run( pool, frames, cameraqueue, processingqueue )
+
+if __name__ == "__main__":
+    resolution, frames = loadcorpus()
+    print( "Corpus: %d frames %dx%d %s" % ((len( frames ),) + tuple( resolution )
+                                           + (args.format,)) )
+    print( "workers   threads (fps)  speedup   processes (fps)  speedup" )
+    base = {}
+    for workers in range( 1, args.workers + 1 ):
+        line = "%7d" % workers
+        for usethreads in (True, False):
+            fps = benchmark( usethreads, workers, resolution, frames )
+            base.setdefault( usethreads, fps )
+            line += "   %13.1f  %6.2fx" % (fps, fps / base[usethreads])
+        print( line )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the binary frame protocol against JSON for the serial link.
+
+For typical commands (Pi to Arduino) and state messages (Arduino to Pi)
+reports the bytes per message, the message rate the link can carry at the
+baud rate (10 bits per byte) and the time to encode the commands and to
+decode the state messages on this machine.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import time
+
+import arduinocomms
+
+parser = argparse.ArgumentParser(
+    description='Benchmark the binary and JSON serial protocols.'
+    )
+parser.add_argument(
+    "--baudrate", type=int, default=115200,
+    help="Baud rate of the serial link"
+    )
+parser.add_argument(
+    "--repeat", type=int, default=20000,
+    help="Number of times to encode/decode each message"
+    )
+args = parser.parse_args()
+
+commands = [
+    ("track",    {"track": [12, -5]}),
+    ("head",     {"target": {"head": [10.5, -3.0]}}),
+    ("setspeed", {"target": {"setspeed": [100, 100]}}),
+    ("pid",      {"target": {"pid": [0.7, 0.1, 0.05]}}),
+]
+
+states = [
+    ("moving",   {"time": 12.345, "speed": [98.5, 101.25],
+                  "counts": [1234, 1240], "power": [55.0, 57.5]}),
+    ("all",      {"time": 12.345, "head": [10.5, -3.0], "power": [55.0, 57.5],
+                  "setspeed": [100.0, 100.0], "speed": [98.5, 101.25],
+                  "counts": [1234, 1240], "pid": [0.7, 0.1, 0.05]}),
+]
+
+def encodestate( d ):
+    """
+    Return the state frame for a state dictionary (as the Arduino sends it).
+    """
+    payload = b""
+    flags = 0
+    for bit, (key, fields) in enumerate( arduinocomms.statefields ):
+        if key in d:
+            flags |= 1 << bit
+            payload += fields.pack( *d[key] )
+    payload = arduinocomms.statetime.pack( int( d["time"] * 1000 ), flags ) + payload
+    return arduinocomms.encodeframe( arduinocomms.FRAME_STATE, payload )
+
+def decodeframe( frame ):
+    """
+    Check and decode a frame (as SerialMonitor._parse()).
+    """
+    frame = bytearray( frame )
+    length = frame[1]
+    if arduinocomms.crc8( frame[2:-1], arduinocomms.crc8table[length] ) != frame[-1]:
+        raise ValueError( "bad CRC" )
+    return arduinocomms.decodeframe( frame[2], frame[3:-1] )
+
+def timeit( function, message ):
+    starttime = time.time()
+    for i in range( args.repeat ):
+        function( message )
+    return (time.time() - starttime) / args.repeat
+
+def jsonline( d ):
+    return json.dumps( d, separators=(',',':') ) + "\n"
+
+def line( name, jsonbytes, binarybytes, jsontime, binarytime ):
+    bytespersecond = args.baudrate / 10.0
+    print( "%-10s %5d %6d   %7.0f %7.0f   %7.1f %7.1f" % (
+        name, jsonbytes, binarybytes,
+        bytespersecond / jsonbytes, bytespersecond / binarybytes,
+        1e6 * jsontime, 1e6 * binarytime) )
+
+if __name__ == "__main__":
+    print( "%d baud" % args.baudrate )
+    print( "                 bytes        messages/s      time (us)" )
+    print( "message     json binary      json  binary      json  binary" )
+    print( "Commands (encode):" )
+    for name, d in commands:
+        line( name, len( jsonline( d ) ), len( arduinocomms.encodecommand( d ) ),
+              timeit( jsonline, d ), timeit( arduinocomms.encodecommand, d ) )
+    print( "State (decode):" )
+    for name, d in states:
+        text  = jsonline( d )
+        frame = encodestate( d )
+        line( name, len( text ), len( frame ),
+              timeit( json.loads, text ), timeit( decodeframe, frame ) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
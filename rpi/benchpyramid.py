@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Compare the accuracy and throughput of the ColourTracker pyramid search levels.
+
+Tracks every frame of a recorded frame set at each pyramid level and reports
+the time per frame, the detection rate and the error in the object location
+and area relative to the full resolution search (pyramid level 0).
+"""
+
+from __future__ import print_function
+import argparse
+import math
+import time
+
+import colourtracker
+import framecorpus
+import hsvvalues
+
+parser = argparse.ArgumentParser(
+    description='Compare accuracy and throughput of the pyramid search levels.'
+    )
+parser.add_argument(
+    "images", nargs="+",
+    help="Recorded frame files or directories to track"
+    )
+parser.add_argument(
+    "--target", default="bluething", choices=sorted( hsvvalues.hsvvalues.keys() ),
+    help="The HSV slice to track"
+    )
+parser.add_argument(
+    "--levels", type=int, nargs="+", default=[0, 1, 2],
+    help="The pyramid levels to compare"
+    )
+args = parser.parse_args()
+
+def trackall( tracker, images ):
+    """
+    Track all the images and return the (time per frame, results).
+    """
+    results = []
+    starttime = time.time()
+    for image in images:
+        image.reset()
+        found = tracker.Track( image )
+        results.append( image.track if found else None )
+    return (time.time() - starttime) / len( images ), results
+
+if __name__ == "__main__":
+    images  = framecorpus.loadframes( args.images, "bgr" )
+    results = {}
+    print( "level  ms/frame  found  mean err(px)  max err(px)  area ratio" )
+    for level in [0] + [l for l in args.levels if l != 0]:
+        tracker = colourtracker.ColourTracker(
+            hsv_slice = hsvvalues.hsvvalues[args.target],
+            pyramid   = level
+            )
+        frametime, results[level] = trackall( tracker, images )
+        errors, ratios = [], []
+        for ref, res in zip( results[0], results[level] ):
+            if ref is not None and res is not None:
+                errors.append( math.hypot( res[0] - ref[0], res[1] - ref[1] ) )
+                ratios.append( res[2] / ref[2] )
+        found = sum( 1 for r in results[level] if r is not None )
+        print( "%5d %9.2f %6d %13.2f %12.2f %11.3f"
+               % (level, frametime * 1000.0, found,
+                  sum( errors ) / len( errors ) if errors else 0.0,
+                  max( errors ) if errors else 0.0,
+                  sum( ratios ) / len( ratios ) if ratios else 0.0) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the serial link to the robot with the Arduino emulator.
+
+Runs ArduinoComms against an ArduinoEmulator on a pty (throttled to the
+baud rate) for each protocol and reports:
+- Throughput: setspeed commands sent as fast as possible, and the
+  commands per second processed by the robot.
+- Latency:    setspeed commands sent at a fixed rate, and the time from
+  sending each to receiving the state showing the new setspeed.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import threading
+import time
+
+import arduinocomms
+import arduinoemulator
+import workflow
+
+parser = argparse.ArgumentParser(
+    description='Benchmark the serial link with the Arduino emulator.'
+    )
+parser.add_argument(
+    "--baudrate", type=int, default=115200,
+    help="Baud rate of the emulated link (0: no limit)"
+    )
+parser.add_argument(
+    "--commands", type=int, default=500,
+    help="Number of commands for the throughput measurement"
+    )
+parser.add_argument(
+    "--rate", type=float, default=50.0,
+    help="Commands per second for the latency measurement"
+    )
+parser.add_argument(
+    "--seconds", type=float, default=3.0,
+    help="Duration of the latency measurement"
+    )
+parser.add_argument(
+    "--maxrate", type=float, default=None,
+    help="Also measure with the SendScheduler at this rate"
+    )
+args = parser.parse_args()
+
+class Link():
+    """
+    An emulated robot and the ArduinoComms connected to it.
+    """
+    def __init__( self, protocol, maxrate = None ):
+        self.emulator = arduinoemulator.ArduinoEmulator( args.baudrate or None )
+        self.emulator.start()
+        self.fd       = os.open( self.emulator.name, os.O_RDWR | os.O_NOCTTY )
+        self.comms    = arduinocomms.ArduinoComms( protocol = protocol,
+                                                   maxrate  = maxrate,
+                                                   port     = self.fd )
+        self.latencies = workflow.Histogram()
+        self.senttimes = {}
+        self.lock      = threading.Lock()
+        self.comms.setcallback( self.received )
+
+    def received( self, message ):
+        if not isinstance( message, dict ):
+            if not message.startswith( "{" ):
+                return
+            message = json.loads( message )
+        if "setspeed" in message:
+            now = time.time()
+            with self.lock:
+                senttime = self.senttimes.pop( int( message["setspeed"][0] ), None )
+            if senttime is not None:
+                self.latencies.add( now - senttime )
+
+    def setspeed( self, value ):
+        with self.lock:
+            self.senttimes[value] = time.time()
+        self.comms.send( {"target": {"setspeed": [value, value]}} )
+
+    def close( self ):
+        self.comms.close()
+        os.close( self.fd )
+        self.emulator.close()
+
+def throughput( protocol, maxrate ):
+    """
+    Return the commands per second processed by the robot.
+    """
+    link = Link( protocol, maxrate )
+    start = link.emulator.commands
+    starttime = time.time()
+    for i in range( args.commands ):
+        link.setspeed( i % 200 + 1 )
+    if link.comms.scheduler is not None:
+        link.comms.scheduler.close()
+    # Wait until the robot has caught up
+    count = -1
+    while count != link.emulator.commands:
+        count = link.emulator.commands
+        time.sleep( 0.2 )
+    rate = (count - start) / (time.time() - starttime - 0.2)
+    overflows = link.emulator.overflows
+    link.close()
+    return count - start, rate, overflows
+
+def latency( protocol, maxrate ):
+    """
+    Return the Histogram of the command to state latencies.
+    """
+    link = Link( protocol, maxrate )
+    starttime = time.time()
+    for i in range( int( args.seconds * args.rate ) ):
+        delay = starttime + i / args.rate - time.time()
+        if delay > 0:
+            time.sleep( delay )
+        link.setspeed( i % 200 + 1 )
+    time.sleep( 0.5 )
+    link.close()
+    return link.latencies
+
+if __name__ == "__main__":
+    print( "Baud rate: %s" % (args.baudrate or "no limit") )
+    print( "                         throughput              latency (ms)" )
+    print( "protocol  scheduler  commands   cmds/s  ovfl    mean    p50    p95    p99" )
+    for maxrate in ([None] if args.maxrate is None else [None, args.maxrate]):
+        for protocol in ("json", "binary"):
+            count, rate, overflows = throughput( protocol, maxrate )
+            latencies = latency( protocol, maxrate )
+            print( "%-8s  %9s  %8d  %7.0f  %4d  %6.2f %6.2f %6.2f %6.2f" % (
+                protocol, "%g/s" % maxrate if maxrate else "-",
+                count, rate, overflows,
+                1000.0 * latencies.total / max( 1, latencies.count ),
+                1000.0 * latencies.percentile( 50 ),
+                1000.0 * latencies.percentile( 95 ),
+                1000.0 * latencies.percentile( 99 )) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+Benchmark decoding the Arduino state lines into a RobotState.
+
+Compares the lines per second of robotstate.RobotState against the
+per-script RobotState it replaced, as the MQTT state messages are received
+by rpimonitor, rpipidtune, rpicontroller and arduinorobot:
+- before: state( json.loads( payload ) ), which also encoded the unused
+  JSON text, then listofvalues() (an itertools.chain list)
+- after:  update( payload ) (the bytes payload), then the local time, then
+  listofvalues()
+for the state lines the Arduino sends, and for a stream of the lines
+recorded from the Arduino emulator while driving (the mix of lines the
+monitors actually decode). Each result is the median of the repeated
+measurements.
+"""
+
+from __future__ import print_function
+import argparse
+import itertools
+import json
+import time
+
+import arduinoemulator
+import robotstate
+
+parser = argparse.ArgumentParser(
+    description='Benchmark decoding the Arduino state lines.'
+    )
+parser.add_argument(
+    "--lines", type=int, default=100000,
+    help="Number of lines to decode for each measurement"
+    )
+parser.add_argument(
+    "--repeat", type=int, default=5,
+    help="Number of measurements of each (the median is reported)"
+    )
+parser.add_argument(
+    "--seconds", type=float, default=10.0,
+    help="Duration (simulated seconds) of the recorded stream of lines"
+    )
+args = parser.parse_args()
+
+lines = [
+    ("moving",   '{"power":[57.92,57.92],"speed":[4.51,4.51],'
+                 '"counts":[112,118],"time":12.80}\r\n'),
+    ("setspeed", '{"setspeed":[10.00,10.00],"time":12.85}\r\n'),
+    ("all",      '{"head":[10.50,-3.00],"power":[55.00,57.50],'
+                 '"setspeed":[100.00,100.00],"speed":[98.50,101.25],'
+                 '"counts":[1234,1240],"pid":[0.70,0.10,0.05],"time":12.35}\r\n'),
+]
+
+class DictRobotState:
+    """
+    The RobotState each script had before robotstate.RobotState.
+    """
+    def __init__( self ):
+        self.time       = 0
+        self.head       = [0,0]
+        self.setspeed   = [0,0]
+        self.speed      = [0,0]
+        self.counts     = [0,0]
+        self.power      = [0,0]
+        self.pid        = [0.2, 0.0, 0.0 ]
+
+    def state( self, d ):
+        s = json.dumps( d, separators=(',',':') )
+        self.__dict__.update( d )
+        self.time = time.time()
+        return s
+
+    def receive( self, payload ):
+        self.state( json.loads( payload ) )
+
+    def listofvalues( self ):
+        return list(
+            itertools.chain(
+                [self.time],
+                self.head,
+                self.setspeed,
+                self.speed,
+                self.counts,
+                self.power,
+                self.pid
+            )
+        )
+
+def recordstream( seconds ):
+    """
+    Return the state lines the Arduino emulator sends while driving for
+    the (simulated) seconds, with new targets every second.
+    """
+    emulator = arduinoemulator.ArduinoEmulator( None )
+    emulator.reset( 0.0 )
+    emulator.booted = True
+    period = emulator.period
+    for i in range( int( seconds / period ) ):
+        now = i * period
+        if i % int( 1.0 / period ) == 0:
+            speed = 50 + 10 * (i % 3)
+            emulator.processjson( json.dumps(
+                {"target": {"setspeed": [speed, speed],
+                            "head": [speed / 10.0, -3.0]}} ).encode( "latin-1" ) )
+        emulator.loop( now, period )
+    emulator.close()
+    return [line for line in bytes( emulator.output ).decode( "latin-1" ).splitlines( True )
+            if line.startswith( "{" )]
+
+class MqttRobotState( robotstate.RobotState ):
+    """
+    The RobotState as the MQTT clients receive a state message.
+    """
+    __slots__ = ()
+
+    def receive( self, payload ):
+        self.update( payload )
+        self.time = time.time()
+
+def linespersecond( state, stream ):
+    receive      = state.receive
+    listofvalues = state.listofvalues
+    stream       = [line.encode( "latin-1" ) for line in stream]
+    count = max( 1, args.lines // len( stream ) ) * len( stream )
+    results = []
+    for i in range( args.repeat ):
+        starttime = time.time()
+        for j in range( count // len( stream ) ):
+            for line in stream:
+                receive( line )
+                listofvalues()
+        results.append( count / (time.time() - starttime) )
+    return sorted( results )[len( results ) // 2]
+
+if __name__ == "__main__":
+    recorded = recordstream( args.seconds )
+    print( "line       dict (lines/s)   slots (lines/s)   speedup" )
+    for name, stream in [(name, [line]) for name, line in lines] + [("stream", recorded)]:
+        before = linespersecond( DictRobotState(), stream )
+        after  = linespersecond( MqttRobotState(), stream )
+        print( "%-8s   %14.0f   %15.0f   %6.2fx" % (name, before, after, after / before) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
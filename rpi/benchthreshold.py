@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the colour lookup table against the cvtColor() + inRange() thresholding.
+
+Runs both threshold engines over a set of images (or random frames if no
+images are given) and reports the time per frame of each engine and the
+fraction of pixels on which the two masks disagree (from the quantisation
+of the lookup table). The lookup table is opt-in: use it only where it is
+the faster engine.
+"""
+
+from __future__ import print_function
+import argparse
+import timeit
+
+import numpy as np
+import cv2
+
+import colourtracker
+import hsvvalues
+
+parser = argparse.ArgumentParser(
+    description='Compare lookup table and cvtColor+inRange colour thresholding.'
+    )
+parser.add_argument(
+    "images", nargs="*",
+    help="Image files to threshold (default: random 320x240 frames)"
+    )
+parser.add_argument(
+    "--target", default="bluething", choices=sorted( hsvvalues.hsvvalues.keys() ),
+    help="The HSV slice to threshold"
+    )
+parser.add_argument(
+    "--bits", type=int, default=6, choices=[4,5,6,7],
+    help="Bits per colour channel for the lookup table"
+    )
+parser.add_argument(
+    "--repeat", type=int, default=20,
+    help="Number of times to threshold each frame"
+    )
+args = parser.parse_args()
+
+def loadframes():
+    if args.images:
+        return [cv2.imread( f, 1 ) for f in args.images]
+    return [np.random.randint( 0, 256, (240, 320, 3) ).astype( np.uint8 )
+            for i in range( 10 )]
+
+def timeperframe( threshold, frames ):
+    t = timeit.timeit( lambda: [threshold( f ) for f in frames],
+                       number=args.repeat )
+    return t / (args.repeat * len( frames ))
+
+if __name__ == "__main__":
+    frames = loadframes()
+    tracker = colourtracker.ColourTracker(
+        hsv_slice = hsvvalues.hsvvalues[args.target],
+        lut_bits  = args.bits
+        )
+    hsvtime = timeperframe( tracker._inRange, frames )
+    masks   = [tracker._inRange( f ) for f in frames]
+
+    buildtime = timeit.timeit(
+        lambda: colourtracker.ColourLUT( tracker.HSV_slice, args.bits ),
+        number=1 )
+    tracker.use_lut = True
+    luttime = timeperframe( tracker._inRange, frames )
+    differ  = sum( np.count_nonzero( tracker._inRange( f ) != m )
+                   for f, m in zip( frames, masks ) )
+    pixels  = sum( m.size for m in masks )
+
+    print( "Lookup table build:   %8.2f ms (%d bits per channel)"
+           % (buildtime * 1000.0, args.bits) )
+    print( "cvtColor + inRange:   %8.3f ms/frame" % (hsvtime * 1000.0) )
+    print( "Lookup table:         %8.3f ms/frame" % (luttime * 1000.0) )
+    print( "Mask disagreement:    %8.4f %%" % (100.0 * differ / pixels) )
+    print( "Faster engine:        %s (%.2fx)"
+           % (("lookup table, use --lut", hsvtime / luttime) if luttime < hsvtime else
+              ("cvtColor + inRange, the default", luttime / hsvtime)) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+Compare the ColourTracker and CamShiftTracker engines on the same recorded frames.
+
+Tracks a recorded sequence of frames with each engine and reports the time
+per frame, the number of frames where the object was found and the
+stability of the track: the mean and maximum frame-to-frame jump of the
+tracked location.
+"""
+
+from __future__ import print_function
+import argparse
+import math
+import time
+
+import camshifttracker
+import colourtracker
+import framecorpus
+import hsvvalues
+
+parser = argparse.ArgumentParser(
+    description='Compare the colour threshold and CamShift tracking engines.'
+    )
+parser.add_argument(
+    "images", nargs="+",
+    help="Recorded frame files or directories to track (in capture order)"
+    )
+parser.add_argument(
+    "--target", default="bluething", choices=sorted( hsvvalues.hsvvalues.keys() ),
+    help="The HSV slice to track"
+    )
+args = parser.parse_args()
+
+def trackall( tracker, images ):
+    """
+    Track all the images and return (time per frame, list of tracks).
+    """
+    tracks = []
+    starttime = time.time()
+    for image in images:
+        image.reset()
+        tracks.append( image.track if tracker.Track( image ) else None )
+    return (time.time() - starttime) / len( images ), tracks
+
+if __name__ == "__main__":
+    images = framecorpus.loadframes( args.images, "bgr" )
+    engines = [
+        ("colour",   colourtracker.ColourTracker(
+            hsv_slice = hsvvalues.hsvvalues[args.target] )),
+        ("camshift", camshifttracker.CamShiftTracker(
+            hsv_slice = hsvvalues.hsvvalues[args.target] )),
+        ]
+    print( "engine    ms/frame  found  mean jump(px)  max jump(px)" )
+    for name, tracker in engines:
+        frametime, tracks = trackall( tracker, images )
+        jumps = [math.hypot( b[0] - a[0], b[1] - a[1] )
+                 for a, b in zip( tracks, tracks[1:] )
+                 if a is not None and b is not None]
+        print( "%-8s %9.2f %6d %14.2f %13.2f"
+               % (name, frametime * 1000.0,
+                  sum( 1 for t in tracks if t is not None ),
+                  sum( jumps ) / len( jumps ) if jumps else 0.0,
+                  max( jumps ) if jumps else 0.0) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
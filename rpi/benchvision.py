@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+Vision benchmark suite: time the ColourTracker over a recorded frame corpus.
+
+Runs each stage of the colour tracking pipeline (decode, HSV convert,
+inRange, erode, dilate, findContours, moments) over every frame of the
+corpus and reports the time per frame of each stage, the end-to-end frames
+per second of ColourTracker.Track() and the memory allocated per frame.
+Needs no camera, so it runs on any Linux box with OpenCV.
+
+Each result is the median of --runs timing runs (of --repeat passes over
+the corpus each), and the spread of the runs is shown as the noise. The
+results may be saved as a baseline (--save) and later runs compared
+against it (--baseline): any stage slower than the baseline by more than
+the tolerance (and by more than its noise) is flagged as a regression
+(and the exit status is 1). The stages are compared after scaling the
+baseline by the time of a fixed calibration workload in each, as the
+speed of the machine itself varies (CPU frequency scaling, other load)
+and slows every stage alike. The default tolerance is above the run to
+run variation measured for repeated runs on the same tree (up to +15%,
+with rare outliers at +25%), so such runs do not flag regressions.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import tracemalloc      # Python 3.4+
+except ImportError:
+    tracemalloc = None
+
+import colourtracker
+import framecorpus
+import hsvvalues
+
+parser = argparse.ArgumentParser(
+    description='Benchmark the ColourTracker stages over a recorded frame corpus.'
+    )
+parser.add_argument(
+    "corpus", nargs="+",
+    help="Recorded frame files or directories (*.jpg, *.jpeg, *.npy)"
+    )
+parser.add_argument(
+    "--target", default="bluething", choices=sorted( hsvvalues.hsvvalues.keys() ),
+    help="The HSV slice to track"
+    )
+parser.add_argument(
+    "--repeat", type=int, default=5,
+    help="Number of passes over the corpus in each timing run"
+    )
+parser.add_argument(
+    "--runs", type=int, default=5,
+    help="Number of timing runs to take the median of (at least %d)" % 3
+    )
+parser.add_argument(
+    "--save", metavar="FILE",
+    help="Save the results as a baseline to FILE"
+    )
+parser.add_argument(
+    "--baseline", metavar="FILE",
+    help="Compare the results against the baseline in FILE"
+    )
+parser.add_argument(
+    "--tolerance", type=float, default=0.30,
+    help="Fractional slowdown of a stage against the baseline to flag"
+    )
+parser.add_argument(
+    "--floor", type=float, default=0.005,
+    help="Smallest slowdown (ms/frame) of a stage to flag (the timer noise)"
+    )
+args = parser.parse_args()
+
+MINRUNS = 3                     # The fewest runs for a meaningful median
+if args.runs < MINRUNS:
+    parser.error( "--runs must be at least %d" % MINRUNS )
+
+stages = ("decode", "hsv", "inrange", "erode", "dilate",
+          "findcontours", "moments")
+
+def timestages( tracker, image, times ):
+    """
+    Run the ColourTracker pipeline one stage at a time on an Image and add
+    the time of each stage to times.
+    """
+    morphology = tracker.morphology
+    t0 = time.time()
+    img = tracker._decode( image )
+    t1 = time.time()
+    hsv = cv2.cvtColor( img, cv2.COLOR_BGR2HSV )
+    t2 = time.time()
+    mask = cv2.inRange( hsv, tracker.HSV_slice[0], tracker.HSV_slice[1] )
+    t3 = time.time()
+    mask = morphology._operation( cv2.erode, mask, morphology.erode )
+    t4 = time.time()
+    mask = morphology._operation( cv2.dilate, mask, morphology.dilate )
+    t5 = time.time()
+    contours, _ = cv2.findContours( mask, cv2.RETR_EXTERNAL,
+                                    cv2.CHAIN_APPROX_SIMPLE )
+    t6 = time.time()
+    if contours:
+        cv2.moments( max( contours, key=lambda c: cv2.contourArea( c ) ), 0 )
+    t7 = time.time()
+    for stage, t in zip( stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3,
+                                  t5 - t4, t6 - t5, t7 - t6) ):
+        times[stage] += t
+
+def allocatedperframe( tracker, images ):
+    """
+    Return the mean peak memory (bytes) allocated by ColourTracker.Track()
+    per frame (or None if tracemalloc is not available).
+    """
+    if tracemalloc is None:
+        return None
+    total = 0
+    for image in images:
+        image.reset()
+        tracemalloc.start()
+        tracker.Track( image )
+        total += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return total / float( len( images ) )
+
+def median( values ):
+    values = sorted( values )
+    middle = len( values ) // 2
+    return (values[middle] if len( values ) % 2 else
+            (values[middle - 1] + values[middle]) / 2.0)
+
+def calibrate( frames ):
+    """
+    Return the ms/frame of a fixed reference workload (a blur of a fixed
+    frame), to measure the speed of the machine at the time of a run.
+    """
+    img = np.random.RandomState( 0 ).randint( 0, 256, (240, 320, 3) ).astype( np.uint8 )
+    dst = np.empty_like( img )
+    starttime = time.time()
+    for i in range( frames ):
+        cv2.GaussianBlur( img, (5, 5), 0, dst=dst )
+    return 1000.0 * (time.time() - starttime) / frames
+
+def timingrun( tracker, images ):
+    """
+    Return the ms/frame of each stage, the fps of Track() and the ms/frame
+    of the calibration for one run of args.repeat passes over the images.
+    """
+    frames = args.repeat * len( images )
+    times = dict( (stage, 0.0) for stage in stages )
+    for i in range( args.repeat ):
+        for image in images:
+            image.reset()
+            timestages( tracker, image, times )
+    results = dict( (stage, 1000.0 * times[stage] / frames) for stage in stages )
+
+    starttime = time.time()
+    for i in range( args.repeat ):
+        for image in images:
+            image.reset()
+            tracker.Track( image )
+    results["fps"] = frames / (time.time() - starttime)
+    results["calibration"] = calibrate( frames )
+    return results
+
+def benchmark( images ):
+    """
+    Return the median results of args.runs timing runs, and the noise of
+    each: the spread (max - min) of the runs as a fraction of the median.
+    """
+    tracker = colourtracker.ColourTracker(
+        hsv_slice = hsvvalues.hsvvalues[args.target]
+        )
+    runs = [timingrun( tracker, images ) for i in range( args.runs )]
+    results = {}
+    noise   = {}
+    for key in stages + ("fps", "calibration"):
+        values = [run[key] for run in runs]
+        results[key] = median( values )
+        noise[key]   = ((max( values ) - min( values )) / results[key]
+                        if results[key] else 0.0)
+    results["allocated"] = allocatedperframe( tracker, images )
+    return results, noise
+
+def report( results, noise, baseline ):
+    regressions = []
+    # Compare at the speed of the machine now (eg. CPU frequency scaling
+    # or other load slows every stage alike)
+    speed = 1.0
+    if baseline is not None and baseline.get( "calibration" ):
+        speed = results["calibration"] / baseline["calibration"]
+    print( "stage          ms/frame    noise   baseline   change" )
+    for stage in stages:
+        line = "%-12s %10.3f %7.1f%%" % (stage, results[stage], 100.0 * noise[stage])
+        if baseline is not None and stage in baseline:
+            change = (results[stage] / (baseline[stage] * speed) - 1.0
+                      if baseline[stage] else 0.0)
+            line += " %10.3f %+7.1f%%" % (baseline[stage], 100.0 * change)
+            slowdown = results[stage] - baseline[stage] * speed
+            if change > max( args.tolerance, noise[stage] ) and slowdown > args.floor:
+                line += "  REGRESSION"
+                regressions.append( stage )
+        print( line )
+    print( "Track():      %10.2f fps  (median of %d runs)" % (results["fps"], args.runs) )
+    print( "Calibration:  %10.3f ms/frame" % results["calibration"], end="" )
+    print( "  (%.2fx the baseline time)" % speed if baseline is not None else "" )
+    if results["allocated"] is not None:
+        print( "Allocated:    %10.1f KB/frame" % (results["allocated"] / 1024.0) )
+    return regressions
+
+if __name__ == "__main__":
+    images = framecorpus.loadframes( args.corpus )
+    if not images:
+        parser.error( "no frames found in the corpus" )
+    print( "Corpus: %d frames" % len( images ) )
+    results, noise = benchmark( images )
+
+    baseline = None
+    if args.baseline:
+        with open( args.baseline, "r" ) as f:
+            baseline = json.load( f )
+    regressions = report( results, noise, baseline )
+    if args.save:
+        with open( args.save, "w" ) as f:
+            json.dump( results, f, indent=4, sort_keys=True )
+    if regressions:
+        sys.exit( 1 )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the thread based workflow against the asyncio workflow engine.
+
+- Overhead: pushes items as fast as possible through a two stage pipeline
+  of trivial processors and reports the time per item.
+- Latency:  feeds items at a fixed rate through a CPU stage (a blur of a
+  camera sized image, run in threads by both engines) and an I/O stage
+  (a short sleep: a coroutine for the asyncio engine) and reports the end
+  to end latency percentiles.
+
+Needs Python 3 (for asyncio).
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+
+import numpy as np
+import cv2
+
+import asyncworkflow
+import workflow
+
+parser = argparse.ArgumentParser(
+    description='Benchmark the thread and asyncio workflow engines.'
+    )
+parser.add_argument(
+    "--items", type=int, default=5000,
+    help="Number of items for the overhead measurement"
+    )
+parser.add_argument(
+    "--rate", type=float, default=60.0,
+    help="Items per second for the latency measurement"
+    )
+parser.add_argument(
+    "--seconds", type=float, default=5.0,
+    help="Duration of the latency measurement"
+    )
+parser.add_argument(
+    "--workers", type=int, default=2,
+    help="Number of workers for the CPU stage"
+    )
+parser.add_argument(
+    "--io", type=float, default=0.002,
+    help="Time (seconds) of the I/O stage"
+    )
+args = parser.parse_args()
+
+class Item():
+    def __init__( self, image = False ):
+        self.time = time.time()
+        self.img  = np.zeros( (240, 320, 3), np.uint8 ) if image else None
+
+def nothing( item ):
+    return item
+
+async def asyncnothing( item ):
+    return item
+
+def blur( item ):
+    cv2.GaussianBlur( item.img, (9, 9), 0, dst=item.img )
+    return item
+
+def iostage( item ):
+    time.sleep( args.io )
+    return item
+
+async def asynciostage( item ):
+    await asyncio.sleep( args.io )
+    return item
+
+def description( cpu, io ):
+    return {
+        "queues": {"input": {}, "middle": {}, "output": {}},
+        "stages": [
+            {"name": "cpu", "processor": cpu, "workers": args.workers,
+             "input": "input", "output": "middle"},
+            {"name": "io", "processor": io, "workers": args.workers,
+             "input": "middle", "output": "output"},
+            ],
+        }
+
+def threadsoverhead():
+    manager = workflow.WorkflowManager( description( nothing, nothing ),
+                                        supervise=None )
+    starttime = time.time()
+    for i in range( args.items ):
+        manager.queues["input"].put( Item() )
+    for i in range( args.items ):
+        manager.queues["output"].get()
+    elapsedtime = time.time() - starttime
+    manager.close()
+    return elapsedtime / args.items
+
+async def asyncoverhead( cpu, io ):
+    manager = asyncworkflow.AsyncWorkflowManager( description( cpu, io ) )
+    manager.start()
+    starttime = time.time()
+    for i in range( args.items ):
+        await manager.queues["input"].put( Item() )
+    for i in range( args.items ):
+        await manager.queues["output"].get()
+    elapsedtime = time.time() - starttime
+    await manager.close()
+    return elapsedtime / args.items
+
+def threadslatency():
+    manager = workflow.WorkflowManager( description( blur, iostage ),
+                                        supervise=None )
+    latencies = workflow.Histogram()
+    count = int( args.seconds * args.rate )
+    def feed():
+        starttime = time.time()
+        for i in range( count ):
+            delay = starttime + i / args.rate - time.time()
+            if delay > 0:
+                time.sleep( delay )
+            manager.queues["input"].put( Item( True ) )
+    feeder = threading.Thread( target=feed )
+    feeder.start()
+    for i in range( count ):
+        item = manager.queues["output"].get()
+        latencies.add( time.time() - item.time )
+    feeder.join()
+    manager.close()
+    return latencies
+
+async def asynclatency():
+    manager = asyncworkflow.AsyncWorkflowManager(
+        description( blur, asynciostage ) )
+    manager.start()
+    latencies = workflow.Histogram()
+    count = int( args.seconds * args.rate )
+    # Feed from a thread, as the camera capture does
+    def feed():
+        starttime = time.time()
+        for i in range( count ):
+            delay = starttime + i / args.rate - time.time()
+            if delay > 0:
+                time.sleep( delay )
+            manager.put_threadsafe( "input", Item( True ) )
+    feeder = threading.Thread( target=feed )
+    feeder.start()
+    for i in range( count ):
+        item = await manager.queues["output"].get()
+        latencies.add( time.time() - item.time )
+    feeder.join()
+    await manager.close()
+    return latencies
+
+def ms( histogram ):
+    return "%6.2f %6.2f %6.2f %6.2f" % tuple(
+        1000.0 * v for v in (histogram.total / histogram.count,
+                             histogram.percentile( 50 ),
+                             histogram.percentile( 95 ),
+                             histogram.percentile( 99 )) )
+
+if __name__ == "__main__":
+    results = [
+        ("threads",           threadsoverhead()),
+        ("asyncio coroutine", asyncio.run( asyncoverhead( asyncnothing,
+                                                          asyncnothing ) )),
+        ("asyncio executor",  asyncio.run( asyncoverhead( nothing, nothing ) )),
+        ]
+    print( "" )
+    print( "Overhead per item (2 stages, %d items):" % args.items )
+    for name, overhead in results:
+        print( "  %-20s %8.1f us" % (name, 1e6 * overhead) )
+
+    threads = threadslatency()
+    asyncs  = asyncio.run( asynclatency() )
+    print( "" )
+    print( "End to end latency at %.0f items/s (ms):" % args.rate )
+    print( "  %-20s   mean    p50    p95    p99" % "" )
+    print( "  %-20s %s" % ("threads", ms( threads )) )
+    print( "  %-20s %s" % ("asyncio", ms( asyncs )) )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -1,3 +1,4 @@
+from __future__ import print_function
 import time
 import threading
 import Queue
@@ -7,7 +8,8 @@ import imageprocessor
 class CameraCapture( threading.Thread ):
     """
     Setup the picamera image capture process in a new thread. Images will be captured
-    to io.BytesIO streams in Image objects. After capture, Images will be put onto an
+    to io.BytesIO streams in Image objects (or straight into preallocated numpy arrays
+    for the raw "yuv" and "bgr" formats). After capture, Images will be put onto an
     outputqueue (Queue.Queue) ready for further processing....
 
     Methods:
@@ -20,25 +22,43 @@ class CameraCapture( threading.Thread ):
                   camera,
                   inputqueue,
                   outputqueue,
-                  showpreview = False ):
+                  showpreview = False,
+                  format      = "jpeg",
+                  images      = None,
+                  count       = 4 ):
         """
         Constructor for multi-threaded image capture and processing.
 
         Args:
             camera (picamera.PiCamera): A pre-configured Raspberry PiCamera object
+                                        (or a ReplayCamera to replay recorded frames)
             inputqueue  (Queue.Queue):  Input queue for loading Image objects
             outputqueue (Queue.Queue):  Output queue for Image objects after capture
             showpreview (boolean):      Display image capture preview on RPi console?
+            format (str):               Capture format: "jpeg", "yuv" or "bgr"
+                                        (the raw formats skip the jpeg encode/decode)
+            images (list):              Optional Image records to capture into
+            count (int):                Number of Image records to create (if
+                                        images is None): enough for the workers
+                                        so the camera is not starved of Images
         """
         super( CameraCapture, self ).__init__()  # Initialise the super class
         self.camera         = camera
         self.inputqueue     = inputqueue
         self.outputqueue    = outputqueue
         self.showpreview    = showpreview
+        self.format         = format
         self.done           = False            # Flag to shutdown processing
+        self.captured       = 0                # Count of Images captured
+        self.sequence       = 0                # Next capture sequence number
+        self.starved        = 0                # Count of waits for a free Image
+        self.starvedtime    = 0.0              # Time spent waiting for Images
         # Fill the inputqueue Image records - ready for capture
-        for i in range(4):
-            self.inputqueue.put( imageprocessor.Image() )
+        if images is None:
+            images = [imageprocessor.Image( self.camera.resolution, self.format )
+                      for i in range( count )]
+        for image in images:
+            self.inputqueue.put( image )
         # Call the "run()" method in the new thread
         self.start()
 
@@ -55,7 +75,16 @@ class CameraCapture( threading.Thread ):
             # time.sleep(2)
             # This is the fastest method to capture a sequence of images from the camera
             # Keep capturing images until self.done is True...
-            camera.capture_sequence( self._streamgenerator(), use_video_port=True )
+            camera.capture_sequence( self._streamgenerator(),
+                                     format=self.format, use_video_port=True )
+        self.report()
+
+    def report( self ):
+        """
+        Print how often the camera was starved of free Images to capture into.
+        """
+        print( 'Captured %d images: starved of images %d times for %.2f seconds'
+               % ( self.captured, self.starved, self.starvedtime ) )
 
     def close( self ):
         # Stop the image capture
@@ -73,7 +102,7 @@ class CameraCapture( threading.Thread ):
         Arguments:
             None
         Yields:
-            stream (BytesIO())
+            stream (BytesIO() or ArrayStream())
         """
         # Get the next Image from the input queue
         # Yield the Image object's stream to the picamera capture-sequence
@@ -81,17 +110,32 @@ class CameraCapture( threading.Thread ):
         while not self.done:
             try:
                 # Get the next Image buffer from the camera queue
-                # We use a timeout so we can respond to (self.done=True)
-                image = self.inputqueue.get( timeout=0.2 )
+                image = self.inputqueue.get_nowait()
             except Queue.Empty:
-                continue
+                # Starved: all the Images are still being processed
+                self.starved += 1
+                starttime = time.time()
+                image = None
+                while not self.done and image is None:
+                    try:
+                        # We use a timeout so we can respond to (self.done=True)
+                        image = self.inputqueue.get( timeout=0.2 )
+                    except Queue.Empty:
+                        pass
+                self.starvedtime += time.time() - starttime
+                if image is None:
+                    continue
             if image is not None:
                 image.reset()
                 image.time = time.time() # Record the time for the capture
+                # Number the Images so results can be put back in capture order
+                image.sequence = self.sequence
+                self.sequence += 1
                 yield image.stream
                 # Resumes when camera asks for next buffer for Image capture
                 # Put the just captured Image on the processing queue
                 image.stream.seek( 0 )
+                self.captured += 1
                 self.outputqueue.put( image )
 
 # Local Variables:
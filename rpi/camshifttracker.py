@@ -0,0 +1,132 @@
+import numpy as np
+import cv2
+
+import colourtracker
+
+class CamShiftTracker( colourtracker.ColourTracker ):
+    """
+    Track an object by hue histogram back-projection and CamShift.
+
+    A hue histogram of the target is built once (from the HSV slice, or from
+    a patch of an image with SetTargetPatch()). Each image is then only
+    converted to HSV, back-projected through the histogram and searched by
+    CamShift from the window where the object was last seen - there is no
+    threshold, erode, dilate or contour finding. When the object is lost, the
+    ColourTracker search of the whole image is used to find it again.
+
+    Has the same Track(image) contract as the ColourTracker.
+    """
+    def __init__( self, hsv_slice = None, show_images = False, tune_hsv = False,
+                  hue_bins = 30, min_area = 16, **kwargs ):
+        colourtracker.ColourTracker.__init__(
+            self,
+            hsv_slice   = hsv_slice,
+            show_images = show_images,
+            tune_hsv    = tune_hsv,
+            **kwargs )
+        self.hue_bins  = hue_bins
+        self.min_area  = min_area     # Smaller windows mean we lost the object
+        self.criteria  = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 1)
+        # The tracking workers finish images out of order: only the newest
+        # image (by capture sequence) sets the window, under the roilock
+        self.window    = None         # (x, y, w, h) of the last CamShift window
+        self.windowsequence = None    # Capture sequence of the image it was in
+        self.hist      = None         # Built lazily from the HSV slice
+
+    def _sliceHistogram( self ):
+        # A flat hue histogram over the hue range of the HSV slice
+        lower, upper = self.HSV_slice
+        hues = np.arange( self.hue_bins ) * 180.0 / self.hue_bins
+        if lower[0] <= upper[0]:
+            inslice = (hues >= lower[0]) & (hues <= upper[0])
+        else:
+            # Hue wraps around: Hmin <= H <= 179 or 0 <= H <= Hmax
+            inslice = (hues >= lower[0]) | (hues <= upper[0])
+        return (inslice * 255).astype( np.float32 ).reshape( -1, 1 )
+
+    # Only count pixels which are saturated and bright enough for the slice
+    def _validMask( self, hsv ):
+        lower, upper = self.HSV_slice
+        return cv2.inRange( hsv,
+                            np.array( [  0, lower[1], lower[2]], np.uint8 ),
+                            np.array( [180, upper[1], upper[2]], np.uint8 ) )
+
+    def SetTargetPatch( self, img, rect ):
+        """
+        Build the target hue histogram from a patch of a BGR image.
+
+        Arguments:
+            img:  The BGR image
+            rect: (x, y, w, h) of the patch containing the target
+        """
+        x, y, w, h = rect
+        hsv  = cv2.cvtColor( img[y:y+h, x:x+w], cv2.COLOR_BGR2HSV )
+        hist = cv2.calcHist( [hsv], [0], self._validMask( hsv ),
+                             [self.hue_bins], [0, 180] )
+        cv2.normalize( hist, hist, 0, 255, cv2.NORM_MINMAX )
+        self.hist = hist
+
+    def _sliceChanged( self ):
+        colourtracker.ColourTracker._sliceChanged( self )
+        self.hist = None
+
+    # Find the object with the ColourTracker whole image search and
+    # return a CamShift window around it (or None if not found)
+    def _acquire( self, image ):
+        found = self._searchImage( image )
+        if found is None:
+            return None
+        (x, y), area = found
+        half = max( 2, int( np.sqrt( self._pixelArea( area ) ) ) // 2 )
+        height, width = image.img.shape[:2]
+        x0, y0 = max( x - half, 0 ), max( y - half, 0 )
+        return (x0, y0, min( x + half, width ) - x0, min( y + half, height ) - y0)
+
+    # Set the CamShift window (or None) from the image - unless a newer
+    # image has already set it
+    def _setWindow( self, image, window ):
+        sequence = image.sequence
+        with self.roilock:
+            if (sequence is not None and self.windowsequence is not None
+                    and sequence < self.windowsequence):
+                return
+            self.window         = window
+            self.windowsequence = sequence
+
+    def Track( self, image ):
+        image.img = self._decode( image )
+        image.allocate( image.img.shape )
+        hist = self.hist
+        if hist is None:
+            hist = self.hist = self._sliceHistogram()
+
+        with self.roilock:
+            window = self.window
+        if window is None:
+            window = self._acquire( image )
+            if window is None:
+                return False
+
+        hsv = cv2.cvtColor( image.img, cv2.COLOR_BGR2HSV, dst=image.hsv )
+        backproj = cv2.calcBackProject( [hsv], [0], hist, [0, 180], 1 )
+        backproj &= self._validMask( hsv )
+        rect, window = cv2.CamShift( backproj, window, self.criteria )
+        (cx, cy), (w, h), angle = rect
+        if w * h < self.min_area:
+            self._setWindow( image, None )
+            return False
+        self._setWindow( image, window )
+
+        box = np.int32( cv2.boxPoints( rect ) ).reshape( -1, 1, 2 )
+        image.contours    = [box]
+        image.bestcontour = box
+        image.location    = (int( cx ), int( cy ))
+        image.track       = self._trackCoords( image.location, w * h,
+                                               image.img.shape )
+        return True
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
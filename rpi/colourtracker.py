@@ -1,6 +1,166 @@
+import math
+import threading
+
 import numpy as np
 import cv2
 
+def hsvInRange( hsv, hsv_slice, dst = None ):
+    """
+    Return the mask (0 or 255) of the pixels of an HSV image in the slice
+    (into dst if given). A hue range which wraps around through zero
+    (Hmin > Hmax, eg. for reds) matches Hmin <= H <= 179 or 0 <= H <= Hmax.
+    """
+    lower, upper = hsv_slice
+    if lower[0] <= upper[0]:
+        return cv2.inRange( hsv, lower, upper, dst=dst )
+    mask = cv2.inRange( hsv, lower,
+                        np.array( [179, upper[1], upper[2]], np.uint8 ), dst=dst )
+    return cv2.bitwise_or(
+        mask,
+        cv2.inRange( hsv, np.array( [0, lower[1], lower[2]], np.uint8 ), upper ),
+        dst=mask )
+
+class ColourLUT():
+    """
+    A lookup table to classify BGR pixels against an HSV slice in one pass.
+
+    The BGR colour space is quantised to "bits" bits per channel and every
+    quantised colour is converted to HSV and thresholded once when the table
+    is built. Thresholding a frame is then a single table lookup per pixel -
+    no per-frame HSV conversion or inRange(). Hue ranges which wrap around
+    through zero (Hmin > Hmax, eg. for reds) are matched as hsvInRange()
+    does for the cvtColor() + inRange() engine.
+
+    This is opt-in (ColourTracker use_lut): with the vectorised cvtColor()
+    of current OpenCV builds the gather of the table lookup is the slower
+    of the two (0.37 vs 0.16 ms for a 320x240 frame on x86, also with
+    preallocated index buffers or a 15 bit index). Measure both with
+    benchthreshold.py on the target before enabling it.
+    """
+    def __init__( self, hsv_slice, bits = 6 ):
+        self.bits  = bits
+        self.shift = 8 - bits
+        self.table = self._build( hsv_slice )
+
+    def _build( self, hsv_slice ):
+        # Classify the centre of each quantised BGR bin.
+        # Index of the bin for colour (b, g, r) is b << 2*bits | g << bits | r
+        n      = 1 << self.bits
+        levels = ((np.arange( n, dtype=np.uint8 ) << self.shift)
+                  + ((1 << self.shift) >> 1))
+        b, g, r = np.meshgrid( levels, levels, levels, indexing='ij' )
+        bgr = np.column_stack( (b.ravel(), g.ravel(), r.ravel()) ).reshape( -1, 1, 3 )
+        hsv = cv2.cvtColor( bgr, cv2.COLOR_BGR2HSV )
+        return hsvInRange( hsv, hsv_slice ).ravel()
+
+    def threshold( self, img ):
+        """
+        Return a monochrome mask (0 or 255) of the pixels of img in the HSV slice.
+        """
+        q = img >> self.shift
+        index = q[..., 0].astype( np.uint32 )
+        index <<= self.bits
+        index |= q[..., 1]
+        index <<= self.bits
+        index |= q[..., 2]
+        return self.table.take( index )
+
+class Morphology():
+    """
+    The morphology stage to remove noise from a threshold mask.
+
+    Erodes the mask (to remove specks of noise) and then dilates it (to fill
+    out the blobs) by the given number of 3x3 steps. The method may be:
+        "iterate":   repeated 3x3 erode and dilate (one pass per step)
+        "kernel":    a single pass of each with the equivalent square kernel
+        "separable": a row pass and a column pass with the equivalent kernels
+    All three give the same mask. Optionally the mask may be cropped to the
+    bounding box of the non-zero pixels first (exact), or downscaled by
+    "downscale" for the morphology (approximate).
+    """
+    methods = ("iterate", "kernel", "separable")
+
+    def __init__( self, erode = 3, dilate = 8, method = "iterate",
+                  crop = False, downscale = 1 ):
+        if method not in self.methods:
+            raise ValueError( "Morphology: unknown method: %s" % method )
+        self.erode     = erode
+        self.dilate    = dilate
+        self.method    = method
+        self.crop      = crop
+        self.downscale = downscale
+        self.kernels   = {}
+
+    # The number of steps on a mask downscaled by "scale"
+    def _steps( self, steps, scale ):
+        return max( 1, int( round( float( steps ) / scale ) ) )
+
+    def _kernel( self, size ):
+        kernel = self.kernels.get( size )
+        if kernel is None:
+            kernel = self.kernels[size] = cv2.getStructuringElement(
+                cv2.MORPH_RECT, size )
+        return kernel
+
+    # Apply the morphology operation (cv2.erode or cv2.dilate) "steps" times
+    # - into dst if given (which may be the mask itself)
+    def _operation( self, operation, mask, steps, dst = None ):
+        if self.method == "iterate":
+            return operation( mask, None, dst=dst, iterations=steps )
+        size = 2 * steps + 1
+        if self.method == "kernel":
+            return operation( mask, self._kernel( (size, size) ), dst=dst )
+        return operation( operation( mask, self._kernel( (size, 1) ), dst=dst ),
+                          self._kernel( (1, size) ), dst=dst )
+
+    def _apply( self, mask, scale, dst = None ):
+        if self.downscale > 1 and min( mask.shape[:2] ) >= self.downscale:
+            height, width = mask.shape[:2]
+            small = cv2.resize( mask,
+                                (width // self.downscale, height // self.downscale),
+                                interpolation=cv2.INTER_NEAREST )
+            return cv2.resize( self._erodeDilate( small, scale * self.downscale,
+                                                  small ),
+                               (width, height), dst=dst,
+                               interpolation=cv2.INTER_NEAREST )
+        return self._erodeDilate( mask, scale, dst )
+
+    def _erodeDilate( self, mask, scale, dst = None ):
+        return self._operation(
+            cv2.dilate,
+            self._operation( cv2.erode, mask, self._steps( self.erode, scale ), dst ),
+            self._steps( self.dilate, scale ), dst )
+
+    def apply( self, mask, scale = 1, inplace = False ):
+        """
+        Return the mask with the noise removed.
+
+        Arguments:
+            mask:    The monochrome threshold mask
+            scale:   The mask is downscaled by this factor (the steps are scaled)
+            inplace: Remove the noise in place in mask (no new mask is allocated)
+        """
+        dst = mask if inplace else None
+        if not self.crop:
+            return self._apply( mask, scale, dst )
+        points = cv2.findNonZero( mask )
+        if points is None:
+            return mask
+        # Leave room around the pixels for the dilation
+        x, y, w, h = cv2.boundingRect( points )
+        pad = self._steps( self.dilate, scale ) * self.downscale + 1
+        height, width = mask.shape[:2]
+        x0, y0 = max( x - pad, 0 ), max( y - pad, 0 )
+        x1, y1 = min( x + w + pad, width ), min( y + h + pad, height )
+        if inplace:
+            # Outside the crop the mask is already all zero
+            window = mask[y0:y1, x0:x1]
+            self._apply( window, scale, window )
+            return mask
+        result = np.zeros_like( mask )
+        result[y0:y1, x0:x1] = self._apply( mask[y0:y1, x0:x1], scale )
+        return result
+
 class ColourTracker():
     HSV_all = [np.array( [   0,   0,   0 ], np.uint8 ),
                np.array( [ 179, 255, 255 ], np.uint8 )]
@@ -9,31 +169,87 @@ class ColourTracker():
                   hsv_slice    = None,
                   use_contours = True,
                   show_images  = False,
-                  tune_hsv     = False
+                  tune_hsv     = False,
+                  use_roi      = False,
+                  roi_scale    = 1.5,
+                  roi_margin   = 40,
+                  use_lut      = False,
+                  lut_bits     = 6,
+                  targets      = None,
+                  target       = None,
+                  pyramid      = 0,
+                  use_components = False,
+                  morphology   = None
                   ):
         self.HSV_slice    = (hsv_slice
                              if hsv_slice is not None
                              else self.__class__.HSV_all)
         self.use_contours = use_contours
+        # Find the largest blob from one connected components labelling pass
+        # (needs OpenCV 3+). Contours are only found if the image is shown.
+        self.use_components = use_components
+        self.morphology   = morphology if morphology is not None else Morphology()
         self.show_images  = show_images or tune_hsv
         self.tune_hsv     = tune_hsv
+        # Region of interest tracking: only search a window around the
+        # last location of the object. The half-width of the window is
+        # (roi_scale * sqrt(area) + roi_margin) pixels. The tracking workers
+        # finish images out of order: only the newest image sets it.
+        self.use_roi      = use_roi
+        self.roi_scale    = roi_scale
+        self.roi_margin   = roi_margin
+        self.roilock      = threading.Lock()
+        self.lastfound    = None     # ((x,y), pixel area) of last object found
+        self.lastsequence = None     # Capture sequence of the image it was in
+        # Lookup table thresholding (opt-in, see ColourLUT): built lazily
+        # whenever the slice changes
+        self.use_lut      = use_lut
+        self.lut_bits     = lut_bits
+        self.lut          = None
+        # Multi-target tracking: a dict of {name: hsv_slice} all tracked
+        # from the one HSV conversion of each image. The "target" is the
+        # name of the target to steer by, or "nearest" for the largest.
+        self.targets      = targets
+        self.target       = target if target is not None else "nearest"
+        # Pyramid search: find the object on an image downscaled by
+        # 2**pyramid first, then refine it on a full resolution window.
+        self.pyramid      = pyramid
         if self.show_images:
             cv2.namedWindow( "output", 1 )
         if self.tune_hsv:
             self.SetupHSVTuning()
 
     # return a monochrome image with only pixels between the HSV range
-    def _ColorThreshold( self, img ):
-        return cv2.dilate(
-            cv2.erode(
-                cv2.inRange(
-                    cv2.cvtColor( img, cv2.COLOR_BGR2HSV ),
-                    self.HSV_slice[0], self.HSV_slice[1] ),
-                None, iterations=3 ),
-            None, iterations=8 )
+    # - into the preallocated hsv and mask arrays of image (if given)
+    def _inRange( self, img, image = None ):
+        if self.use_lut:
+            lut = self.lut
+            if lut is None:
+                lut = self.lut = ColourLUT( self.HSV_slice, self.lut_bits )
+            return lut.threshold( img )
+        if image is None:
+            return hsvInRange( cv2.cvtColor( img, cv2.COLOR_BGR2HSV ),
+                               self.HSV_slice )
+        height, width = img.shape[:2]
+        hsv = cv2.cvtColor( img, cv2.COLOR_BGR2HSV,
+                            dst=image.hsv[:height, :width] )
+        return hsvInRange( hsv, self.HSV_slice, dst=image.mask[:height, :width] )
+
+    # remove small specks of noise from the mask and fill out the blobs
+    # - on a mask downscaled by "scale" the erode and dilate are scaled to match
+    def _removeNoise( self, mask, scale = 1, inplace = False ):
+        return self.morphology.apply( mask, scale, inplace )
+
+    # return the HSV range mask with the noise removed
+    def _ColorThreshold( self, img, image = None ):
+        if image is None or self.use_lut:
+            return self._removeNoise( self._inRange( img ) )
+        return self._removeNoise( self._inRange( img, image ), inplace=True )
 
     # Calculate moments from the largest contour of the thresholded image
-    def _getMoments( self, imgFiltered, image ):
+    # - moments are relative to the thresholded image, but the contours are
+    #   shifted by offset so they can be drawn on the full image.
+    def _getMoments( self, imgFiltered, image, offset = (0, 0) ):
         # If use_contours is "off": calculate moments from threshold image
         if not self.use_contours:
             return cv2.moments( imgFiltered, 0 )
@@ -45,54 +261,250 @@ class ColourTracker():
             return False
         # Get the contour with maximum area
         image.bestcontour = max( image.contours, key=lambda c: cv2.contourArea( c ) )
-        return cv2.moments( image.bestcontour, 0 )
+        moments = cv2.moments( image.bestcontour, 0 )
+        if offset != (0, 0):
+            shift = np.array( offset, np.int32 )
+            image.contours    = [c + shift for c in image.contours]
+            image.bestcontour = image.bestcontour + shift
+        return moments
+
+    # Return the search window (x0, y0, x1, y1) around the last object found
+    # - or None if we should search the whole image
+    def _searchWindow( self, shape ):
+        with self.roilock:
+            lastfound = self.lastfound
+        if not self.use_roi or lastfound is None:
+            return None
+        (x, y), area = lastfound
+        half = int( self.roi_scale * math.sqrt( area ) ) + self.roi_margin
+        height, width = shape[:2]
+        x0, y0 = max( x - half, 0 ), max( y - half, 0 )
+        x1, y1 = min( x + half, width ), min( y + half, height )
+        if x1 - x0 >= width and y1 - y0 >= height:
+            return None
+        return (x0, y0, x1, y1)
+
+    # Locate the object in the window (x0, y0, x1, y1) of the image
+    # (or the whole image if window is None).
+    # Returns ((x,y), area) of the object or None if not found.
+    def _findObject( self, image, window ):
+        if window is None:
+            x0, y0 = 0, 0
+            img = image.img
+        else:
+            x0, y0, x1, y1 = window
+            img = image.img[y0:y1, x0:x1]
+
+        # Generate the thresholded image to identify
+        imgFiltered = self._ColorThreshold( img, image )
+
+        return self._locateObject( imgFiltered, image, (x0, y0) )
+
+    # Search the whole image for the object - directly, or by a coarse search
+    # on a downscaled image refined on a full resolution window around it.
+    # Returns ((x,y), area) of the object or None if not found.
+    def _searchImage( self, image ):
+        if not self.pyramid:
+            return self._findObject( image, None )
+
+        scale = 1 << self.pyramid
+        height, width = image.img.shape[:2]
+        small = cv2.resize( image.img, (width // scale, height // scale),
+                            interpolation=cv2.INTER_AREA )
+        coarse = self._locateObject(
+            self._removeNoise( self._inRange( small ), scale ), image, (0, 0) )
+        if coarse is None:
+            return None
+
+        (x, y), area = coarse
+        x, y  = x * scale + scale // 2, y * scale + scale // 2
+        area *= scale * scale
+        # Allow for the coarse position being out by a couple of pixels
+        half = int( self.roi_scale * math.sqrt( self._pixelArea( area ) ) ) + 2 * scale
+        window = (max( x - half, 0 ), max( y - half, 0 ),
+                  min( x + half, width ), min( y + half, height ))
+        found = self._findObject( image, window )
+        if found is None:
+            # Lost it at full resolution - fall back to the coarse result
+            image.contours    = None
+            image.bestcontour = None
+            image.blobs       = None
+            return ((x, y), area)
+        return found
+
+    # Locate the largest connected component of the thresholded image.
+    # The labels are kept in image.blobs so contours can be found for display.
+    def _largestComponent( self, imgFiltered, image, offset ):
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            imgFiltered, connectivity=8 )
+        if n < 2:
+            return None
+        # Label 0 is the background
+        best = 1 + int( stats[1:, cv2.CC_STAT_AREA].argmax() )
+        image.blobs = (labels, best, offset)
+        return ((int( centroids[best][0] ) + offset[0],
+                 int( centroids[best][1] ) + offset[1]),
+                float( stats[best, cv2.CC_STAT_AREA] ))
+
+    # Find the contours of the blobs found by _largestComponent()
+    def _blobContours( self, image ):
+        labels, best, offset = image.blobs
+        image.contours, _ = cv2.findContours( (labels > 0).astype( np.uint8 ),
+                                              cv2.RETR_EXTERNAL,
+                                              cv2.CHAIN_APPROX_SIMPLE,
+                                              offset=offset )
+        bestcontours, _ = cv2.findContours( (labels == best).astype( np.uint8 ),
+                                            cv2.RETR_EXTERNAL,
+                                            cv2.CHAIN_APPROX_SIMPLE,
+                                            offset=offset )
+        image.bestcontour = bestcontours[0]
+
+    # Area of the object in pixels from the area returned by _locateObject()
+    # - moments of the threshold image are weighted by pixel value (255)
+    def _pixelArea( self, area ):
+        if self.use_components or self.use_contours:
+            return area
+        return area / 255.0
+
+    # Locate the largest object in the thresholded image
+    # (which is at offset (x0, y0) in the full image).
+    # Returns ((x,y), area) of the object or None if not found.
+    def _locateObject( self, imgFiltered, image, offset ):
+        if self.use_components:
+            return self._largestComponent( imgFiltered, image, offset )
+
+        x0, y0 = offset
+        # Calculate moments from the largest contour, or the threshold image
+        moments = self._getMoments( imgFiltered, image, offset )
+        if not moments:
+            return None
+
+        area = moments['m00']
+        if (area < 1):
+            return None
+
+        # Calculate the centre of gravity of the largest "blob" of colour we found
+        return ((int(moments['m10'] / area) + x0,
+                 int(moments['m01'] / area) + y0),
+                area)
+
+    # Get the BGR image for processing from the captured Image
+    # - jpeg captures must be decoded, raw captures are used in place
+    def _decode( self, image ):
+        if image.format == "bgr":
+            width, height = image.resolution
+            return image.array[:height, :width]
+        if image.format == "yuv":
+            width, height = image.resolution
+            return cv2.cvtColor( image.array, cv2.COLOR_YUV2BGR_I420,
+                                 dst=image.bgr )[:height, :width]
+        # "Decode" the image straight from the capture buffer, preserving colour
+        return cv2.imdecode( image.view(), 1 )
 
     # Read an image from the stream
     # Return the coordinates and area of the object (posx, posy, area)
     # The centre of the image is at (posx, posy) = (0, 0)
     def Track( self, image ):
-        # "Decode" the image from the array, preserving colour
-        image.img = cv2.imdecode( np.fromstring( image.stream.getvalue(),
-                                                 dtype=np.uint8 ), 1 )
-        
+        image.img = self._decode( image )
+        image.allocate( image.img.shape )
+
         # Camera applies gaussian blur - no need to do it again.
         # image.img = cv2.smooth( image.img, cv2.BLUR, 3 )
 
-        # Generate the thresholded image to identify 
-        imgFiltered = self._ColorThreshold( image.img )
-
-        # Calculate moments from the largest contour, or the threshold image
-        moments = self._getMoments( imgFiltered, image )
-        if not moments:
-            return False
+        if self.targets:
+            return self._trackTargets( image )
 
-        area = moments['m00']
-        if (area < 1):
+        # Search near the last known location first (if ROI tracking is on)
+        # and fall back to searching the whole image if we lost the object
+        window = self._searchWindow( image.img.shape )
+        found  = None
+        if window is not None:
+            found = self._findObject( image, window )
+        if found is None:
+            found = self._searchImage( image )
+        if found is None:
+            self._setLastFound( image, None )
             return False
 
-        image.location = (None,None)
-        image.track    = (None,None,None)
-        # Calculate the centre of gravity of the largest "blob" of colour we found
-        image.location = (int(moments['m10'] / area),
-                          int(moments['m01'] / area))
-        # Convert coords so (0,0) is at centre of image and Y is upward
-        image.track = (+(image.location[0] - image.img.shape[1]/2),
-                       -(image.location[1] - image.img.shape[0]/2),
-                       area)
+        image.location, area = found
+        self._setLastFound( image, (image.location, self._pixelArea( area )) )
+        image.track = self._trackCoords( image.location, area, image.img.shape )
 
         # Return the coords of the object and it's area
         return True
 
-    def Showimage( self, image ):
+    # Set the last object found (or None) from the image - unless a newer
+    # image (by capture sequence) has already set it
+    def _setLastFound( self, image, lastfound ):
+        sequence = image.sequence
+        with self.roilock:
+            if (sequence is not None and self.lastsequence is not None
+                    and sequence < self.lastsequence):
+                return
+            self.lastfound    = lastfound
+            self.lastsequence = sequence
+
+    # Convert coords so (0,0) is at centre of image and Y is upward
+    def _trackCoords( self, location, area, shape ):
+        return (+(location[0] - shape[1]/2),
+                -(location[1] - shape[0]/2),
+                area)
+
+    # Track all the targets from one HSV conversion of the image.
+    # image.tracks is set to a dict of {name: (x,y,area)} of all the targets
+    # found, and image.location/track to the selected target (if found).
+    def _trackTargets( self, image ):
+        hsv = cv2.cvtColor( image.img, cv2.COLOR_BGR2HSV, dst=image.hsv )
+        found = {}
+        for name, hsv_slice in self.targets.items():
+            # Each target in turn in the Image's mask
+            imgFiltered = self._removeNoise(
+                hsvInRange( hsv, hsv_slice, dst=image.mask ),
+                inplace=True )
+            location = self._locateObject( imgFiltered, image, (0, 0) )
+            if location is not None:
+                found[name] = (location, image.contours, image.bestcontour,
+                               image.blobs)
+                image.tracks[name] = self._trackCoords( location[0], location[1],
+                                                        image.img.shape )
+        target = self.target
+        if target == "nearest" and image.tracks:
+            # The nearest target is the one which appears largest
+            target = max( image.tracks, key=lambda t: image.tracks[t][2] )
+        if target not in found:
+            image.contours = None
+            image.blobs    = None
+            return False
+
+        ((image.location, area),
+         image.contours, image.bestcontour, image.blobs) = found[target]
+        image.target = target
+        image.track  = image.tracks[target]
+        return True
+
+    def SelectTarget( self, target ):
+        """
+        Select the target to track by name (or "nearest") in multi-target mode.
+        """
+        self.target = target
+
+    # Draw the tracking results for the Image onto img
+    # (image.img, or a copy of it)
+    def Annotate( self, image, img ):
+        if image.contours is None and image.blobs is not None:
+            self._blobContours( image )
         if image.contours:
             # Draw all the contours in red
-            cv2.drawContours( image.img, image.contours,     -1, (0,0,255), 2 )
+            cv2.drawContours( img, image.contours,     -1, (0,0,255), 2 )
             # Draw the max contour in blue
-            cv2.drawContours( image.img, [image.bestcontour], 0, (255,0,0), 2 )
+            cv2.drawContours( img, [image.bestcontour], 0, (255,0,0), 2 )
 
         if image.location[0] is not None:
             # Draw a circle around the tracking point
-            cv2.circle( image.img, image.location, 20, (0,255,0), 2 );
+            cv2.circle( img, image.location, 20, (0,255,0), 2 );
+
+    def Showimage( self, image ):
+        self.Annotate( image, image.img )
 
         # update display windows
         cv2.imshow( "output", image.img )
@@ -100,32 +512,44 @@ class ColourTracker():
         cv2.waitKey( 100 )
         return
 
+    # Forget anything built from the HSV slice - it has changed
+    def _sliceChanged( self ):
+        self.lut = None
+
     def SetHSVSlice( self, hsv_slice ):
         if hsv_slice is not None:
             self.HSV_slice = hsv_slice
+            self._sliceChanged()
 
     def setHmin( self, value ):
         self.HSV_slice[0][0] = value
+        self._sliceChanged()
     
     def setHmax( self, value ):
         self.HSV_slice[1][0] = value
+        self._sliceChanged()
         
     def setSmin( self, value ):
         self.HSV_slice[0][1] = value
+        self._sliceChanged()
 
     def setSmax( self, value ):
         self.HSV_slice[1][1] = value
+        self._sliceChanged()
 
     def setVmin( self, value ):
         self.HSV_slice[0][2] = value
+        self._sliceChanged()
 
     def setVmax( self, value ):
         self.HSV_slice[1][2] = value
+        self._sliceChanged()
 
     def SetupHSVTuning( self, hsv_slice = None ):
         self.show_images = True
         if hsv_slice is not None:
             self.HSV_slice = hsv_slice
+            self._sliceChanged()
 
         windowname = "Trackbars"
         cv2.namedWindow( windowname, 1 )
@@ -0,0 +1,113 @@
+"""
+Load a corpus of recorded frames from disk as Image records for benchmarking.
+
+Frames may be jpeg files (*.jpg, *.jpeg) as captured by the camera, or raw
+numpy arrays (*.npy) of BGR images (height x width x 3) or YUV420 images
+((height * 3/2) x width). Directories are expanded to the frames in them,
+in name order.
+"""
+
+import os
+
+import numpy as np
+import cv2
+
+import imageprocessor
+
+extensions = (".jpg", ".jpeg", ".npy")
+
+class CorpusImage( imageprocessor.Image ):
+    """
+    An Image record loaded from a recorded frame.
+
+    Unlike a camera Image, reset() restores the recorded frame data, so the
+    same CorpusImage may be tracked over and over again.
+
+    Attributes:
+    filename:    The file the frame was loaded from
+    data:        The jpeg data of the frame (None for raw frames)
+    """
+    def __init__( self, filename, resolution = None, format = "jpeg", data = None ):
+        self.filename = filename
+        self.data     = data
+        # Capture jpeg frames into a buffer of their own size
+        buffer = (np.empty( len( data ), dtype=np.uint8 )
+                  if data is not None and resolution is None else None)
+        imageprocessor.Image.__init__( self, resolution, format, buffer )
+
+    def reset( self ):
+        imageprocessor.Image.reset( self )
+        if self.data is not None:
+            self.stream.write( self.data )
+            self.stream.seek( 0 )
+
+def framefiles( paths ):
+    """
+    Return the list of frame files in paths (files or directories).
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir( path ):
+            files.extend( os.path.join( path, f )
+                          for f in sorted( os.listdir( path ) )
+                          if os.path.splitext( f )[1].lower() in extensions )
+        else:
+            files.append( path )
+    return files
+
+def loadframe( filename, format = None ):
+    """
+    Load a recorded frame as a CorpusImage.
+
+    Arguments:
+        filename: The jpeg or numpy frame file
+        format:   Convert the frame to this capture format ("jpeg" or "bgr")
+                  (default: keep the recorded format)
+    """
+    if os.path.splitext( filename )[1].lower() == ".npy":
+        frame = np.load( filename )
+        if frame.ndim == 2:
+            # YUV420: full size Y plane followed by quarter size U and V
+            resolution = (frame.shape[1], frame.shape[0] * 2 // 3)
+            rawformat  = "yuv"
+        else:
+            resolution = (frame.shape[1], frame.shape[0])
+            rawformat  = "bgr"
+        if format == "bgr" and rawformat == "yuv":
+            frame, rawformat = cv2.cvtColor( frame, cv2.COLOR_YUV2BGR_I420 ), "bgr"
+    else:
+        with open( filename, "rb" ) as f:
+            data = f.read()
+        if format != "bgr":
+            return CorpusImage( filename, None, "jpeg", data )
+        frame = cv2.imdecode( np.frombuffer( data, dtype=np.uint8 ), 1 )
+        resolution = (frame.shape[1], frame.shape[0])
+        rawformat  = "bgr"
+    if format == "jpeg":
+        ok, data = cv2.imencode( ".jpg", frame if rawformat == "bgr" else
+                                 cv2.cvtColor( frame, cv2.COLOR_YUV2BGR_I420 ) )
+        return CorpusImage( filename, None, "jpeg", data.tobytes() )
+    image = CorpusImage( filename, resolution, rawformat )
+    width, height = resolution
+    if rawformat == "yuv":
+        # The Y, U and V planes are each padded in the capture buffer
+        padheight, padwidth = image.array.shape[0] * 2 // 3, image.array.shape[1]
+        image.array[:height, :width] = frame[:height]
+        chroma = frame[height:].reshape( 2, height // 2, width // 2 )
+        planes = image.array[padheight:].reshape( 2, padheight // 2, padwidth // 2 )
+        planes[:, :height // 2, :width // 2] = chroma
+    else:
+        image.array[:height, :width] = frame
+    return image
+
+def loadframes( paths, format = None ):
+    """
+    Load all the frames in paths (files or directories) as CorpusImages.
+    """
+    return [loadframe( f, format ) for f in framefiles( paths )]
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
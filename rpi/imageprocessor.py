@@ -7,48 +7,186 @@ workflows.
 
 import io
 
+import numpy as np
+
+class ArrayStream():
+    """
+    A minimal file-like object which writes straight into a preallocated buffer.
+
+    The picamera capture methods only need write() on their outputs, so raw
+    (unencoded) frames can be captured directly into a numpy array without
+    any intermediate BytesIO copies or reallocations. Like a BytesIO, the
+    data written is kept (getvalue()) after seeking back to the start.
+    """
+    def __init__( self, buffer ):
+        self.buffer   = memoryview( buffer )
+        self.position = 0
+        self.length   = 0     # End of the data written
+
+    def write( self, data ):
+        n = len( data )
+        end = self.position + n
+        if end > len( self.buffer ):
+            # Silently drop anything past the end of the frame buffer
+            end = len( self.buffer )
+            n   = end - self.position
+        self.buffer[self.position:end] = data[:n]
+        self.position = end
+        self.length   = max( self.length, end )
+        return n
+
+    def seek( self, position ):
+        self.position = position
+
+    def tell( self ):
+        return self.position
+
+    def truncate( self ):
+        self.length = self.position
+
+    def getvalue( self ):
+        return self.buffer[:self.length].tobytes()
+
+    def flush( self ):
+        pass
+
 # Each ImageProcessor has a stream for capturing images from the camera
 # and has a thread for processing it in the run() method.
-class Image():
+class Image( object ):
     """
     An object for image capture and processing on the raspberry pi.
 
-    This 
+    Each Image owns a fixed size capture buffer (and the working arrays for
+    the colour tracking) which are allocated once and reused every time the
+    Image is recycled, so there are no per frame allocations of frame sized
+    buffers in the capture/tracking loop.
 
     Methods:
     __init__():  Build the Image record
     reset():     Reset the Image record for re-use
                  (Some workflows may recycle records, rather than create and destroy)
+    view():      Return a (zero copy) numpy view of the captured data
+    allocate():  Allocate the working arrays (hsv, mask) for an image size
 
     Attributes:
-    stream:      A BytesIO stream for image capture from the PI Camera.
+    format:      The capture format: "jpeg", "yuv" or "bgr"
+    resolution:  Tuple of (width,height) of the captured image
+    buffer:      The preallocated 1-D uint8 capture buffer
+    stream:      An ArrayStream for image capture from the PI Camera: writes
+                 into "buffer" through a writable memoryview (a BytesIO if
+                 there is no buffer - a jpeg Image with no resolution)
+    array:       The capture buffer as a numpy image for the raw formats
+                 (None for jpeg)
+    bgr:         Preallocated BGR image for the decoded "yuv" captures
+    hsv:         Preallocated HSV image for the colour tracking
+    mask:        Preallocated threshold mask for the colour tracking
+    slot:        The slot of the buffer in a SharedFrames ring (or None)
     img:         The OpenCV Image for the processing workflows
     contours:    List of contours for the object identified
     bestcontour: Countour representing the object to be tracked
+    blobs:       Tuple of (labels, bestlabel, offset) from the connected
+                 components labelling (contours are found from it on demand)
     time:        Time of image capture
+    sequence:    The capture sequence number of the image
     location:    Tuple of (x,y) for centre of object to be tracked
                  (coords relative to top left of image)
     track:       Tuple of (x,y,area) for object to be tracked
                  (coords relative to centre of image)
+    tracks:      Dict of {name: track} for all targets found (multi-target mode)
+    target:      Name of the target in track (multi-target mode)
     """
-    sentinel = object()
+    __slots__ = ("format", "resolution", "buffer", "stream", "array",
+                 "bgr", "hsv", "mask", "slot",
+                 "img", "contours", "bestcontour", "blobs", "time", "sequence",
+                 "location", "track", "tracks", "target")
+    sentinel  = object()
+    formats   = ("jpeg", "yuv", "bgr")
 
-    def __init__( self ):
+    def __init__( self, resolution = None, format = "jpeg", buffer = None ):
         """
         Instantiate the Image object
+
+        Args:
+            resolution (tuple): (width, height) - required for the raw formats
+            format (str):       "jpeg", "yuv" (YUV420) or "bgr"
+            buffer (np.array):  Optional 1-D uint8 array to capture into
+                                (eg. a slot of a SharedFrames ring)
         """
-        self.stream         = io.BytesIO()
+        if format not in self.formats:
+            raise ValueError( "Image: unknown capture format: %s" % format )
+        self.format         = format
+        self.resolution     = resolution
+        self.array          = None
+        self.bgr            = None
+        self.hsv            = None
+        self.mask           = None
+        self.slot           = None
+        self.tracks         = {}
+        if buffer is None and resolution is not None:
+            # A jpeg is never bigger than the raw bgr frame
+            shape  = self.buffershape( resolution,
+                                       "bgr" if format == "jpeg" else format )
+            buffer = np.empty( int( np.prod( shape ) ), dtype=np.uint8 )
+        self.buffer         = buffer
+        if format == "jpeg":
+            self.stream     = (io.BytesIO() if buffer is None
+                               else ArrayStream( buffer ))
+        else:
+            shape = self.buffershape( resolution, format )
+            self.array      = buffer[:int( np.prod( shape ) )].reshape( shape )
+            self.stream     = ArrayStream( self.array.reshape( -1 ) )
+            if format == "yuv":
+                self.bgr    = np.empty( self.buffershape( resolution, "bgr" ),
+                                        dtype=np.uint8 )
+        if resolution is not None:
+            self.allocate( (resolution[1], resolution[0]) )
         self.reset()
 
+    @staticmethod
+    def buffershape( resolution, format ):
+        """
+        Return the shape of the raw capture buffer for this resolution and format.
+
+        The camera pads raw captures out to a width multiple of 32 and a
+        height multiple of 16.
+        """
+        width  = (resolution[0] + 31) // 32 * 32
+        height = (resolution[1] + 15) // 16 * 16
+        if format == "yuv":
+            # YUV420 (I420): full size Y plane followed by quarter size U and V
+            return (height * 3 // 2, width)
+        return (height, width, 3)
+
+    def allocate( self, shape ):
+        """
+        Allocate the working arrays for processing images of shape (height, width).
+        """
+        height, width = shape[:2]
+        if self.mask is None or self.mask.shape != (height, width):
+            self.hsv  = np.empty( (height, width, 3), dtype=np.uint8 )
+            self.mask = np.empty( (height, width), dtype=np.uint8 )
+
+    def view( self ):
+        """
+        Return a numpy view of the captured data (without copying it).
+        """
+        if isinstance( self.stream, ArrayStream ):
+            return self.buffer[:self.stream.length]
+        return np.frombuffer( self.stream.getvalue(), dtype=np.uint8 )
+
     def reset( self ):
         self.stream.seek( 0 )
         self.stream.truncate()
         self.img            = None
         self.contours       = None
-        self.bestcountour   = None
+        self.bestcontour    = None
+        self.blobs          = None
         self.time           = None
+        self.sequence       = None
         self.location       = (None, None)
         self.track          = (None, None, None)
+        self.tracks.clear()
+        self.target         = None
 
 # Local Variables:
 # python-indent: 4
@@ -0,0 +1,125 @@
+"""
+Provides the MJPEGStreamer: serve the latest annotated image as an MJPEG stream.
+
+Lets us watch the object tracking from a web browser (http://robot:8080/)
+without an X display on the robot. Only the newest image is ever kept, so
+publishing never blocks and slow clients just skip images.
+"""
+
+from __future__ import print_function
+import socket
+import threading
+
+import cv2
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:                             # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+class _StreamServer( ThreadingMixIn, HTTPServer ):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+class _StreamHandler( BaseHTTPRequestHandler ):
+    """
+    Send the stream of images to a client as a multipart http response.
+    """
+    def do_GET( self ):
+        streamer = self.server.streamer
+        self.send_response( 200 )
+        self.send_header( "Cache-Control", "no-cache, private" )
+        self.send_header( "Content-Type",
+                          "multipart/x-mixed-replace; boundary=FRAME" )
+        self.end_headers()
+        sequence = 0
+        try:
+            while not streamer.done:
+                sequence, frame = streamer.wait( sequence, timeout=1.0 )
+                if frame is None:
+                    continue
+                self.wfile.write( b"--FRAME\r\n"
+                                  b"Content-Type: image/jpeg\r\n"
+                                  b"Content-Length: " + str( len( frame ) ).encode()
+                                  + b"\r\n\r\n" )
+                self.wfile.write( frame )
+                self.wfile.write( b"\r\n" )
+        except (socket.error, IOError):
+            pass                                # The client went away
+
+    def log_message( self, format, *args ):
+        pass
+
+class MJPEGStreamer( threading.Thread ):
+    """
+    Serve the most recently published image as an MJPEG stream over http.
+
+    Methods:
+    publish(): Publish a new image (replacing any unsent image)
+    wait():    Wait for an image newer than the last one sent
+    close():   Shut down the http server
+    """
+    def __init__( self, port = 8080, address = "", quality = 80 ):
+        """
+        Start an http server streaming the published images.
+
+        Arguments:
+            port (int):    The http port to listen on
+            address (str): The address to listen on (default: all interfaces)
+            quality (int): The jpeg quality of the streamed images
+        """
+        super( MJPEGStreamer, self ).__init__()
+        self.quality    = quality
+        self.condition  = threading.Condition()
+        self.frame      = None    # jpeg data of the newest image
+        self.sequence   = 0       # Count of images published
+        self.done       = False
+        self.daemon     = True
+        self.server     = _StreamServer( (address, port), _StreamHandler )
+        self.server.streamer = self
+        self.start()
+
+    def run( self ):
+        self.server.serve_forever()
+
+    def publish( self, img ):
+        """
+        Publish an OpenCV image to the stream.
+        """
+        ok, data = cv2.imencode( ".jpg", img,
+                                 [int( cv2.IMWRITE_JPEG_QUALITY ), self.quality] )
+        if not ok:
+            return
+        with self.condition:
+            self.frame     = data.tobytes()
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def wait( self, sequence, timeout = None ):
+        """
+        Wait for an image newer than "sequence".
+
+        Returns:
+            (sequence, jpeg data) of the newest image (data is None on timeout)
+        """
+        with self.condition:
+            if self.sequence == sequence and not self.done:
+                self.condition.wait( timeout )
+            if self.sequence == sequence:
+                return (sequence, None)
+            return (self.sequence, self.frame)
+
+    def close( self ):
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
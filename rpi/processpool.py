@@ -0,0 +1,212 @@
+"""
+Process based image tracking with the frames in shared memory.
+
+The thread based WorkerPool can't use all the cores of the Raspberry Pi for
+image tracking, as the Python glue between the OpenCV calls holds the GIL.
+The ProcessPool runs the tracker in worker processes instead. The Images are
+captured straight into a SharedFrames ring of fixed size buffers in shared
+memory, so only a small descriptor (slot, capture time, data length) is
+passed to the worker processes, and only the (found, location, track)
+results come back.
+"""
+
+from __future__ import print_function
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+import imageprocessor
+import workflow
+
+class SharedFrames():
+    """
+    A ring of fixed size frame buffers in shared memory.
+
+    Methods:
+    buffer(): The 1-D uint8 numpy array for a slot of the ring
+    images(): Build an Image record to capture into each slot of the ring
+    """
+    def __init__( self, count, resolution, format = "jpeg" ):
+        """
+        Allocate the shared memory for the ring.
+
+        Arguments:
+            count (int):        The number of frame buffers (slots)
+            resolution (tuple): (width, height) of the captured images
+            format (str):       The capture format: "jpeg", "yuv" or "bgr"
+        """
+        self.count      = count
+        self.resolution = resolution
+        self.format     = format
+        # Raw frames are a fixed size - allow a jpeg up to the size of a raw frame
+        shape = imageprocessor.Image.buffershape(
+            resolution, format if format != "jpeg" else "bgr" )
+        self.slotsize   = int( np.prod( shape ) )
+        self.memory     = multiprocessing.RawArray( 'B', count * self.slotsize )
+
+    def buffer( self, slot ):
+        return np.frombuffer( self.memory, dtype=np.uint8,
+                              count=self.slotsize, offset=slot * self.slotsize )
+
+    def image( self, slot ):
+        image = imageprocessor.Image( self.resolution, self.format,
+                                      self.buffer( slot ) )
+        image.slot = slot
+        return image
+
+    def images( self ):
+        return [self.image( slot ) for slot in range( self.count )]
+
+def _trackframes( tracker, frames, tasks, results ):
+    """
+    The worker process: track the Images in the shared frames.
+
+    Receives (slot, capture time, data length) descriptors on tasks and
+    sends (slot, found, location, track) back on results.
+    """
+    images = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, capturetime, length = task
+        image = images.get( slot )
+        if image is None:
+            image = images[slot] = frames.image( slot )
+        image.reset()
+        image.stream.length = length
+        image.time = capturetime
+        try:
+            found = tracker.Track( image )
+        except Exception as e:
+            print( "ProcessPool: Track() failed:", e )
+            found = False
+        results.put( (slot, found, image.location, image.track) )
+
+class ProcessPool():
+    """
+    A pool of processes to track Images in SharedFrames off a queue.
+
+    Has the count() and close() methods of a WorkerPool so it can be managed
+    by a WorkflowManager.
+    """
+    sentinel = workflow.Worker.sentinel
+
+    def __init__( self, numberofworkers, tracker, frames,
+                  inputqueue, outputqueue, processor = None ):
+        """
+        Start the worker processes.
+
+        Args:
+        - numberofworkers:  The number of worker processes to create.
+        - tracker:          The tracker (eg. ColourTracker) run in each process
+        - frames:           The SharedFrames the Images are captured into
+        - inputqueue:       The queue for receiving Images for tracking
+        - outputqueue:      The queue to put Images on when they are tracked
+        - processor:        Optional function called with (image, found) for
+                            each tracked Image (in the results thread)
+        """
+        self.numberofworkers = numberofworkers
+        self.frames          = frames
+        self.inputqueue      = inputqueue
+        self.outputqueue     = outputqueue
+        self.processor       = processor
+        self.tasks           = multiprocessing.Queue()
+        self.results         = multiprocessing.Queue()
+        self.pending         = {}      # The Images being tracked, by slot
+        self.lock            = threading.Lock()
+        self.counter         = 0
+        self.processing      = workflow.Histogram()  # Times to track the Images
+        self.starttime       = time.time()
+        self.processes       = []
+        for i in range( numberofworkers ):
+            process = multiprocessing.Process(
+                target=_trackframes,
+                args=(tracker, frames, self.tasks, self.results) )
+            process.daemon = True
+            process.start()
+            self.processes.append( process )
+        self.feeder    = threading.Thread( target=self._feed )
+        self.collector = threading.Thread( target=self._collect )
+        self.feeder.start()
+        self.collector.start()
+
+    def _feed( self ):
+        # Pass descriptors of the Images on the input queue to the processes
+        while True:
+            image = self.inputqueue.get()
+            if image is self.sentinel:
+                break
+            with self.lock:
+                self.pending[image.slot] = (image, time.time())
+            length = image.stream.length if image.format == "jpeg" else 0
+            self.tasks.put( (image.slot, image.time, length) )
+
+    def _collect( self ):
+        # Apply the results from the processes to the Images
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            slot, found, location, track = result
+            with self.lock:
+                image, senttime = self.pending.pop( slot )
+            self.processing.add( time.time() - senttime )
+            image.location, image.track = location, track
+            try:
+                if self.processor is not None:
+                    self.processor( image, found )
+                self.counter += 1
+            finally:
+                if self.outputqueue is not None:
+                    self.outputqueue.put( image )
+
+    def count( self ):
+        """
+        Get the number of Images tracked by the pool.
+        """
+        return self.counter
+
+    def snapshot( self ):
+        """
+        Return the metrics for the pool (as WorkerPool.snapshot()). The
+        processing time includes the passing of the descriptors and results,
+        and busy is estimated from the processing times.
+        """
+        waits = getattr( self.inputqueue, "waits", None )
+        elapsedtime = (time.time() - self.starttime) * self.numberofworkers
+        return {
+            "name":       "processes",
+            "count":      self.count(),
+            "processing": self.processing.summary(),
+            "wait":       waits.summary() if waits is not None else None,
+            "depth":      {"p95": len( self.pending )},
+            "queued":     self.inputqueue.qsize(),
+            "busy":       min( 1.0, self.processing.total / elapsedtime )
+                          if elapsedtime > 0 else 0.0,
+            }
+
+    def close( self ):
+        """
+        Finish tracking the queued Images and close down the processes.
+        """
+        self.inputqueue.put( self.sentinel )
+        self.feeder.join()
+        for process in self.processes:
+            self.tasks.put( None )
+        for process in self.processes:
+            process.join()
+        self.results.put( None )
+        self.collector.join()
+        # Stop the queue feeder threads
+        for queue in (self.tasks, self.results):
+            queue.close()
+            queue.join_thread()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
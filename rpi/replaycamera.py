@@ -0,0 +1,184 @@
+"""
+Provides the ReplayCamera: a drop-in frame source for CameraCapture which
+replays recorded frames instead of capturing from the Raspberry Pi camera.
+
+Replays jpeg or numpy frame files (see framecorpus) or a video file into the
+same Image recycling queues as the picamera, either paced in real time or as
+fast as the processing workflow takes the Images.
+"""
+
+import os
+import time
+
+import numpy as np
+import cv2
+
+import framecorpus
+import imageprocessor
+
+videoextensions = (".avi", ".mp4", ".mkv", ".h264", ".mjpeg")
+
+class ReplayCamera():
+    """
+    Replay recorded frames with the picamera interface used by CameraCapture.
+
+    Methods:
+    capture_sequence(): Write the frames to the outputs (as PiCamera does)
+    start_preview():    Does nothing
+    close():            Stop replaying
+
+    Attributes:
+    resolution: (width, height) of the replayed frames
+    count:      Number of frames replayed
+    finished:   True when all the frames have been replayed
+    """
+    def __init__( self, source, realtime = True, loop = False, framerate = None ):
+        """
+        Construct a frame source to replay recorded frames.
+
+        Arguments:
+            source (list):     Frame files or directories, or a single video file
+            realtime (bool):   Pace the frames at their original timestamps
+                               (False: replay as fast as they are consumed)
+            loop (bool):       Start again at the first frame after the last
+            framerate (float): Pace at this rate instead of the timestamps
+                               (frame file modification times, or video times)
+        """
+        self.source     = list( source )
+        self.realtime   = realtime
+        self.loop       = loop
+        self.framerate  = framerate
+        self.count      = 0
+        self.finished   = False
+        self.closed     = False
+        self.video      = (len( self.source ) == 1 and
+                           os.path.splitext( self.source[0] )[1].lower()
+                           in videoextensions)
+        self.files      = None if self.video else framecorpus.framefiles( self.source )
+        # Get the resolution from the first frame
+        for timestamp, data, frame in self._readframes():
+            if frame is None:
+                frame = cv2.imdecode( np.frombuffer( data, dtype=np.uint8 ), 1 )
+            self.resolution = (frame.shape[1], frame.shape[0])
+            break
+        else:
+            raise ValueError( "ReplayCamera: no frames in %s" % self.source )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_val, exc_tb ):
+        self.close()
+
+    def start_preview( self ):
+        pass
+
+    def close( self ):
+        self.closed = True
+
+    def _readframes( self ):
+        """
+        Generator to yield (timestamp, jpeg data, bgr frame) for each frame.
+        Only one of jpeg data or bgr frame is set.
+        """
+        if self.video:
+            video = cv2.VideoCapture( self.source[0] )
+            try:
+                while True:
+                    ok, frame = video.read()
+                    if not ok:
+                        break
+                    yield (video.get( cv2.CAP_PROP_POS_MSEC ) / 1000.0, None, frame)
+            finally:
+                video.release()
+            return
+        for filename in self.files:
+            timestamp = os.path.getmtime( filename )
+            if os.path.splitext( filename )[1].lower() == ".npy":
+                frame = np.load( filename )
+                if frame.ndim == 2:
+                    frame = cv2.cvtColor( frame, cv2.COLOR_YUV2BGR_I420 )
+                yield (timestamp, None, frame)
+            else:
+                with open( filename, "rb" ) as f:
+                    yield (timestamp, f.read(), None)
+
+    def _encode( self, data, frame, format ):
+        """
+        Return the frame as the bytes the camera would write in this format.
+        """
+        if format == "jpeg":
+            if data is None:
+                ok, data = cv2.imencode( ".jpg", frame )
+                data = data.tobytes()
+            return data
+        if frame is None:
+            frame = cv2.imdecode( np.frombuffer( data, dtype=np.uint8 ), 1 )
+        width, height = self.resolution
+        if (frame.shape[1], frame.shape[0]) != self.resolution:
+            frame = cv2.resize( frame, self.resolution )
+        # Pad out the frame the same way the camera does
+        if format == "yuv":
+            frame = cv2.cvtColor( frame, cv2.COLOR_BGR2YUV_I420 )
+            shape = imageprocessor.Image.buffershape( self.resolution, format )
+            if frame.shape != shape:
+                padded = np.zeros( shape, np.uint8 )
+                # The Y, U and V planes are each padded
+                fw, fh = shape[1], shape[0] * 2 // 3
+                padded[:height, :width] = frame[:height]
+                u = frame[height:height + height // 4].reshape( height // 2, width // 2 )
+                v = frame[height + height // 4:].reshape( height // 2, width // 2 )
+                planes = padded[fh:].reshape( 2, fh // 2, fw // 2 )
+                planes[0, :height // 2, :width // 2] = u
+                planes[1, :height // 2, :width // 2] = v
+                frame = padded
+        else:
+            shape = imageprocessor.Image.buffershape( self.resolution, format )
+            if frame.shape != shape:
+                padded = np.zeros( shape, np.uint8 )
+                padded[:height, :width] = frame
+                frame = padded
+        return frame.tobytes()
+
+    def capture_sequence( self, outputs, format = "jpeg", use_video_port = False ):
+        """
+        Write the recorded frames to the outputs in turn (like PiCamera).
+
+        Returns when the outputs are exhausted, the camera is closed, or all
+        the frames have been replayed (unless looping).
+        """
+        outputs   = iter( outputs )
+        starttime = None
+        while not self.closed:
+            replayed = 0
+            for timestamp, data, frame in self._readframes():
+                if self.closed:
+                    return
+                if self.framerate:
+                    timestamp = self.count / float( self.framerate )
+                if starttime is None:
+                    starttime = (time.time(), timestamp)
+                if self.realtime:
+                    # Wait till this frame is due
+                    delay = (starttime[0] + timestamp - starttime[1]) - time.time()
+                    if delay > 0:
+                        time.sleep( delay )
+                buffer = self._encode( data, frame, format )
+                try:
+                    output = next( outputs )
+                except StopIteration:
+                    return
+                output.write( buffer )
+                self.count += 1
+                replayed   += 1
+            if not self.loop or replayed == 0:
+                break
+            # Restart the pacing for the next time through the frames
+            starttime = None
+        self.finished = True
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
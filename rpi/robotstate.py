@@ -0,0 +1,152 @@
+"""
+The state of the robot: as sent by the Arduino (Robot::sendstate()) and as
+targeted by the controllers.
+
+Classes:
+    RobotState: The fields of the robot state in a flat list of values.
+"""
+
+from __future__ import print_function
+import json
+import time
+
+# Scan one JSON value (without the checks for surrounding whitespace)
+_scan = json.JSONDecoder().scan_once
+
+class RobotState( object ):
+    """
+    The robot state: a fixed schema of fields, kept in place in one flat
+    list of values (in the order of listofkeys()).
+
+    The fields are read and written as attributes (eg. state.head), and
+    update()/state() decode the JSON (or dictionaries) of the state into
+    the values. Unknown keys are ignored, and a field without its list
+    of values raises ValueError (as a line which is not JSON does).
+    """
+    __slots__ = ("values",)
+
+    # The fields and their number of values
+    schema = (
+        ("time",     1),
+        ("head",     2),
+        ("setspeed", 2),
+        ("speed",    2),
+        ("counts",   2),
+        ("power",    2),
+        ("pid",      3),
+    )
+
+    keys = [
+        "time",
+        "headX", "headY",
+        "setspeedL", "setspeedR",
+        "speedL", "speedR",
+        "countsL", "countsR",
+        "powerL", "powerR",
+        "Kp", "Ki", "Kd"
+    ]
+
+    def __init__( self, pid = (0.2, 0.0, 0.0) ):
+        self.values = [0] * (len( self.keys ) - 3) + list( pid )
+
+    def _set( self, d ):
+        values = self.values
+        fields = self.fields
+        for key in d:
+            field = fields.get( key )
+            if field is not None:
+                value = d[key]
+                if (not isinstance( value, (list, tuple) ) or
+                        len( value ) != field.stop - field.start):
+                    raise ValueError( "RobotState: %s needs %d values: %r"
+                                      % (key, field.stop - field.start, value) )
+                values[field] = value
+            elif key == "time":
+                values[0] = d[key]
+            elif key == "target" and isinstance( d[key], dict ):
+                self._set( d[key] )
+
+    def update( self, s ):
+        """
+        Update the fields from a line of JSON state (text or bytes, eg. an
+        MQTT payload), or its dictionary.
+
+        Returns:
+            The dictionary of the state.
+        """
+        if isinstance( s, dict ):
+            d = s
+        else:
+            if isinstance( s, bytes ) and not isinstance( s, str ):
+                s = s.decode( "latin-1" )
+            try:
+                # The line is one JSON object: call the (C) scanner directly
+                d = _scan( s, 0 )[0]
+            except StopIteration:
+                d = json.loads( s )     # Raises the ValueError
+            if not isinstance( d, dict ):
+                raise ValueError( "RobotState: not a JSON object: %r" % s )
+        self._set( d )
+        return d
+
+    def listofvalues( self ):
+        return list( self.values )
+
+    def listofkeys( self ):
+        return list( self.keys )
+
+    def state( self, d ):
+        """
+        Update the fields from a dictionary of a command (a "target" is
+        unwrapped) and set the time to now.
+
+        Returns:
+            The JSON text of the dictionary (to send the command).
+        """
+        s = json.dumps( d, separators=(',',':') )
+        self._set( d )
+        self.values[0] = time.time()
+        return s
+
+    def asdict( self ):
+        values = self.values
+        return dict( (key, values[start] if start == 0 else values[start:stop])
+                     for key, (start, stop) in self.offsets.items() )
+
+    def json( self ):
+        return json.dumps( self.asdict(), separators=(',',':') )
+
+def _field( start, stop ):
+    if start == 0:
+        def get( self ):
+            return self.values[0]
+        def set( self, value ):
+            self.values[0] = value
+    else:
+        def get( self ):
+            return self.values[start:stop]
+        def set( self, value ):
+            if not isinstance( value, (list, tuple) ) or len( value ) != stop - start:
+                raise ValueError( "RobotState: needs %d values: %r"
+                                  % (stop - start, value) )
+            self.values[start:stop] = value
+    return property( get, set )
+
+# The (start, stop) of the values of each field, the slices of the list
+# fields and the field attributes
+RobotState.offsets = {}
+RobotState.fields  = {}
+_start = 0
+for _key, _size in RobotState.schema:
+    RobotState.offsets[_key] = (_start, _start + _size)
+    if _start > 0:
+        RobotState.fields[_key] = slice( _start, _start + _size )
+    setattr( RobotState, _key, _field( _start, _start + _size ) )
+    _start += _size
+del _start, _key, _size
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
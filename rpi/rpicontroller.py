@@ -9,13 +9,13 @@ Classes:
 
 from __future__ import print_function
 import argparse
-import itertools
-import time
-import json
 import sys, tty, termios
+import time
 
 import paho.mqtt.client as mqtt
 
+import robotstate
+
 parser = argparse.ArgumentParser(
     description='Run the RPI-arduino proxy control program.'
     )
@@ -51,7 +51,12 @@ class MqRobot( mqtt.Client ):
         #       str( msg.qos ) + " " + str( msg.payload ),
         #       end="\r\n" )
         # Update the robot state
-        self.robot.robotstate.state( json.loads( msg.payload ) )
+        try:
+            self.robot.robotstate.update( msg.payload )
+        except ValueError as e:
+            print( e, msg.payload, end="\r\n" )
+            return
+        self.robot.robotstate.time = time.time()     # The time it arrived here
         print( *self.robot.robotstate.listofvalues(), sep=',',
                file=self.robot.datafile )
 
@@ -70,55 +75,6 @@ class MqRobot( mqtt.Client ):
         return self.publish( "/mollie-robot/target", state, qos=0, retain=True )
 
 
-class RobotState:
-    def __init__( self ):
-        self.time       = 0
-        self.head       = [0,0]
-        self.setspeed   = [0,0]
-        self.speed      = [0,0]
-        self.counts     = [0,0]
-        self.power      = [0,0]
-
-    def update( self, s ):
-        print( "Line =", s, end="\r\n" )
-        d = json.loads( s )
-        self.__dict__.update( d )
-        # print( "Robot =", self.__dict__, end="\r\n" )
-        return d
-
-    def listofvalues( self ):
-        return list(
-            itertools.chain(
-                [self.time],
-                self.head,
-                self.setspeed,
-                self.speed,
-                self.counts,
-                self.power,
-            )
-        )
-    
-    def listofkeys( self ):
-        return [
-            "time",
-            "headX", "headY",
-            "setspeedL", "setspeedR",
-            "speedL", "speedR",
-            "countsL", "countsR",
-            "powerL", "powerR",
-            "Kp", "Ki", "Kd"
-        ]
-
-    def state( self, d ):
-        s = json.dumps( d, separators=(',',':') )
-        self.__dict__.update( d )
-        self.time = time.time()
-        # print( "Target=", self.__dict__, end="\r\n" )
-        return s
-
-    def json( self ):
-        return json.dumps( self.__dict__, separators=(',',':') )
-
 class RobotController():
     """
     An interface to an Arduino controlled robot.
@@ -144,8 +100,8 @@ class RobotController():
         self.angleX     = 0
         self.angleY     = 0
         self.trackingOn = False
-        self.targetstate= RobotState()
-        self.robotstate = RobotState()
+        self.targetstate= robotstate.RobotState()
+        self.robotstate = robotstate.RobotState()
         self.mqrobot    = MqRobot( self )
         self.datafile   = open( "./robbie.csv", "w", 1 )
 
@@ -8,7 +8,6 @@ Classes:
 """
 
 from __future__ import print_function
-import itertools
 import time
 import json
 import sys, tty, termios
@@ -19,56 +18,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 
-class RobotState:
-    def __init__( self ):
-        self.time       = 0
-        self.head       = [0,0]
-        self.setspeed   = [0,0]
-        self.speed      = [0,0]
-        self.counts     = [0,0]
-        self.power      = [0,0]
-        self.pid        = [0.7, 0.0, 0.0 ]
-
-    def update( self, s ):
-        print( "Line =", s, end="\r\n" )
-        d = json.loads( s )
-        self.__dict__.update( d )
-        # print( "Robot =", self.__dict__, end="\r\n" )
-        return d
-
-    def listofvalues( self ):
-        return list(
-            itertools.chain(
-                [self.time],
-                self.head,
-                self.setspeed,
-                self.speed,
-                self.counts,
-                self.power,
-                self.pid
-            )
-        )
-    
-    def listofkeys( self ):
-        return [
-            "time",
-            "headX", "headY",
-            "setspeedL", "setspeedR",
-            "speedL", "speedR",
-            "countsL", "countsR",
-            "powerL", "powerR",
-            "Kp", "Ki", "Kd"
-        ]
-
-    def state( self, d ):
-        s = json.dumps( d, separators=(',',':') )
-        self.__dict__.update( d )
-        self.time = time.time()
-        # print( "Target=", self.__dict__, end="\r\n" )
-        return s
-
-    def json( self ):
-        return json.dumps( self.__dict__, separators=(',',':') )
+import robotstate
 
 class MqRobot( mqtt.Client ):
     """
@@ -76,7 +26,7 @@ class MqRobot( mqtt.Client ):
     """
     def __init__( self, clientid = None ):
         super( MqRobot, self ).__init__( clientid )
-        self.robotstate   = RobotState()
+        self.robotstate   = robotstate.RobotState( pid = [0.7, 0.0, 0.0] )
         self.df           = pd.DataFrame( columns=self.robotstate.listofkeys() )
         self.on_connect   = self._on_connect
         self.on_subscribe = self._on_subscribe
@@ -103,7 +53,12 @@ class MqRobot( mqtt.Client ):
         #       str( msg.qos ) + " " + str( msg.payload ),
         #       end="\r\n" )
         # Update the robot state
-        self.robotstate.state( json.loads( msg.payload ) )
+        try:
+            self.robotstate.update( msg.payload )
+        except ValueError as e:
+            print( e, msg.payload, end="\r\n" )
+            return
+        self.robotstate.time = time.time()     # The time it arrived here
         if (self.savedata):
             self.df.loc[len(self.df)] = self.robotstate.listofvalues()
 
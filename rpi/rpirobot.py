@@ -14,6 +14,10 @@ parser.add_argument(
     "--show", action="store_true",
     help="Display the captured and processed images for tracking"
     )
+parser.add_argument(
+    "--stream", type=int, metavar="PORT",
+    help="Stream the processed images as MJPEG over http on this port"
+    )
 parser.add_argument(
     "--preview", action="store_true",
     help="Show the pi-camera preview window"
@@ -22,43 +26,179 @@ parser.add_argument(
     "--nocamera", action="store_true",
     help="Do not use the Raspberry Pi camera"
     )
+parser.add_argument(
+    "--engine", default="colour", choices=["colour", "camshift"],
+    help="Object tracking engine: colour thresholding or CamShift back-projection"
+    )
+parser.add_argument(
+    "--replay", nargs="+", metavar="PATH",
+    help="Replay recorded frame files/directories or a video file instead of the camera"
+    )
+parser.add_argument(
+    "--fast", action="store_true",
+    help="Replay frames as fast as they can be processed (not in real time)"
+    )
+parser.add_argument(
+    "--loop", action="store_true",
+    help="Keep replaying the recorded frames"
+    )
 parser.add_argument(
     "--nocontours", action="store_true",
     help="Eliminate the contour finding part of the object tracking"
     )
+parser.add_argument(
+    "--components", action="store_true",
+    help="Find the object by connected components labelling instead of contours"
+    )
+parser.add_argument(
+    "--morphology", default="iterate", choices=["iterate", "kernel", "separable"],
+    help="How to erode and dilate the threshold mask"
+    )
+parser.add_argument(
+    "--morphcrop", action="store_true",
+    help="Only erode and dilate the bounding box of the threshold mask"
+    )
+parser.add_argument(
+    "--roi", action="store_true",
+    help="Only search a window around the last location of the tracked object"
+    )
+parser.add_argument(
+    "--pyramid", type=int, default=0, choices=[0,1,2],
+    help="Search a 2**PYRAMID downscaled image first, then refine at full size"
+    )
+parser.add_argument(
+    "--lut", action="store_true",
+    help="Use a colour lookup table for the HSV thresholding "
+    "(usually slower than cvtColor+inRange: check with benchthreshold.py)"
+    )
+parser.add_argument(
+    "--target", default=None,
+    help="Name of the HSV slice to track, or \"nearest\" with --targets "
+    "(default: bluething, or \"nearest\" with --targets)"
+    )
+parser.add_argument(
+    "--targets", nargs="+", metavar="TARGET",
+    help="Track all these HSV slices from one HSV conversion per image"
+    )
+parser.add_argument(
+    "--predict", action="store_true",
+    help="Predict the object position to compensate for tracking latency"
+    )
+parser.add_argument(
+    "--latency", type=float, default=0.1,
+    help="Expected delay (seconds) from sending a track command to the servos moving"
+    )
+parser.add_argument(
+    "--resolution", type=int, nargs=2, default=[320, 240],
+    help="Camera resolution (width height)"
+    )
+parser.add_argument(
+    "--framerate", type=int, default=10,
+    help="Camera capture framerate"
+    )
+parser.add_argument(
+    "--format", default="jpeg", choices=["jpeg", "yuv", "bgr"],
+    help="Camera capture format (yuv and bgr skip the jpeg encode/decode)"
+    )
+parser.add_argument(
+    "--queuesize", type=int, default=0,
+    help="Keep only the newest N images waiting for tracking (1: latest image wins)"
+    )
+parser.add_argument(
+    "--maxage", type=float, default=None,
+    help="Drop images older than this (seconds) instead of tracking them"
+    )
+parser.add_argument(
+    "--pipeline", metavar="FILE",
+    help="Load the image processing pipeline description from a yaml/json FILE"
+    )
+parser.add_argument(
+    "--metrics", type=float, default=None, metavar="SECONDS",
+    help="Print the workflow latency and queue metrics every SECONDS"
+    )
+parser.add_argument(
+    "--processes", type=int, default=0, choices=[0,1,2,3,4,5,6,7,8],
+    help="Number of processes to use for the image tracking (instead of threads)"
+    )
 parser.add_argument(
     "--threads", type=int, default=2, choices=[1,2,3,4,5,6,7,8],
     help="Number of threads to use for the image processing"
     )
 args = parser.parse_args()
 
-import picamera
-
 import arduinorobot
 import colourtracker
+import camshifttracker
 import trackingrobot
+import targetpredictor
+import mjpegstreamer
 import hsvvalues
 
+if args.target is None:
+    args.target = "nearest" if args.targets else "bluething"
+for name in (args.targets or [args.target]):
+    if name not in hsvvalues.hsvvalues:
+        parser.error( "unknown target: %s" % name )
+if args.targets and args.target not in args.targets + ["nearest"]:
+    parser.error( "--target must be one of --targets or \"nearest\"" )
+if args.processes and (args.show or args.stream is not None or args.tunehsv):
+    parser.error( "--processes does not support displaying the images" )
+if args.processes and not (args.replay or not args.nocamera):
+    parser.error( "--processes needs the camera (or --replay)" )
+if args.targets and args.engine == "camshift":
+    parser.error( "--targets is not supported by the camshift engine" )
+
+# Load the image processing pipeline description
+pipeline = None
+if args.pipeline:
+    import yaml
+    with open( args.pipeline, 'r' ) as f:
+        pipeline = yaml.safe_load( f )
+
+if pipeline and args.stream is None and any(
+        stage.get( "processor" ) == "streamimage"
+        for stage in pipeline.get( "stages", [] )):
+    parser.error( "the pipeline streams the images (streamimage): "
+                  "give --stream PORT, or use displayimage" )
+
 # Create a Robot instance
 robot = arduinorobot.ArduinoRobot()
 
-# Create a ColourTracker instance to track objects
-tracker = colourtracker.ColourTracker(
-    hsv_slice        = hsvvalues.hsvvalues["bluething"],
+# Create a ColourTracker (or CamShiftTracker) instance to track objects
+trackerclass = (camshifttracker.CamShiftTracker if args.engine == "camshift"
+                else colourtracker.ColourTracker)
+tracker = trackerclass(
+    hsv_slice        = hsvvalues.hsvvalues.get( args.target ),
     use_contours     = not args.nocontours,
     show_images      = args.show,
-    tune_hsv         = args.tunehsv
+    tune_hsv         = args.tunehsv,
+    use_roi          = args.roi,
+    use_lut          = args.lut,
+    targets          = (dict( (name, hsvvalues.hsvvalues[name])
+                              for name in args.targets )
+                        if args.targets else None),
+    target           = args.target,
+    pyramid          = args.pyramid,
+    use_components   = args.components,
+    morphology       = colourtracker.Morphology( method = args.morphology,
+                                                 crop   = args.morphcrop )
     )
 
-# Setup the Raspberry Pi camera
+# Setup the Raspberry Pi camera (or replay recorded frames)
 camera = None
-if not args.nocamera:
+if args.replay:
+    import replaycamera
+    camera = replaycamera.ReplayCamera( args.replay,
+                                        realtime = not args.fast,
+                                        loop     = args.loop )
+elif not args.nocamera:
+    import picamera
     camera = picamera.PiCamera()
-    resolution = (320, 240)
+    resolution = tuple( args.resolution )
     camera.preview_fullscreen = False
     camera.preview_window     = (100, 100, resolution[0], resolution[1])
     camera.resolution         = resolution
-    camera.framerate          = 10
+    camera.framerate          = args.framerate
     # camera.exposure_mode    = 'off'
     camera.iso                = 800
     camera.image_effect       = 'blur'
@@ -73,8 +213,19 @@ trackingrobot = trackingrobot.TrackingRobot(
     robot            = robot,
     tracker          = tracker,
     camera           = camera,
-    show_images      = args.show,
-    showpreview      = args.preview
+    showimages       = args.show or args.stream is not None,
+    showpreview      = args.preview,
+    captureformat    = args.format,
+    predictor        = (targetpredictor.TargetPredictor( latency = args.latency )
+                        if args.predict else None),
+    streamer         = (mjpegstreamer.MJPEGStreamer( args.stream )
+                        if args.stream is not None else None),
+    processes        = args.processes,
+    threads          = args.threads,
+    queuesize        = args.queuesize,
+    maxage           = args.maxage,
+    metrics          = args.metrics,
+    pipeline         = pipeline
     )
 
 # Now turn on the robot which will:
@@ -0,0 +1,107 @@
+"""
+Provides the TargetPredictor to compensate for the latency in tracking objects.
+
+There is a delay between the capture of an image and the track command
+reaching the head servos on the Arduino. The TargetPredictor filters the
+tracked positions with a constant velocity (alpha-beta) filter keyed on the
+capture time of each image, and extrapolates the position of the object to
+the time the command is expected to take effect. It also bridges short
+dropouts when the object is not found in an image.
+"""
+
+import threading
+import time
+
+class TargetPredictor():
+    """
+    A constant velocity (alpha-beta) filter to predict the position of an object.
+
+    Methods:
+    update(): Update the filter with a tracked position and return the prediction
+    coast():  Return the prediction when the object was not found in an image
+    reset():  Forget the object
+
+    Attributes:
+    alpha:      Position gain of the filter (0 to 1)
+    beta:       Velocity gain of the filter (0 to 1)
+    latency:    Expected delay (seconds) from sending a command to it taking effect
+    maxdropout: How long (seconds) to keep predicting after losing the object
+    """
+    def __init__( self, alpha = 0.5, beta = 0.1, latency = 0.1, maxdropout = 0.5 ):
+        self.alpha      = alpha
+        self.beta       = beta
+        self.latency    = latency
+        self.maxdropout = maxdropout
+        self.lock       = threading.Lock()
+        self.reset()
+
+    def reset( self ):
+        """
+        Forget the object - the next update() will restart the filter.
+        """
+        self.time     = None          # Capture time of the last update
+        self.position = (0.0, 0.0)
+        self.velocity = (0.0, 0.0)
+        self.area     = 0
+
+    def _predict( self, when ):
+        # Extrapolate the filtered position to the given time
+        dt = when - self.time
+        return (self.position[0] + self.velocity[0] * dt,
+                self.position[1] + self.velocity[1] * dt,
+                self.area)
+
+    def update( self, capturetime, track ):
+        """
+        Update the filter with the position of the object in an image.
+
+        Arguments:
+            capturetime: Time the image was captured (image.time)
+            track:       The (x, y, area) of the object in the image (image.track)
+        Returns:
+            The (x, y, area) of the object predicted for when a command sent
+            now will take effect.
+        """
+        x, y, area = track
+        with self.lock:
+            if self.time is None or capturetime - self.time > self.maxdropout:
+                # First sighting (or lost it for too long) - restart the filter
+                self.time     = capturetime
+                self.position = (float( x ), float( y ))
+                self.velocity = (0.0, 0.0)
+            elif capturetime > self.time:
+                dt = capturetime - self.time
+                px, py = self._predict( capturetime )[:2]
+                rx, ry = x - px, y - py
+                self.position = (px + self.alpha * rx,
+                                 py + self.alpha * ry)
+                self.velocity = (self.velocity[0] + self.beta * rx / dt,
+                                 self.velocity[1] + self.beta * ry / dt)
+                self.time     = capturetime
+            # else: an older image finished processing late - ignore it
+            self.area = area
+            return self._predict( time.time() + self.latency )
+
+    def coast( self, capturetime ):
+        """
+        Predict the position of the object when it was not found in an image.
+
+        Arguments:
+            capturetime: Time the image was captured (image.time)
+        Returns:
+            The predicted (x, y, area) of the object, or None if the object
+            has been lost for longer than maxdropout.
+        """
+        with self.lock:
+            if self.time is None:
+                return None
+            if capturetime - self.time > self.maxdropout:
+                self.reset()
+                return None
+            return self._predict( time.time() + self.latency )
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,125 @@
+"""
+Test the commands from the controllers through the proxy to the robot.
+
+The ArduinoRobot commands (as published to the MQTT broker) are passed to
+the ArduinoProxy, which sends them to an ArduinoEmulator on a pty.
+"""
+
+from __future__ import print_function
+import json
+import os
+import sys
+import time
+import unittest
+
+import arduinocomms
+import arduinoemulator
+import arduinorobot
+
+# arduinoproxy parses the command line when imported
+_argv, sys.argv = sys.argv, sys.argv[:1]
+try:
+    import arduinoproxy
+finally:
+    sys.argv = _argv
+
+class Message():
+    """
+    An MQTT message (as passed to on_message).
+    """
+    def __init__( self, payload ):
+        self.topic   = "/mollie-robot/target"
+        self.qos     = 0
+        self.payload = payload
+
+class CommandsTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.published = []
+        self.robot    = arduinorobot.ArduinoRobot()
+        self.robot.mqrobot.update = self.published.append
+        self.emulator = arduinoemulator.ArduinoEmulator( None )
+        self.emulator.start()
+        self.fd       = os.open( self.emulator.name, os.O_RDWR | os.O_NOCTTY )
+        self.proxy    = None
+        self.lines    = []
+
+    def tearDown( self ):
+        if self.proxy is not None:
+            self.proxy.arduino.close()
+        os.close( self.fd )
+        self.emulator.close()
+
+    def connect( self, protocol = "json", maxrate = None ):
+        self.proxy = arduinoproxy.ArduinoProxy(
+            arduinocomms.ArduinoComms( protocol = protocol,
+                                       maxrate  = maxrate,
+                                       port     = self.fd ) )
+        self.proxy.arduino.setcallback( self.lines.append )
+
+    def publish( self ):
+        """
+        Pass the published commands from the robot to the proxy.
+        """
+        for payload in self.published:
+            self.proxy.mqrobot._on_message( None, None, Message( payload ) )
+        del self.published[:]
+
+    def wait( self, commands ):
+        deadline = time.time() + 2.0
+        while self.emulator.commands < commands and time.time() < deadline:
+            time.sleep( 0.01 )
+        time.sleep( 0.05 )
+
+    def test_track_is_json( self ):
+        self.robot.Track( 10, -20 )
+        self.assertEqual( json.loads( self.published[0] ), {"track": [10, -20]} )
+
+    def test_proxy_command( self ):
+        self.connect()
+        self.assertEqual( self.proxy.command( {"track": [1, 2]} ),
+                          {"track": [1, 2]} )
+        self.assertEqual( self.proxy.command( {"track": [1, 2], "head": [3, 4]} ),
+                          {"track": [1, 2], "target": {"head": [3, 4]}} )
+        self.assertEqual( self.proxy.command( {"setspeed": [5, 5]} ),
+                          {"target": {"setspeed": [5, 5]}} )
+
+    def check_track( self, protocol ):
+        self.connect( protocol )
+        self.robot.Track( 10, -20 )
+        self.publish()
+        self.wait( 1 )
+        self.assertEqual( self.emulator.errors, 0 )
+        self.assertEqual( self.emulator.head, [-2.0, -4.0] )
+        self.assertFalse( [line for line in self.lines
+                           if not isinstance( line, dict ) and "unknown key" in line] )
+
+    def test_track_json( self ):
+        self.check_track( "json" )
+
+    def test_track_binary( self ):
+        self.check_track( "binary" )
+        self.assertTrue( self.proxy.arduino.binary )
+
+    def test_track_coalesced( self ):
+        self.connect( maxrate = 10 )
+        for i in range( 50 ):
+            self.robot.Track( 10, -20 )
+        self.publish()
+        scheduler = self.proxy.arduino.scheduler
+        scheduler.close()
+        self.wait( scheduler.sent )
+        self.assertEqual( scheduler.commands, 50 )
+        self.assertTrue( scheduler.superseded > 0 )
+        self.assertTrue( scheduler.sent < 50 )
+        self.assertEqual( self.emulator.commands, scheduler.sent )
+        self.assertEqual( self.emulator.errors, 0 )
+
+if __name__ == "__main__":
+    unittest.main()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
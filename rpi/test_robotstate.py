@@ -0,0 +1,75 @@
+"""
+Test decoding the robot state, and malformed state lines from the Arduino.
+"""
+
+from __future__ import print_function
+import os
+import time
+import tty
+import unittest
+
+import arduinocomms
+import robotstate
+
+class RobotStateTest( unittest.TestCase ):
+
+    def test_update( self ):
+        state = robotstate.RobotState()
+        d = state.update( '{"head":[10.50,-3.00],"counts":[12,13],"time":1.5}\r\n' )
+        self.assertEqual( d["counts"], [12, 13] )
+        self.assertEqual( state.head, [10.5, -3.0] )
+        self.assertEqual( state.listofvalues(),
+                          [1.5, 10.5, -3.0, 0, 0, 0, 0, 12, 13, 0, 0, 0.2, 0.0, 0.0] )
+
+    def test_payload( self ):
+        # An MQTT payload is bytes on python 3
+        state = robotstate.RobotState()
+        state.update( b'{"speed":[4.5,4.5],"time":12.8}' )
+        self.assertEqual( state.speed, [4.5, 4.5] )
+        self.assertEqual( state.time, 12.8 )
+
+    def test_target( self ):
+        state = robotstate.RobotState( pid = (0.7, 0.0, 0.0) )
+        state.state( {"target": {"setspeed": [5, 6]}, "track": [1, 2]} )
+        self.assertEqual( state.setspeed, [5, 6] )
+        self.assertEqual( state.pid, [0.7, 0.0, 0.0] )
+
+    def test_malformed( self ):
+        state = robotstate.RobotState()
+        for line in ('{"head":3}', '{"head":null}', '{"head":{"x":1,"y":2}}',
+                     '{"pid":[1,2]}', '[1,2]', '{"head":[1,', 'Free SRAM'):
+            self.assertRaises( ValueError, state.update, line )
+        self.assertEqual( len( state.listofvalues() ), len( state.listofkeys() ) )
+        self.assertRaises( ValueError, setattr, state, "speed", 1 )
+
+class MalformedLineTest( unittest.TestCase ):
+
+    def test_serialmonitor_survives( self ):
+        master, slave = os.openpty()
+        tty.setraw( slave )
+        try:
+            os.write( master, b"Robot ready for config\r\n" )
+            monitor = arduinocomms.SerialMonitor( "pty", 115200, port = slave )
+            state   = robotstate.RobotState()
+            monitor.setcallback( state.update )
+            os.write( master, b'{"head":null,"time":1.0}\r\n'
+                              b'{"setspeed":7,"time":2.0}\r\n'
+                              b'{"head":[4.00,5.00],"time":3.0}\r\n' )
+            deadline = time.time() + 2.0
+            while state.time != 3.0 and time.time() < deadline:
+                time.sleep( 0.01 )
+            self.assertTrue( monitor.is_alive() )
+            self.assertEqual( state.head, [4.0, 5.0] )
+            monitor.close()
+        finally:
+            os.close( master )
+            os.close( slave )
+
+if __name__ == "__main__":
+    unittest.main()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,129 @@
+"""
+Test the SerialMonitor transport over a pty.
+
+The test plays the Arduino on the master side of the pty, and the
+SerialMonitor reads and writes the slave side.
+"""
+
+from __future__ import print_function
+import os
+import select
+import socket
+import time
+import tty
+import unittest
+
+import arduinocomms
+
+class SerialMonitorTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.master, self.slave = os.openpty()
+        tty.setraw( self.slave )        # No echo or newline translation
+        self.messages = []
+        # The Arduino is ready before the monitor starts
+        os.write( self.master, b"Robot ready for config\r\n" )
+        self.monitor = arduinocomms.SerialMonitor( "pty", 115200,
+                                                   port = self.slave )
+        self.monitor.setcallback( self.messages.append )
+
+    def tearDown( self ):
+        if self.monitor.is_alive():
+            self.monitor.close()
+        for fd in (self.master, self.slave):
+            try:
+                os.close( fd )
+            except OSError:
+                pass
+
+    def wait( self, condition, timeout = 2.0 ):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep( 0.01 )
+        return condition()
+
+    def readmaster( self, length, timeout = 2.0 ):
+        """
+        Read length bytes written by the monitor to the pty.
+        """
+        data     = b""
+        deadline = time.time() + timeout
+        while len( data ) < length and time.time() < deadline:
+            readable, _, _ = select.select( [self.master], [], [], 0.05 )
+            if readable:
+                data += os.read( self.master, 4096 )
+        return data
+
+    def test_split_lines_and_frames( self ):
+        frame = arduinocomms.encodeframe(
+            arduinocomms.FRAME_STATE,
+            arduinocomms.statetime.pack( 1234, 1 ) +
+            arduinocomms.statefields[0][1].pack( 1.5, -2.5 ) )
+        data  = b"first line\n" + frame + b"second line\n"
+        # Write the input a few bytes at a time
+        for i in range( 0, len( data ), 3 ):
+            os.write( self.master, data[i:i + 3] )
+            time.sleep( 0.002 )
+        self.assertTrue( self.wait( lambda: len( self.messages ) >= 3 ) )
+        self.assertEqual( self.messages[0], "first line\n" )
+        self.assertEqual( self.messages[1]["time"], 1.234 )
+        self.assertEqual( self.messages[1]["head"], [1.5, -2.5] )
+        self.assertEqual( self.messages[2], "second line\n" )
+        self.assertEqual( self.monitor.errors, 0 )
+
+    def test_batched_writes( self ):
+        lines = [("{\"track\":[%d,0]}\n" % i).encode( "latin-1" )
+                 for i in range( 200 )]
+        for line in lines:
+            self.monitor.write( line )
+        expected = b"".join( lines )
+        self.assertEqual( self.readmaster( len( expected ) ), expected )
+        self.assertTrue( self.monitor.writes < len( lines ) )
+
+    def test_callback_error( self ):
+        def callback( message ):
+            self.messages.append( message )
+            if message.startswith( "bad" ):
+                raise KeyError( message )
+        self.monitor.setcallback( callback )
+        os.write( self.master, b"bad line\ngood line\n" )
+        self.assertTrue( self.wait( lambda: len( self.messages ) >= 2 ) )
+        self.assertEqual( self.messages[1], "good line\n" )
+        self.assertTrue( self.monitor.is_alive() )
+
+    def test_close( self ):
+        start = time.time()
+        self.monitor.close()
+        self.assertFalse( self.monitor.is_alive() )
+        self.assertTrue( time.time() - start < 0.5 )
+
+    def test_write_after_hangup( self ):
+        # Closing the other end of the pty stops the monitor
+        os.close( self.master )
+        self.assertTrue( self.wait( lambda: not self.monitor.is_alive() ) )
+        self.assertEqual( self.monitor.write( b"{\"track\":[0,0]}\n" ), 0 )
+
+    def test_write_error( self ):
+        # Writes to a shut down socket fail (EPIPE): the monitor reports the
+        # error and stops instead of dying with the output queued
+        port, arduino = socket.socketpair()
+        try:
+            arduino.sendall( b"Robot ready for config\r\n" )
+            monitor = arduinocomms.SerialMonitor( "socket", 115200, port = port )
+            port.shutdown( socket.SHUT_WR )
+            monitor.write( b"{\"track\":[0,0]}\n" )
+            self.assertTrue( self.wait( lambda: not monitor.is_alive() ) )
+            self.assertEqual( monitor.unwritten, b"" )
+            self.assertEqual( monitor.write( b"{\"track\":[0,0]}\n" ), 0 )
+        finally:
+            port.close()
+            arduino.close()
+
+if __name__ == "__main__":
+    unittest.main()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -0,0 +1,86 @@
+"""
+Test the shutdown of the WorkerPool batch workers, and the LatestCommit.
+"""
+
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+import workflow
+
+def failingbatch( batch ):
+    raise RuntimeError( "failingbatch: %d items" % len( batch ) )
+
+class BatchShutdownTest( unittest.TestCase ):
+
+    def drain( self, queue ):
+        items = []
+        while True:
+            try:
+                items.append( queue.get( timeout=1.0 ) )
+            except Queue.Empty:
+                return items
+            if items[-1] is workflow.Worker.sentinel:
+                return items
+
+    def check_shutdown( self, processor ):
+        inputqueue  = Queue.Queue()
+        outputqueue = Queue.Queue()
+        for item in (1, 2, 3, workflow.Worker.sentinel):
+            inputqueue.put( item )
+        # The one worker takes the items and the sentinel in one batch
+        pool = workflow.WorkerPool( 1, processor, inputqueue, outputqueue,
+                                    batchsize = 10 )
+        for worker in pool.workers:
+            worker.join( 2.0 )
+            self.assertFalse( worker.is_alive() )
+        self.assertEqual( self.drain( outputqueue ),
+                          [1, 2, 3, workflow.Worker.sentinel] )
+        # The sentinel is put back for the other workers
+        self.assertTrue( inputqueue.get_nowait() is workflow.Worker.sentinel )
+
+    def test_sentinel_in_batch( self ):
+        self.check_shutdown( lambda batch: None )
+
+    def test_processor_raises_on_sentinel_batch( self ):
+        self.check_shutdown( failingbatch )
+
+class LatestCommitTest( unittest.TestCase ):
+
+    def test_newest_in_order( self ):
+        committed = []
+        started   = threading.Event()
+        release   = threading.Event()
+        def commit( value ):
+            started.set()
+            release.wait( 2.0 )
+            committed.append( value )
+        committer = workflow.LatestCommit( commit )
+        self.assertTrue( committer( 1, "one" ) )
+        started.wait( 2.0 )
+        # The commit thread is busy: the workers do not wait for it
+        starttime = time.time()
+        self.assertTrue( committer( 3, "three" ) )
+        self.assertTrue( committer( 4, "four" ) )
+        self.assertFalse( committer( 2, "two" ) )
+        self.assertTrue( time.time() - starttime < 0.5 )
+        release.set()
+        committer.close()
+        self.assertEqual( committed, ["one", "four"] )
+        self.assertEqual( (committer.committed, committer.superseded,
+                           committer.discarded), (2, 1, 1) )
+
+if __name__ == "__main__":
+    unittest.main()
+
+# Local Variables:
+# python-indent: 4
+# tab-width: 4
+# indent-tabs-mode: nil
+# End:
@@ -21,6 +21,7 @@ import arduinocomms
 import arduinorobot
 import colourtracker
 import cameracapture
+import processpool
 import workflow
 
 class TrackingRobot():
@@ -32,7 +33,10 @@ class TrackingRobot():
     run() : 
     """
     def __init__( self, robot, tracker, camera,
-                  showimages = False, showpreview = False ):
+                  showimages = False, showpreview = False,
+                  captureformat = "jpeg", predictor = None, streamer = None,
+                  processes = 0, threads = 2, queuesize = 0, maxage = None,
+                  metrics = None, pipeline = None ):
         """
         Construct a robot which tracks objects using the RPI camera.
 
@@ -40,24 +44,144 @@ class TrackingRobot():
             robot   (ArduinoRobot): Interface to the arduino-controlled robot
             tracker (ColourTracker): The object tracking class.
             camera: (PiCamera.picamera): Raspberry Pi Camera instance
+            captureformat (str): Camera capture format: "jpeg", "yuv" or "bgr"
+            predictor (TargetPredictor): Optional latency compensation for tracking
+            streamer (MJPEGStreamer): Stream the images over http (instead of
+                                      showing them in a window)
+            processes (int): Track images in this many worker processes (with
+                             the images in shared memory) instead of threads
+            threads (int): Number of threads for the image tracking
+            queuesize (int): Keep only the newest queuesize images waiting for
+                             tracking - the older images are dropped
+                             (0: unbounded, 1: the latest image wins)
+            maxage (float): Drop images older than maxage seconds when they
+                            are taken for tracking (None: no limit)
+            metrics (float): Print the workflow metrics every metrics seconds
+            pipeline (dict): Optional description of the image processing
+                             pipeline (see workflow.buildpipeline()) - it must
+                             have "camera" (free Images) and "processing"
+                             (captured Images) queues
+                             (default: built from the arguments above)
         """
         self.robot           = robot
         self.tracker         = tracker
         self.camera          = camera
         self.showimages      = showimages
         self.showpreview     = showpreview
+        self.captureformat   = captureformat
+        self.predictor       = predictor
+        self.streamer        = streamer
+        self.processes       = processes
+        self.threads         = threads
+        self.queuesize       = queuesize
+        self.metrics         = metrics
 
         self.done            = False
-        self.cameraqueue     = Queue.Queue()
-        self.processingqueue = Queue.Queue()
-        self.displayqueue    = Queue.Queue( 1 )
+        # Send only the newest tracking results to the robot (from one thread)
+        self.committer       = workflow.LatestCommit( self.sendtrack )
+        self.pipeline        = pipeline or self.defaultpipeline( queuesize, maxage )
+        self.queues          = {}
         self.workflow        = None
         self.capture         = None
 
+    def defaultpipeline( self, queuesize, maxage ):
+        """
+        Return the description of the image processing pipeline:
+        - "tracking" stage: track the captured Images (and put them on the
+          display queue)
+        - "display" or "stream" stage: if showing the images
+        Images dropped as stale are recycled straight back to the camera.
+        """
+        stages = [
+            {"name": "tracking", "processor": "imagetracking",
+             "workers": self.threads,
+             "input": "processing", "output": "camera", "side": ["display"]}
+            ]
+        if self.showimages and self.streamer is not None:
+            # Images are recycled as soon as they are copied for streaming
+            stages.append(
+                {"name": "stream", "processor": "streamimage", "workers": 1,
+                 "input": "display", "output": None, "side": ["camera"]} )
+        elif self.showimages:
+            stages.append(
+                {"name": "display", "processor": "displayimage", "workers": 1,
+                 "input": "display", "output": "camera"} )
+        return {
+            "queues": {
+                "camera":     {},
+                "processing": {"capacity": queuesize, "maxage": maxage,
+                               "overflow": "dropoldest" if queuesize else "block",
+                               "recycle": "camera"},
+                # Only display one image at a time - skip the others
+                "display":    {"capacity": 1, "overflow": "dropnewest",
+                               "recycle": "camera"},
+                },
+            "stages": stages,
+            }
+
+    def imagecount( self, workers ):
+        """
+        Return the number of Images the pipeline needs so the camera is not
+        starved: one being captured, one for each worker and one for each
+        place in the queues.
+        """
+        queues = self.pipeline.get( "queues", {} )
+        return 1 + workers + sum( max( (spec or {}).get( "capacity", 0 ), 1 )
+                                  for name, spec in queues.items()
+                                  if name != "camera" )
+
     def displayimage( self, image ):
         self.tracker.Showimage( image )
         return image
 
+    def streamimage( self, image, otherqueues ):
+        """
+        Annotate a copy of the image and publish it to the MJPEG stream.
+
+        The Image is recycled (on otherqueues[0]) as soon as it is copied, so
+        the jpeg encode does not hold it out of the capture loop.
+        """
+        img = None
+        if image.img is not None:
+            img = image.img.copy()
+            self.tracker.Annotate( image, img )
+        otherqueues[0].put( image )
+        if img is not None:
+            self.streamer.publish( img )
+        return None
+
+    def committrack( self, image, found ):
+        """
+        Queue the tracking result of an image to send to the robot.
+
+        Arguments:
+            image (Image): The tracked image
+            found (bool):  Was the object found in the image?
+        """
+        # The Image is recycled: pass on its results (sent later)
+        self.committer( image.sequence, image.time, image.track, found )
+
+    def sendtrack( self, imagetime, track, found ):
+        """
+        Send the position of the tracked object in an image to the robot.
+
+        Arguments:
+            imagetime (float): The capture time of the image
+            track (tuple):     The (x, y, area) of the object in the image
+            found (bool):      Was the object found in the image?
+        """
+        if found:
+            if self.predictor is not None:
+                # Where the object will be when the robot gets the command
+                track = self.predictor.update( imagetime, track )
+            # Send the coordinates to the robot - if we found our target
+            self.robot.TrackObject( *track )
+        elif self.predictor is not None:
+            # Keep tracking where we expect the object to be for a short time
+            track = self.predictor.coast( imagetime )
+            if track is not None:
+                self.robot.TrackObject( *track )
+
     # The function to process each captured image
     # Process each image to identify location of object
     # Send the location of the object to the arduino
@@ -73,12 +197,11 @@ class TrackingRobot():
         if image is None:
             return None
         # Get the position of the object being tracked
-        if self.tracker.Track( image ):
-            # Send the coordinates to the robot - if we found our target
-            self.robot.TrackObject( *image.track )
+        # - the workers run in parallel: send only the newest results
+        self.committrack( image, self.tracker.Track( image ) )
         if self.showimages:
             try:
-                # Put on the display queue - unless it is full (only takes one).
+                # Put on the display queue - unless it is full.
                 otherqueues[0].put_nowait( image )
                 return None
             except Queue.Full:
@@ -92,33 +215,29 @@ class TrackingRobot():
 
         Setups up and executes the multi-threaded image capture and processing.
         """
+        if self.processes:
+            return self._runprocesses()
+
         # Create a workflow to process images which appear on processingqueue
         self.workflow = workflow.WorkflowManager(
-            [
-                workflow.WorkerPool(
-                    2,                    # Number of worker threads
-                    self.imagetracking,   # Function to process the image
-                    self.processingqueue, # Input queue for Images
-                    self.cameraqueue,     # Output queue for Images
-                    (self.displayqueue,)  # Queue for displaying images
-                ),
-                workflow.WorkerPool(
-                    1,                    # Number of worker threads
-                    self.displayimage,    # Function to display the image
-                    self.displayqueue,    # Input queue for Images to display
-                    self.cameraqueue      # Output queue to recycle Images
-                ) if self.showimages else None
-            ]
+            self.pipeline,
+            self.metrics,                 # Period to print the metrics
+            processors = self             # The stage processors are our methods
         )
+        self.queues = self.workflow.queues
 
         # Start the Camera capture - will run in it's own thread.
         # Captured images will be placed on processingqueue
         # to be processed by self.workflow.
+        workers = sum( stage.get( "workers", 1 )
+                       for stage in self.pipeline.get( "stages", [] ) )
         self.capture = cameracapture.CameraCapture(
             self.camera,
-            self.cameraqueue,
-            self.processingqueue,
-            self.showpreview
+            self.queues["camera"],
+            self.queues["processing"],
+            self.showpreview,
+            self.captureformat,
+            count = self.imagecount( workers )
         ) if self.camera is not None else None
 
         # Diagnostic: Print all the threads we have started.
@@ -126,6 +245,39 @@ class TrackingRobot():
             print( t )
         print( '' )
 
+    def _runprocesses( self ):
+        """
+        Run the image capture with the tracking in a pool of processes.
+
+        Images are captured into a ring of shared memory frames, and the
+        tracking results are sent to the robot from the pool's results thread.
+        """
+        self.queues = workflow.buildqueues( self.pipeline.get( "queues", {} ) )
+        frames = processpool.SharedFrames( self.imagecount( self.processes ),
+                                           self.camera.resolution,
+                                           self.captureformat )
+        self.workflow = workflow.WorkflowManager(
+            [
+                processpool.ProcessPool(
+                    self.processes,       # Number of worker processes
+                    self.tracker,         # The tracker to run in each process
+                    frames,               # The shared memory for the Images
+                    self.queues["processing"], # Input queue for Images
+                    self.queues["camera"],     # Output queue for Images
+                    self.committrack      # Send the results to the robot
+                )
+            ],
+            self.metrics                  # Period to print the metrics
+        )
+        self.capture = cameracapture.CameraCapture(
+            self.camera,
+            self.queues["camera"],
+            self.queues["processing"],
+            self.showpreview,
+            self.captureformat,
+            frames.images()
+        )
+
     def loop( self ):
         """
         Main execution loop for the robot.
@@ -143,7 +295,15 @@ class TrackingRobot():
         if self.capture is not None:
             self.capture.close()
         self.workflow.close()
+        self.committer.close()
+        self.committer.report()
+        for name, queue in sorted( self.queues.items() ):
+            if isinstance( queue, workflow.FreshQueue ):
+                print( 'Queue %s:' % name, end=' ' )
+                queue.report()
         self.tracker.close()
+        if self.streamer is not None:
+            self.streamer.close()
         s = time.time()
         while threading.active_count() > 2:
             t = time.time()
@@ -1,7 +1,75 @@
+from __future__ import print_function
 import io
+import bisect
 import time
 import threading
-import Queue
+try:
+    import Queue
+except ImportError:                             # Python 3 (eg. asyncworkflow)
+    import queue as Queue
+
+class Histogram():
+    """
+    A histogram with fixed buckets: cheap enough to add every item to, and
+    gives percentiles at any time while running.
+
+    The default buckets are for times: geometric steps of 25% from 0.1ms up
+    to about a minute (so the percentiles are good to 25%).
+    """
+    timebounds  = [0.0001 * 1.25 ** i for i in range( 60 )]
+    # Integer buckets for queue depths
+    depthbounds = list( range( 64 ) )
+
+    def __init__( self, bounds = None ):
+        """
+        Args:
+        - bounds:   Sorted list of the upper bounds of the buckets
+        """
+        self.bounds = self.timebounds if bounds is None else bounds
+        self.counts = [0] * (len( self.bounds ) + 1)
+        self.count  = 0
+        self.total  = 0.0
+
+    def add( self, value ):
+        self.counts[bisect.bisect_left( self.bounds, value )] += 1
+        self.count += 1
+        self.total += value
+
+    def merge( self, other ):
+        """
+        Add the counts of another histogram (with the same buckets) to this one.
+        """
+        self.counts = [a + b for a, b in zip( self.counts, other.counts )]
+        self.count += other.count
+        self.total += other.total
+        return self
+
+    def percentile( self, p ):
+        """
+        Return the upper bound of the bucket holding the p'th percentile
+        (or None if the histogram is empty).
+        """
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate( self.counts ):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[min( i, len( self.bounds ) - 1 )]
+        return self.bounds[-1]
+
+    def summary( self ):
+        """
+        Return a dict of the count, mean, p50, p95 and p99 of the histogram.
+        """
+        return {
+            "count": self.count,
+            "mean":  self.total / self.count if self.count else None,
+            "p50":   self.percentile( 50 ),
+            "p95":   self.percentile( 95 ),
+            "p99":   self.percentile( 99 ),
+            }
 
 class Worker( threading.Thread ):
     """
@@ -9,15 +77,55 @@ class Worker( threading.Thread ):
     """
     sentinel = object()
 
-    def __init__( self, processor, inputqueue, outputqueue, otherqueues = None ):
+    def __init__( self, processor, inputqueue, outputqueue, otherqueues = None,
+                  batchsize = None, batchwindow = None ):
         super( Worker, self ).__init__()
         self.processor      = processor
         self.inputqueue     = inputqueue
         self.outputqueue    = outputqueue
         self.otherqueues    = otherqueues
+        self.batchsize      = batchsize
+        self.batchwindow    = batchwindow
         self.count          = 0
+        self.processing     = Histogram()                     # Processing times
+        self.depths         = Histogram( Histogram.depthbounds ) # Input queue depths
+        self.busytime       = 0.0
+        self.idletime       = 0.0
         self.start()
 
+    def _getbatch( self, item ):
+        """
+        Return a batch of up to batchsize items starting with item: the items
+        already queued, or those arriving within batchwindow seconds.
+        Returns (batch, True if the sentinel was found).
+        """
+        batch    = [item]
+        deadline = (time.time() + self.batchwindow
+                    if self.batchwindow is not None else None)
+        while len( batch ) < self.batchsize:
+            try:
+                if deadline is None:
+                    item = self.inputqueue.get_nowait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    item = self.inputqueue.get( timeout=remaining )
+            except Queue.Empty:
+                break
+            if item is self.sentinel:
+                return batch, True
+            batch.append( item )
+        return batch, False
+
+    def _finish( self ):
+        # Put the sentinel back on the queue and end this worker thread.
+        #  - need to put it back so other threads will also find it and terminate.
+        self.inputqueue.put( self.sentinel )
+        # Also pass the sentinel down the processing pipeline
+        if (self.outputqueue is not None):
+            self.outputqueue.put( self.sentinel )
+
     def run( self ):
         """
         Extract items off input queue, process, and then put on the output queue.
@@ -28,15 +136,27 @@ class Worker( threading.Thread ):
         """
         while True:
            # Wait for an item to appear on the processing queue
+            starttime = time.time()
             item = self.inputqueue.get()
+            pickuptime = time.time()
+            self.idletime += pickuptime - starttime
+            self.depths.add( self.inputqueue.qsize() )
             # If this is a sentinel - put it back on the queue and end this worker thread.
-            #  - need to put it back so other threads will also find it and terminate.
             if (item is self.sentinel):
-                self.inputqueue.put( self.sentinel )
-                # Also pass the sentinel down the processing pipeline
-                if (self.outputqueue is not None):
-                    self.outputqueue.put( self.sentinel )
+                self._finish()
                 break
+            if self.batchsize is not None:
+                batch, finished = self._getbatch( item )
+                try:
+                    self._processbatch( batch, pickuptime )
+                finally:
+                    # The sentinel was taken into the batch: pass it on
+                    # even if the processor raised
+                    if finished:
+                        self._finish()
+                if finished:
+                    break
+                continue
             try:
                 # Do the processing
                 if self.otherqueues is not None:
@@ -45,10 +165,36 @@ class Worker( threading.Thread ):
                     item = self.processor( item )
                 self.count += 1
             finally:
+                processingtime = time.time() - pickuptime
+                self.busytime += processingtime
+                self.processing.add( processingtime )
                 # Put the item on the output queue
                 if (self.outputqueue is not None):
                     self.outputqueue.put( item )
 
+    def _processbatch( self, batch, pickuptime ):
+        """
+        Process a batch of items and put them on the output queue in order.
+        """
+        items = batch
+        try:
+            # The processor returns the list of items to pass on
+            # (or None to pass on the batch)
+            if self.otherqueues is not None:
+                items = self.processor( batch, self.otherqueues )
+            else:
+                items = self.processor( batch )
+            if items is None:
+                items = batch
+            self.count += len( batch )
+        finally:
+            processingtime = time.time() - pickuptime
+            self.busytime += processingtime
+            self.processing.add( processingtime )
+            if (self.outputqueue is not None):
+                for item in items:
+                    self.outputqueue.put( item )
+
     def close( self ):
         # Put a sentinel on the end of the work queue
         # - Worker thread will close when it is received.
@@ -59,7 +205,8 @@ class WorkerPool():
     A pool of threads to process items off a queue...
     """
     def __init__( self, numberofworkers, processor,
-                  inputqueue, outputqueue, otherqueues = None ):
+                  inputqueue, outputqueue, otherqueues = None, name = None,
+                  batchsize = None, batchwindow = None ):
         """
         Create a pool of Worker threads for processing items on queues.
         
@@ -72,13 +219,26 @@ class WorkerPool():
         - outputqueue:      The queue to put processed items on when finished
         - otherqueues:      Optional list/tuple of queues: passed to processor function
                             - The processor function may use these to run new workflows
+        - name:             Name of the pool for the metrics
+                            (default: the name of the processor function)
+        - batchsize:        Optional maximum number of items in a batch: the
+                            processor is called with a list of items (the ones
+                            already queued) and returns the list of items to
+                            put on the outputqueue (None: the same items)
+        - batchwindow:      Optional time (seconds) to wait for a batch to fill
+                            (default: don't wait for more items)
         """
+        self.name            = name or getattr( processor, "__name__", "pool" )
         self.numberofworkers = numberofworkers
         self.processor       = processor
         self.inputqueue      = inputqueue
         self.outputqueue     = outputqueue
         self.otherqueues     = otherqueues
+        self.batchsize       = batchsize
+        self.batchwindow     = batchwindow
         self.workers         = []
+        self.retired         = []    # Workers which died (for the metrics)
+        self.closing         = False
         # Now create the Worker threads
         self.addworkers( numberofworkers )
 
@@ -91,45 +251,449 @@ class WorkerPool():
         """
         for i in range( numberofworkers ):
             self.workers.append( Worker( self.processor, self.inputqueue,
-                                         self.outputqueue, self.otherqueues ) )
+                                         self.outputqueue, self.otherqueues,
+                                         self.batchsize, self.batchwindow ) )
 
     def count( self ):
         """
         Get the number of items processed by all the workers in this pool.
         """
-        return sum( (worker.count for worker in self.workers) )
+        return sum( (worker.count for worker in self.workers + self.retired) )
+
+    def supervise( self ):
+        """
+        Replace any worker threads which have died (eg. from an exception).
+
+        Returns the number of workers replaced.
+        """
+        if self.closing:
+            return 0
+        dead = [worker for worker in self.workers if not worker.is_alive()]
+        for worker in dead:
+            print( 'WorkerPool %s: replacing a dead worker' % self.name )
+            self.workers.remove( worker )
+            self.retired.append( worker )
+        self.addworkers( len( dead ) )
+        return len( dead )
+
+    def snapshot( self ):
+        """
+        Return the metrics for the pool (while running) as a dict:
+        - count:      Number of items processed
+        - processing: Summary of the processing time per item
+        - wait:       Summary of the time items waited on the input queue
+                      (if it is a MeteredQueue)
+        - depth:      Summary of the input queue depth seen at each pickup
+        - queued:     The input queue depth now
+        - busy:       Fraction of the time the workers were busy
+        """
+        processing = Histogram()
+        depths     = Histogram( Histogram.depthbounds )
+        busytime   = idletime = 0.0
+        for worker in self.workers + self.retired:
+            processing.merge( worker.processing )
+            depths.merge( worker.depths )
+            busytime += worker.busytime
+            idletime += worker.idletime
+        waits = getattr( self.inputqueue, "waits", None )
+        return {
+            "name":       self.name,
+            "count":      self.count(),
+            "processing": processing.summary(),
+            "wait":       waits.summary() if waits is not None else None,
+            "depth":      depths.summary(),
+            "queued":     self.inputqueue.qsize(),
+            "busy":       (busytime / (busytime + idletime)
+                           if busytime + idletime > 0 else 0.0),
+            }
 
     def close( self ):
         """
         Flag all the worker threads to finish processing the queues and close down.
         """
         # Tell all the worker threads to wind up and close down.
+        self.closing = True
         for worker in self.workers:
             worker.close()
         # Wait for the worker threads to terminate.
         for worker in self.workers:
             worker.join()
 
+class MeteredQueue( Queue.Queue ):
+    """
+    A Queue.Queue which records how long each item waits in the queue
+    (in the "waits" Histogram).
+    """
+    def __init__( self, maxsize = 0 ):
+        Queue.Queue.__init__( self, maxsize )
+        self.waits = Histogram()
+
+    def put( self, item, block = True, timeout = None ):
+        if item is Worker.sentinel:
+            # Never block the shutdown of a pipeline on a full queue
+            with self.mutex:
+                self._put( item )
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+            return
+        Queue.Queue.put( self, item, block, timeout )
+
+    # The items are queued as (put time, item)
+    # - these are called with the queue mutex held
+    def _put( self, item ):
+        Queue.Queue._put( self, (time.time(), item) )
+
+    def _get( self ):
+        puttime, item = Queue.Queue._get( self )
+        self.waits.add( time.time() - puttime )
+        return item
+
+class FreshQueue( MeteredQueue ):
+    """
+    A queue for the freshest items: when tracking falls behind the camera
+    the stale items are dropped, rather than processing a backlog of them.
+
+    - put() of an item to a full queue depends on the overflow policy:
+      - "dropoldest": the oldest items are dropped to make room
+                      (maxsize=1 keeps only the latest item)
+      - "dropnewest": the new item is dropped
+      - "block":      wait for room (as a Queue.Queue)
+    - get() drops items older than maxage seconds (by item.time).
+    Dropped items are put on the recycle queue (eg. back to the camera).
+    Only items with a time (eg. Images) are dropped - sentinels are kept.
+    """
+    overflows = ("block", "dropoldest", "dropnewest")
+
+    def __init__( self, maxsize = 1, recycle = None, maxage = None,
+                  overflow = "dropoldest" ):
+        """
+        Args:
+        - maxsize:  The maximum number of items in the queue (0 is unbounded)
+        - recycle:  Optional queue to put the dropped items on
+        - maxage:   Optional maximum age (seconds) of items taken off the queue
+        - overflow: What to do with an item put on a full queue
+        """
+        if overflow not in self.overflows:
+            raise ValueError( "FreshQueue: unknown overflow policy: %s" % overflow )
+        MeteredQueue.__init__( self, maxsize )
+        self.recycle    = recycle
+        self.maxage     = maxage
+        self.overflow   = overflow
+        self.dropped    = 0       # Count of items dropped when full
+        self.expired    = 0       # Count of items dropped as too old
+
+    def _droppable( self, item ):
+        return getattr( item, "time", None ) is not None
+
+    def _drop( self, item ):
+        if self.recycle is not None:
+            self.recycle.put( item )
+
+    def put( self, item, block = True, timeout = None ):
+        if self.overflow == "block":
+            return MeteredQueue.put( self, item, block, timeout )
+        dropped = []
+        with self.not_full:
+            full = self.maxsize > 0 and self._qsize() >= self.maxsize
+            if full and self.overflow == "dropnewest" and self._droppable( item ):
+                dropped.append( item )
+            else:
+                while (self.maxsize > 0 and self._qsize() >= self.maxsize and
+                       self._droppable( self.queue[0][1] )):
+                    dropped.append( self._get() )
+                self._put( item )
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+        self.dropped += len( dropped )
+        for old in dropped:
+            self._drop( old )
+
+    def get( self, block = True, timeout = None ):
+        while True:
+            item = MeteredQueue.get( self, block, timeout )
+            if (self.maxage is None or not self._droppable( item ) or
+                time.time() - item.time <= self.maxage):
+                return item
+            self.expired += 1
+            self._drop( item )
+
+    def report( self ):
+        """
+        Print the counts of the dropped items.
+        """
+        print( 'Dropped %d items when full and %d items too old'
+               % ( self.dropped, self.expired ) )
+
+def makequeue( capacity = 0, overflow = "block", recycle = None, maxage = None ):
+    """
+    Return a queue for a pipeline: a MeteredQueue, or a FreshQueue if items
+    may be dropped.
+
+    Args:
+    - capacity: The maximum number of items in the queue (0 is unbounded)
+    - overflow: What to do with an item put on a full queue:
+                "block", "dropoldest" or "dropnewest"
+    - recycle:  Optional queue to put the dropped items on
+    - maxage:   Optional maximum age (seconds) of items taken off the queue
+    """
+    if overflow == "block" and maxage is None:
+        return MeteredQueue( capacity )
+    return FreshQueue( capacity, recycle, maxage, overflow )
+
+def buildqueues( description ):
+    """
+    Build the queues of a pipeline description.
+
+    Args:
+    - description: Dict of {name: queue}, where each queue is a dict of the
+                   makequeue() args (recycle is the name of another queue)
+    Returns:
+        Dict of {name: queue}
+    """
+    queues = {}
+    for name, spec in description.items():
+        spec = dict( spec or {} )
+        spec.pop( "recycle", None )
+        queues[name] = makequeue( **spec )
+    for name, spec in description.items():
+        recycle = (spec or {}).get( "recycle" )
+        if recycle is not None:
+            if recycle not in queues:
+                raise ValueError( "Pipeline: queue %s recycles to unknown queue %s"
+                                  % (name, recycle) )
+            queues[name].recycle = queues[recycle]
+    return queues
+
+def buildpipeline( description, processors = None, queues = None ):
+    """
+    Build the queues and WorkerPools of a declarative pipeline description.
+
+    A description is plain data (so it may be loaded from a yaml/json file):
+        {
+          "queues": {                 # Each queue by name: see makequeue()
+              "camera":     {},
+              "processing": {"capacity": 1, "overflow": "dropoldest",
+                             "recycle": "camera", "maxage": 0.2},
+          },
+          "stages": [                 # Each stage is a WorkerPool
+              {"name": "tracking", "processor": "imagetracking", "workers": 2,
+               "input": "processing", "output": "camera",
+               "side": ["display"]},  # Optional side output queues
+              {"name": "log", "processor": "logimages",
+               "batchsize": 8,        # Optional batches (see WorkerPool)
+               "batchwindow": 0.1,
+               "input": "logging", "output": "camera"},
+          ],
+        }
+
+    Args:
+    - description: The pipeline description
+    - processors:  Object (or dict) to look up the processor names on
+    - queues:      Optional dict of queues already built for the description
+    Returns:
+        (dict of {name: queue}, list of WorkerPools)
+    """
+    if queues is None:
+        queues = buildqueues( description.get( "queues", {} ) )
+    def queue( name, stage ):
+        if name is None:
+            return None
+        if name not in queues:
+            raise ValueError( "Pipeline: stage %s uses unknown queue %s"
+                              % (stage, name) )
+        return queues[name]
+    pools = []
+    for stage in description.get( "stages", [] ):
+        name      = stage.get( "name" )
+        processor = stage["processor"]
+        if not callable( processor ):
+            processor = (processors[processor] if isinstance( processors, dict )
+                         else getattr( processors, processor ))
+        side = stage.get( "side" )
+        pools.append( WorkerPool(
+            stage.get( "workers", 1 ),
+            processor,
+            queue( stage["input"], name ),
+            queue( stage.get( "output" ), name ),
+            tuple( queue( q, name ) for q in side ) if side else None,
+            name,
+            stage.get( "batchsize" ),
+            stage.get( "batchwindow" ) ) )
+    return queues, pools
+
+class LatestCommit( threading.Thread ):
+    """
+    A single commit thread for the results of a pool of parallel workers.
+
+    The workers finish items in any order, so a slow older item may finish
+    after a newer one. The workers call the LatestCommit with the sequence
+    number of each result (eg. item.sequence) and it keeps only the newest:
+    a result older than the last one taken is discarded, and a newer result
+    replaces one still waiting to be committed. The thread calls commit()
+    with each result kept, so the results are committed in increasing
+    sequence (with gaps, never reordered) and the workers never wait on the
+    commit (eg. network I/O). It never waits for a missing result (which
+    may have been dropped), so more workers add no latency.
+    """
+    def __init__( self, commit ):
+        """
+        Args:
+        - commit:   The function to call with the args of each result kept
+                    - it is never called concurrently
+        """
+        super( LatestCommit, self ).__init__()
+        self.commit     = commit
+        self.condition  = threading.Condition()
+        self.last       = None    # Sequence number of the last result taken
+        self.pending    = None    # The args of the result waiting to commit
+        self.done       = False
+        self.daemon     = True
+        self.committed  = 0       # Count of results committed
+        self.discarded  = 0       # Count of results older than the last taken
+        self.superseded = 0       # Count of results replaced before commit
+        self.errors     = 0       # Count of commit() exceptions
+        self.start()
+
+    def __call__( self, sequence, *args ):
+        """
+        Queue the result (args) to commit, unless a newer result has already
+        been taken. The args are committed later on the commit thread, so
+        must not be changed by the caller (eg. not a recycled Image).
+
+        Returns True if the result was queued.
+        """
+        with self.condition:
+            if self.last is not None and sequence <= self.last:
+                self.discarded += 1
+                return False
+            if self.pending is not None:
+                self.superseded += 1
+            self.last    = sequence
+            self.pending = args
+            self.condition.notify()
+            return True
+
+    def run( self ):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.done:
+                    self.condition.wait()
+                if self.pending is None:
+                    break
+                args, self.pending = self.pending, None
+            try:
+                self.commit( *args )
+                self.committed += 1
+            except Exception as e:
+                # Keep the thread committing the newer results
+                self.errors += 1
+                print( "LatestCommit: commit() failed:", repr( e ) )
+
+    def close( self ):
+        """
+        Commit any waiting result and stop the thread.
+        """
+        with self.condition:
+            self.done = True
+            self.condition.notify()
+        self.join()
+
+    def report( self ):
+        """
+        Print the counts of the committed, superseded, discarded and failed
+        results.
+        """
+        print( 'Committed %d results: %d superseded by newer results, '
+               '%d discarded as out of order, %d failed'
+               % ( self.committed, self.superseded, self.discarded, self.errors ) )
+
 class WorkflowManager():
     """
     Manage the queues and threads for workflow.
     """
-    def __init__( self, workflow ):
+    def __init__( self, workflow, interval = None, publish = None,
+                  processors = None, supervise = 1.0 ):
         """
         Takes a workflow description and initiates tasks to process the workflow.
         
         Args:
-        workflow: A list/tuple of WorkerPool objects which comprise the workflow
+        workflow:   A list/tuple of WorkerPool objects which comprise the workflow
+                    or a pipeline description (see buildpipeline())
+        interval:   Optional period (seconds) to publish the metrics snapshot()
+        publish:    Function called with each snapshot() (default: print it)
+        processors: Object (or dict) to look up the processor names of a
+                    pipeline description on
+        supervise:  Period (seconds) to check for (and replace) dead workers
+                    (None: don't supervise)
         """
         self.starttime  = time.time()
         self.finishtime = None
+        self.queues     = {}
+        if isinstance( workflow, dict ):
+            self.queues, workflow = buildpipeline( workflow, processors )
         self.workflow   = workflow
+        self.publish    = publish or self.printsnapshot
+        self.done       = threading.Event()
+        self.monitor    = None
+        if interval or supervise:
+            self.monitor = threading.Thread( target=self._monitor,
+                                             args=(interval, supervise) )
+            self.monitor.daemon = True
+            self.monitor.start()
 
     def count( self ):
         # Return the number of items processed
         # - only count the items processed by the first pool of workers.
         return self.workflow[0].count() if self.workflow is not None else 0
 
+    def snapshot( self ):
+        """
+        Return a list of the metrics of each pool in the workflow (while running).
+        """
+        return [workerpool.snapshot() for workerpool in self.workflow
+                if workerpool is not None and hasattr( workerpool, "snapshot" )]
+
+    def _monitor( self, interval, supervise ):
+        # Publish the metrics every interval seconds, and supervise the
+        # workers every supervise seconds, until closed
+        period    = min( t for t in (interval, supervise) if t )
+        published = supervised = time.time()
+        while not self.done.wait( period ):
+            now = time.time()
+            if supervise and now - supervised >= supervise - 0.001:
+                supervised = now
+                self.supervise()
+            if interval and now - published >= interval - 0.001:
+                published = now
+                self.publish( self.snapshot() )
+
+    def supervise( self ):
+        """
+        Replace any workers which have died (eg. from an exception).
+
+        Returns the number of workers replaced.
+        """
+        return sum( workerpool.supervise() for workerpool in self.workflow
+                    if workerpool is not None and
+                    hasattr( workerpool, "supervise" ) )
+
+    @staticmethod
+    def printsnapshot( snapshot ):
+        """
+        Print a line of the metrics for each pool in a snapshot().
+        """
+        def ms( summary ):
+            if summary is None or not summary["count"]:
+                return "-"
+            return "%.1f/%.1f/%.1f" % tuple( 1000.0 * summary[p]
+                                             for p in ("p50", "p95", "p99") )
+        for pool in snapshot:
+            print( '%-14s %6d items  busy %3d%%  process %s ms  wait %s ms'
+                   '  depth p95 %s now %d'
+                   % ( pool["name"], pool["count"], 100 * pool["busy"],
+                       ms( pool["processing"] ), ms( pool["wait"] ),
+                       pool["depth"]["p95"], pool["queued"] ) )
+
     def report( self ):
         """
         Print a summary of the workflow statistics.
@@ -138,12 +702,16 @@ class WorkflowManager():
         count = self.count()
         print( 'Processed %d items in %d seconds at %.2ffps'
                % ( count, elapsedtime, count / elapsedtime ) )
+        self.printsnapshot( self.snapshot() )
 
     # Cleanup up all the worker threads
     def close( self ):
         """
         Close down the workflow processing threads.
         """
+        self.done.set()
+        if self.monitor is not None:
+            self.monitor.join()
         # Tell the worker threads to finish and wait for them to terminate...
         for workerpool in self.workflow:
             if workerpool is not None: